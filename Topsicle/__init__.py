@@ -1,2 +1,14 @@
 from Topsicle.allsteps import *
-from Topsicle.descriptive_plot import *
+
+# the plotting functions of descriptive_plot are loaded on first use, so importing Topsicle 
+# (and topsicle --help) does not import matplotlib and seaborn.
+# only its own names are looked up there, the others (check_file_type, patterns_to_search, ...) are also in allsteps
+PLOT_NAMES = ("descriptive_plot", "patterns_vs_match_heatmap", "colors")
+
+def __getattr__(name):
+    if name not in PLOT_NAMES:
+        raise AttributeError(f"module 'Topsicle' has no attribute '{name}'")
+    import importlib
+    descriptive_plot = importlib.import_module("Topsicle.descriptive_plot")
+    globals().update({key: getattr(descriptive_plot, key) for key in PLOT_NAMES})
+    return globals()[name]
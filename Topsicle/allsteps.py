@@ -1,5 +1,5 @@
 # Topsicle
-# input: fasta, fa.gz, fastq.gz, or fastq files
+# input: fasta, fa.gz, fastq.gz, or fastq files, or unaligned BAM
 # step 1: calculate Telomere-like Repeat Count (TRC) to identify read start / end has telomere 
 # Step 2: telomere length identified through mean values change of all telomere-like through window sliding 
 # Also have visualizations (density plot of mean window change)
@@ -9,26 +9,27 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import gzip
+import io
+import time
 import numpy as np
-import pandas as pd
-import Bio
-from Bio import SeqIO 
-from Bio.SeqIO.QualityIO import FastqGeneralIterator
+# pandas and Bio.SeqIO are imported in the functions that use them, they are slow to import 
+# and most runs (and every pool worker) do not need them
 
 # algo packages 
-import ruptures as rpt
 import re
+from Topsicle.changepoint import changepoints
+from Topsicle.kmercount import kmer_table, kmer_count_matrix, kmer_window_counts, is_plain_kmers, encode_seqs, word_counts, count_bounds, BOUND_WORD
+from Topsicle.approxscan import approx_patterns, approx_table, approx_count_matrix, approx_window_counts, is_approx_table
+from Topsicle.fastreader import iter_ends, record_ends, open_reads
+from Topsicle.bamreader import is_bam, open_bam, bam_reads
 
 # logging 
 import logging
 logging.basicConfig(level=logging.ERROR)
 import warnings
 
-# plotting
-import seaborn as sns
-import matplotlib.pyplot as plt
-colors = sns.color_palette("colorblind",n_colors=30)
-sns.set_style("whitegrid", {'grid.color': 'grey', 'grid.linestyle': '--'})
+# plotting, matplotlib and seaborn are only imported when something is plotted
+from Topsicle.plotstyle import pyplot, seaborn, palette
 
 version_number = "1.0.0"
 
@@ -36,6 +37,8 @@ version_number = "1.0.0"
 def check_file_type(filepath):
     open_func = gzip.open if filepath.endswith(".gz") else open
     try:
+        if is_bam(filepath):
+            return "bam"
         with open_func(filepath, "rt", encoding='utf-8') as handle:
             first_line = handle.readline().strip()
             if first_line.startswith("@"):
@@ -124,6 +127,15 @@ def patterns_to_search (telopattern, cut_length):
 
     return pattern_all
 
+def scan_patterns(telopattern, cut_length, max_errors=None):
+    '''
+    Patterns counted for one k-mer length: the k-mers of patterns_to_search, or with max_errors (--scanmode approx)
+    the whole repeat unit and its complement, matched with up to max_errors errors (see approxscan)
+    '''
+    if max_errors is None or isinstance(telopattern, list):
+        return patterns_to_search(telopattern, cut_length=cut_length)
+    return approx_patterns(telopattern)
+
 def unzip_file(filepath):
     """
     Read sequences from a FASTQ or FASTA file (compressed or uncompressed)
@@ -139,17 +151,363 @@ def unzip_file(filepath):
         logging.error("File type could not be determined or is unsupported.")
         return None
 
-    open_func = gzip.open if filepath.endswith(".gz") else open
+    from Bio import SeqIO
     try:
-        with open_func(filepath, "rt", encoding='utf-8') as handle:
+        with io.TextIOWrapper(open_reads(filepath), encoding='utf-8') as handle:
             for sequence in SeqIO.parse(handle, file_type):
                 yield sequence
     except Exception as e:
         logging.error(f"Error parsing file: {e}")
         #sys.exit("there is problem with input in", filepath, " Terminate.")
 
+# byte offset index of the subset file, so step 2 can seek straight to a read
+def write_read_subset(seq_loc, out_path, read_ids, seq_format, out_format, threads=None):
+    '''
+    Write the reads in read_ids from seq_loc to out_path, and a byte offset index next to it (out_path + ".idx")
+    seq_loc: str, location of the input file (fastq/fasta, can be .gz, or unaligned BAM)
+    out_path: str, location of the subset file, uncompressed
+    read_ids: set (or dict) of read names to keep
+    seq_format: format of the input, "fastq", "fasta" or "bam"
+    out_format: format of the subset file, "fastq" or "fasta" ("fastq" for bam)
+    threads: number of decompression threads for .gz and BAM input
+    return: dict of read name -> (byte offset, byte length) in out_path
+    '''
+    index = {}
+    offset = 0
+    # written under a temporary name, so an interrupted run never leaves a partial subset that a rerun would reuse
+    tmp_path = out_path + ".tmp"
+    if seq_format == "bam":
+        # only the reads kept are decoded, and written as 4 line fastq records
+        with open_bam(seq_loc, threads) as in_handle, open(tmp_path, "wb") as out_handle:
+            for read_id, seq, qual in bam_reads(in_handle, read_ids):
+                chunk = f"@{read_id}\n{seq}\n+\n{qual}\n".encode("utf-8")
+                out_handle.write(chunk)
+                if read_id not in index:
+                    index[read_id] = (offset, len(chunk))
+                offset += len(chunk)
+        write_read_index(out_path, index)
+        os.replace(tmp_path, out_path)
+        return index
+
+    from Bio import SeqIO
+    with io.TextIOWrapper(open_reads(seq_loc, threads), encoding="utf-8") as in_handle, open(tmp_path, "wb") as out_handle:
+        for record in SeqIO.parse(in_handle, seq_format):
+            if record.id in read_ids:
+                chunk = record.format(out_format).encode("utf-8")
+                out_handle.write(chunk)
+                if record.id not in index:  # keep the first one, same as scanning the file
+                    index[record.id] = (offset, len(chunk))
+                offset += len(chunk)
+    write_read_index(out_path, index)
+    os.replace(tmp_path, out_path)
+    return index
+
+def write_read_index(filepath, index):
+    '''
+    Save the byte offset index of filepath to filepath + ".idx", one read per line: read name, offset, length
+    '''
+    with open(filepath + ".idx", "w") as handle:
+        for read, (offset, length) in index.items():
+            handle.write(f"{read}\t{offset}\t{length}\n")
+
+def build_read_index(filepath):
+    '''
+    Scan an uncompressed fastq (4 lines per read, as written by SeqIO) or fasta file once and save its byte offset index
+    filepath: str, location of the subset file
+    return: dict of read name -> (byte offset, byte length)
+    '''
+    index = {}
+    file_type = check_file_type(filepath)
+    if not file_type or filepath.endswith(".gz"):
+        logging.error("Can only index uncompressed fastq or fasta file.")
+        return None
+
+    starts = []  # (read name, offset) of every record start
+    offset = 0
+    with open(filepath, "rb") as handle:
+        for line_no, line in enumerate(handle):
+            if file_type == "fastq" and line_no % 4 == 0 and line.startswith(b"@"):
+                starts.append((line[1:].split(None, 1)[0].decode("utf-8"), offset))
+            elif file_type == "fasta" and line.startswith(b">"):
+                starts.append((line[1:].split(None, 1)[0].decode("utf-8"), offset))
+            offset += len(line)
+
+    for i, (read, start) in enumerate(starts):
+        end = starts[i + 1][1] if i + 1 < len(starts) else offset
+        if read not in index:
+            index[read] = (start, end - start)
+    write_read_index(filepath, index)
+    return index
+
+def load_read_index(filepath):
+    '''
+    Load the byte offset index of filepath, (re)build it if it is missing or older than the file
+    return: dict of read name -> (byte offset, byte length)
+    '''
+    idx_path = filepath + ".idx"
+    if not os.path.exists(idx_path) or os.path.getmtime(idx_path) < os.path.getmtime(filepath):
+        return build_read_index(filepath)
+
+    index = {}
+    with open(idx_path) as handle:
+        for line in handle:
+            read, offset, length = line.rstrip("\n").split("\t")
+            index[read] = (int(offset), int(length))
+    return index
+
+def fetch_read_ends(filepath, reads, span, index=None):
+    '''
+    Get the ends of reads from an indexed, uncompressed fastq/fasta file by seeking to them, without scanning the file
+    filepath: str, location of the subset file
+    reads: list of read names
+    span: number of base pairs to keep at each end
+    index: optional, dict from load_read_index
+    yield: (read id, read length, first span base pairs, last span base pairs flipped) of each read found, in the order of reads
+    '''
+    if index is None:
+        index = load_read_index(filepath)
+    if not index:
+        return
+
+    with open(filepath, "rb") as handle:
+        for read in reads:
+            if read not in index:
+                continue
+            offset, length = index[read]
+            handle.seek(offset)
+            yield from record_ends(handle.read(length), span)
+
 # step 1: count TRC 
-def patternTRC_count(filepath, telopattern, read_length=0, kmer=4, no_bp=1000, cutoff=0.5):
+def trc_from_counts(seq_id, pattern_names, counts_start, counts_end, ratio_perfect_hit, cutoff):
+    '''
+    Find the TRC of one read from the k-mer counts of its first and last base pairs
+    seq_id: str, read name
+    pattern_names: list of str, k-mer patterns
+    counts_start: list of int, count of each pattern in the first no_bp base pairs
+    counts_end: list of int, count of each pattern in the last no_bp base pairs (flipped)
+    ratio_perfect_hit: number of k-mer hits expected in a perfect telomere of no_bp
+    cutoff: TRC threshold
+    return: [read id, pattern, tail, TRC] if the read is over cutoff, otherwise None
+    '''
+    return trc_match(seq_id, pattern_names, trc_scores(counts_start, counts_end, ratio_perfect_hit), cutoff)
+
+def trc_scores(counts_start, counts_end, ratio_perfect_hit):
+    '''
+    TRC of both ends of one read, before any cutoff, from the k-mer counts of its first and last base pairs
+    return: (TRC forward, TRC reverse, index of the best k-mer of the end with the highest TRC)
+    '''
+    trc_start = [matches_start / ratio_perfect_hit for matches_start in counts_start]
+    trc_end = [matches_end / ratio_perfect_hit for matches_end in counts_end]
+    # first best k-mer of each end, like max()
+    best_start = max(range(len(trc_start)), key=trc_start.__getitem__)
+    best_end = max(range(len(trc_end)), key=trc_end.__getitem__)
+    best = best_start if trc_start[best_start] > trc_end[best_end] else best_end
+    return trc_start[best_start], trc_end[best_end], best
+
+def trc_match(seq_id, pattern_names, scores, cutoff):
+    '''
+    Tail and TRC of one read at cutoff, from its scores
+    scores: (TRC forward, TRC reverse, index of the best k-mer in pattern_names), from trc_scores
+    return: [read id, pattern, tail, TRC] if the read is over cutoff, otherwise None
+    '''
+    trc_forward, trc_reverse, best = scores
+    if trc_forward > trc_reverse:
+        if trc_forward > cutoff:    
+            return [seq_id, pattern_names[best], 'forward', trc_forward]
+    else:
+        if trc_reverse > cutoff: 
+            return [seq_id, pattern_names[best], 'reverse', trc_reverse]
+    return None
+
+def trc_read(seq_id, seq_start, seq_end, compiled_patterns, ratio_perfect_hit, cutoff):
+    '''
+    Find the TRC of one read from its first and last base pairs, one regex scan per k-mer
+    seq_id: str, read name
+    seq_start: str, first no_bp base pairs of the read, upper case
+    seq_end: str, last no_bp base pairs of the read (flipped), upper case
+    compiled_patterns: list of compiled k-mer patterns
+    ratio_perfect_hit: number of k-mer hits expected in a perfect telomere of no_bp
+    cutoff: TRC threshold
+    return: [read id, pattern, tail, TRC] if the read is over cutoff, otherwise None
+    '''
+    counts_start = [len([m.start() for m in pattern.finditer(seq_start)]) for pattern in compiled_patterns]
+    counts_end = [len([m.start() for m in pattern.finditer(seq_end)]) for pattern in compiled_patterns]
+    return trc_from_counts(seq_id, [pattern.pattern for pattern in compiled_patterns], counts_start, counts_end, ratio_perfect_hit, cutoff)
+
+def trc_batch(read_ids, seq_starts, seq_ends, table, ratio_perfect_hit, cutoff):
+    '''
+    Find the TRC of a batch of reads with the numpy k-mer engine, all k-mers and all reads in one pass
+    read_ids: list of read names
+    seq_starts: list of str, first no_bp base pairs of each read, upper case
+    seq_ends: list of str, last no_bp base pairs of each read (flipped), upper case
+    table: from kmercount.kmer_table
+    return: list with [read id, pattern, tail, TRC] for reads over cutoff, None for the others
+    '''
+    if not read_ids:
+        return []
+    counts = kmer_count_matrix(list(seq_starts) + list(seq_ends), table).tolist()
+    n = len(read_ids)
+    return [trc_from_counts(read_ids[i], table["patterns"], counts[i], counts[n + i], ratio_perfect_hit, cutoff) for i in range(n)]
+
+def trc_counters(telopattern, kmers, engine="numpy", max_errors=None):
+    '''
+    Prepare the TRC counting of each k-mer size once
+    telopattern: str or list of str, pattern of telomere
+    kmers: list of k-mer lengths
+    engine: "numpy" or "regex", patterns that are not plain k-mers always use regex
+    max_errors: optional, count the whole repeat unit with up to max_errors errors instead of k-mers (--scanmode approx)
+    return: list of (k, compiled patterns, kmer_table or approxscan.approx_table, or None)
+    '''
+    counters = []
+    for kmer in kmers:
+        pattern_all = scan_patterns(telopattern, kmer, max_errors)
+        if max_errors is not None:
+            table = approx_table(pattern_all, max_errors)
+        else:
+            table = kmer_table(pattern_all) if engine == "numpy" and is_plain_kmers(pattern_all) else None
+        counters.append((kmer, [re.compile(pattern) for pattern in pattern_all], table))
+    return counters
+
+# scores of a read skipped by the prefilter, never over any cutoff (see trc_candidates)
+SKIPPED_SCORES = (float("nan"), float("nan"), 0)
+
+def trc_candidates(seq_starts, seq_ends, counters, ratio_perfect_hit, cutoff):
+    '''
+    First tier of TRC: reads that can reach cutoff, for each k-mer size counted with a kmer_table.
+    The TRC of both ends is bounded from above by the 3-mer composition of the ends (kmercount.count_bounds), 
+    which costs one pass for all k-mer sizes, so a read left out is never over cutoff
+    return: dict of k -> bool array (True for reads to count in full), k-mer sizes that can not be bounded are left out
+    '''
+    bounded = [(kmer, table) for kmer, compiled_patterns, table in counters
+               if table is not None and not is_approx_table(table) and table["k"] >= BOUND_WORD]
+    if not bounded or not seq_starts:
+        return {}
+    seqs = list(seq_starts) + list(seq_ends)
+    counts = word_counts(encode_seqs(seqs, max(len(seq) for seq in seqs)), BOUND_WORD)
+    n = len(seq_starts)
+    candidates = {}
+    for kmer, table in bounded:
+        trc_bound = count_bounds(counts, table).max(axis=1) / ratio_perfect_hit
+        candidates[kmer] = np.maximum(trc_bound[:n], trc_bound[n:]) > cutoff
+    return candidates
+
+def trc_kmer_scores(seq_starts, seq_ends, counters, ratio_perfect_hit, cutoff=None):
+    '''
+    TRC scores of a batch of reads for every k-mer size, from the same read ends, before any cutoff
+    counters: from trc_counters
+    cutoff: optional, only count the reads that can be over cutoff (trc_candidates), the others get SKIPPED_SCORES
+    other parameters: same as trc_batch
+    return: dict of k -> list with (TRC forward, TRC reverse, index of the best k-mer) of every read, see trc_scores
+    '''
+    scores = {}
+    candidates = trc_candidates(seq_starts, seq_ends, counters, ratio_perfect_hit, cutoff) if cutoff is not None else {}
+    for kmer, compiled_patterns, table in counters:
+        if kmer in candidates:
+            rows = np.flatnonzero(candidates[kmer]).tolist()
+            scores[kmer] = [SKIPPED_SCORES] * len(seq_starts)
+            if rows:
+                counts = kmer_count_matrix([seq_starts[i] for i in rows] + [seq_ends[i] for i in rows], table).tolist()
+                for j, i in enumerate(rows):
+                    scores[kmer][i] = trc_scores(counts[j], counts[len(rows) + j], ratio_perfect_hit)
+        elif table is None:
+            scores[kmer] = [trc_scores([len(pattern.findall(seq_start)) for pattern in compiled_patterns], 
+                                       [len(pattern.findall(seq_end)) for pattern in compiled_patterns], ratio_perfect_hit)
+                            for seq_start, seq_end in zip(seq_starts, seq_ends)]
+        elif not seq_starts:
+            scores[kmer] = []
+        else:
+            count_matrix = approx_count_matrix if is_approx_table(table) else kmer_count_matrix
+            counts = count_matrix(list(seq_starts) + list(seq_ends), table).tolist()
+            n = len(seq_starts)
+            scores[kmer] = [trc_scores(counts[i], counts[n + i], ratio_perfect_hit) for i in range(n)]
+    return scores
+
+def trc_kmers(read_ids, seq_starts, seq_ends, counters, ratio_perfect_hit, cutoff, prefilter=True):
+    '''
+    TRC of a batch of reads for every k-mer size, from the same read ends
+    counters: from trc_counters
+    prefilter: only count the reads that can be over cutoff (trc_candidates), same matches
+    other parameters: same as trc_batch
+    return: dict of k -> list with [read id, pattern, tail, TRC] for reads over cutoff, None for the others
+    '''
+    names = {kmer: [pattern.pattern for pattern in compiled_patterns] for kmer, compiled_patterns, table in counters}
+    scores = trc_kmer_scores(seq_starts, seq_ends, counters, ratio_perfect_hit, cutoff if prefilter else None)
+    return {kmer: [trc_match(read_id, names[kmer], read_scores, cutoff) for read_id, read_scores in zip(read_ids, scores[kmer])] for kmer in scores}
+
+def patternTRC_scores_stream(filepath, telopattern, kmers, read_length=0, no_bp=1000, engine="numpy", batch_size=256, span=None, threads=None, max_errors=None,
+                             prefilter_cutoff=None):
+    '''
+    TRC scores of every read for several k-mer sizes in one pass over the file, before any cutoff: 
+    each read is decoded once and counted for all k
+    filepath: str, location of file, can be either fastqz.gz or fasta, just 1 file at the time 
+    kmers: list of k-mer lengths
+    engine: "numpy" (count all k-mers of a batch of reads in one vectorized pass) or "regex" (one scan per k-mer). 
+            Both give the same TRC; patterns that are not plain k-mers always use regex
+    batch_size: number of reads counted together
+    span: number of base pairs kept at each end of the read, default no_bp. TRC always looks at the first/last no_bp
+    threads: number of decompression threads for .gz input
+    max_errors: optional, count the repeat unit with up to max_errors errors instead of k-mers (--scanmode approx)
+    prefilter_cutoff: optional, only count the reads that can be over this cutoff (trc_candidates), the others get SKIPPED_SCORES
+    yield: ((read id, read length, first span base pairs, last span base pairs flipped), {k: (TRC forward, TRC reverse, index of the best k-mer)}) 
+           of every read longer than read_length, in file order
+    '''
+    if isinstance(filepath, list):
+        print("Can only process 1 file path at the time, please loop paths through the list")
+        return
+
+    counters = trc_counters(telopattern, kmers, engine, max_errors)
+    ratio_perfect_hit = no_bp / len(telopattern)
+    span = max(span or no_bp, no_bp)
+
+    def count_batch(batch):
+        # first/last no_bp base pairs of each read
+        scores = trc_kmer_scores([ends[2][:no_bp] for ends in batch], [ends[3][:no_bp] for ends in batch], counters, ratio_perfect_hit, prefilter_cutoff)
+        for i, ends in enumerate(batch):
+            yield ends, {kmer: scores[kmer][i] for kmer in scores}
+
+    batch = []
+    for ends in iter_ends(filepath, span, read_length=read_length, threads=threads):  # have to be longer than the minimum length required 
+        batch.append(ends)
+        if len(batch) >= batch_size:
+            yield from count_batch(batch)
+            batch = []
+    yield from count_batch(batch)
+
+def patternTRC_multi_stream(filepath, telopattern, kmers, read_length=0, no_bp=1000, cutoff=0.5, engine="numpy", batch_size=256, span=None, threads=None, max_errors=None,
+                            prefilter=True):
+    '''
+    TRC of every read for several k-mer sizes in one pass over the file: each read is decoded once and counted for all k
+    filepath: str, location of file, can be either fastqz.gz or fasta, just 1 file at the time 
+    kmers: list of k-mer lengths
+    prefilter: only count the reads that can be over cutoff (trc_candidates), same matches
+    other parameters: same as patternTRC_scores_stream
+    yield: ((read id, read length, first span base pairs, last span base pairs flipped), {k: [read id, pattern, tail, TRC] or None}) 
+           of reads over cutoff for at least one k, in file order
+    '''
+    names = {kmer: scan_patterns(telopattern, kmer, max_errors) for kmer in kmers}
+    for ends, scores in patternTRC_scores_stream(filepath, telopattern, kmers, read_length=read_length, no_bp=no_bp, engine=engine, 
+                                                 batch_size=batch_size, span=span, threads=threads, max_errors=max_errors,
+                                                 prefilter_cutoff=cutoff if prefilter else None):
+        read_matches = {kmer: trc_match(ends[0], names[kmer], scores[kmer], cutoff) for kmer in scores}
+        if any(match is not None for match in read_matches.values()):
+            yield ends, read_matches
+
+def patternTRC_stream(filepath, telopattern, read_length=0, kmer=4, no_bp=1000, cutoff=0.5, engine="numpy", batch_size=256, span=None):
+    '''
+    Same as patternTRC_count, but yield each read over cutoff together with its ends, 
+    so step 2 can run on the read ends already in memory (no second pass over the file)
+    filepath: str, location of file, can be either fastqz.gz or fasta, just 1 file at the time 
+    engine: "numpy" (count all k-mers of a batch of reads in one vectorized pass) or "regex" (one scan per k-mer). 
+            Both give the same TRC; patterns that are not plain k-mers always use regex
+    batch_size: number of reads counted together
+    span: number of base pairs kept at each end of the read, default no_bp. TRC always looks at the first/last no_bp
+    yield: ((read id, read length, first span base pairs, last span base pairs flipped), [read id, pattern, tail, TRC]) of reads over cutoff, in file order
+    '''
+    for ends, matches in patternTRC_multi_stream(filepath, telopattern, [kmer], read_length=read_length, no_bp=no_bp, cutoff=cutoff, 
+                                                 engine=engine, batch_size=batch_size, span=span):
+        yield ends, matches[kmer]
+
+def patternTRC_count(filepath, telopattern, read_length=0, kmer=4, no_bp=1000, cutoff=0.5, engine="numpy"):
     '''
     Find the telomere-like repeat count (TRC) in the first and last no_bp base pairs of the sequence
     filepath: str, location of file, can be either fastqz.gz or fasta, just 1 file at the time 
@@ -158,44 +516,15 @@ def patternTRC_count(filepath, telopattern, read_length=0, kmer=4, no_bp=1000, c
     read_length: minimum length require for the sequence (filter out too short sequences)
     kmer: length of scanning pattern divided by chunk when we wanna have flexibility, default = 4
     cutoff: cutoff for mean_window value to be cutoff point for telomere boundary, default = 0.5
+    engine: k-mer counting engine, "numpy" (default) or "regex", same results
     yeild: list of reads with patterns and TRC value. Won't filter out reads at this step
     '''
-    find_match = []  # empty list to store found pattern, ratio, start/end 
-    raw_count = []
-
-    # get the list of patterns to search for 
-    pattern_all = patterns_to_search(telopattern, cut_length=kmer)
-    compiled_patterns = [re.compile(pattern) for pattern in pattern_all]
-
     if isinstance(filepath, list):
         print("Can only process 1 file path at the time, please loop paths through the list")
         return None 
 
-    for seq in unzip_file(filepath): 
-        if len(seq.seq) > read_length:  # have to be longer than the minimum length required 
-            seq_start = str(seq.seq[:no_bp].upper())  # get first no_bp base pairs 
-            seq_end = str(seq.seq[-no_bp:][::-1].upper())  # get last no_bp base pairs   
-            ratio_perfect_hit = no_bp / len(telopattern)
-            itcs_indi = [['seq id', 'pattern', 'TRC forward strand', 'TRC reverse strand']]
-            
-            for pattern in compiled_patterns: 
-                matches_start = len([m.start() for m in pattern.finditer(seq_start)])
-                matches_end = len([m.start() for m in pattern.finditer(seq_end)])
-                
-                count_pattern_start = matches_start / ratio_perfect_hit
-                count_pattern_end = matches_end / ratio_perfect_hit
-                itcs_indi.append([seq.id, pattern.pattern, count_pattern_start, count_pattern_end])
-
-            raw_count.append(itcs_indi)
-            max_row_start = max(itcs_indi[1:], key=lambda row: row[2])
-            max_row_end = max(itcs_indi[1:], key=lambda row: row[3])
-            
-            if max_row_start[2] > max_row_end[3]:
-                if max_row_start[2] > cutoff:    
-                    find_match.append([max_row_start[0], max_row_start[1], 'forward', max_row_start[2]]) 
-            else:
-                if max_row_end[3] > cutoff: 
-                    find_match.append([max_row_end[0], max_row_end[1], 'reverse', max_row_end[3]])
+    # empty list to store found pattern, ratio, start/end 
+    find_match = [match for ends, match in patternTRC_stream(filepath, telopattern, read_length=read_length, kmer=kmer, no_bp=no_bp, cutoff=cutoff, engine=engine)]
                     
     if check_file_type(filepath) is None:
         print("can not read in file - can not run step 1")
@@ -224,7 +553,232 @@ def seq_cut_windows(s, window_size, step):
         windows.append((start, s[start:end]))
     return windows  # Return indices and window
     
-def bound_detect(filepath, read, pattern_telo, windowSize, slide, trimfirst, maxlengthtelo, cut_length, tail=None, plot_yes_no=None,plotcp_range=None):
+def window_counts(seq, compiled_patterns, windowSize, slide, table=None):
+    '''
+    Count of each pattern in every sliding window of seq, each pattern counted at least 1 in a window
+    seq: str, upper case
+    compiled_patterns: list of compiled patterns
+    windowSize: size of window
+    slide: step of each window
+    table: optional, kmercount.kmer_table of the patterns. With it, hits are found once for the whole seq 
+           and window counts come from cumulative sums instead of scanning every window. 
+           An approxscan.approx_table counts the repeat unit with errors the same way (--scanmode approx)
+    return: window starts (int array) and counts (int array, number of windows x number of patterns)
+    '''
+    if is_approx_table(table):
+        starts, counts = approx_window_counts(seq, table, windowSize, slide)
+        return starts, np.maximum(counts, 1)
+    if table is not None:
+        starts, counts = kmer_window_counts(seq, table, windowSize, slide)
+        return starts, np.maximum(counts, 1)
+
+    windows = seq_cut_windows(seq, windowSize, slide)
+    counts = [[len(pattern.findall(seq_cut)) or 1 for pattern in compiled_patterns] for start, seq_cut in windows]
+    return (np.array([start for start, seq_cut in windows], dtype=np.int64), 
+            np.array(counts, dtype=np.int64).reshape(len(windows), len(compiled_patterns)))
+
+def window_means(starts, counts):
+    '''
+    Mean window values from window_counts
+    return: list of (window start, mean window value)
+    '''
+    return list(zip(starts.tolist(), (counts.sum(axis=1) / counts.shape[1]).tolist()))
+
+def mean_windows(seq, compiled_patterns, windowSize, slide, table=None):
+    '''
+    Mean count of the patterns in every sliding window of seq, each pattern counted at least 1 in a window
+    parameters: same as window_counts
+    return: list of (window start, mean window value)
+    '''
+    return window_means(*window_counts(seq, compiled_patterns, windowSize, slide, table=table))
+
+def pattern_table(compiled_patterns, max_errors=None):
+    '''
+    kmercount.kmer_table of the compiled patterns if they are plain k-mers, otherwise None (regex is used)
+    max_errors: optional, approxscan.approx_table of the patterns instead (repeat units, --scanmode approx)
+    '''
+    patterns = [pattern.pattern for pattern in compiled_patterns]
+    if max_errors is not None:
+        return approx_table(patterns, max_errors)
+    return kmer_table(patterns) if is_plain_kmers(patterns) else None
+
+def read_ends(seq, span):
+    '''
+    Get both ends of a read, which is all that TRC and boundary detection look at
+    seq: SeqRecord of the read
+    span: number of base pairs to keep at each end, at least max(no_bp, maxlengthtelo)
+    return: (read id, read length, first span base pairs, last span base pairs flipped), upper case
+    '''
+    # the last span base pairs are reversed while they are sliced, the rest of the read is not copied
+    return (seq.id, len(seq), str(seq.seq[:span]).upper(), str(seq.seq[:-span - 1:-1]).upper())
+
+def plot_boundary(read_id, x, y, telo_boundary_point, maxlengthtelo, plotcp_range=None):
+    '''
+    Plot the mean window values of one read end and its telomere boundary point, in a new figure
+    '''
+    plt = pyplot()
+    plt.figure(figsize=(7.5, 3), dpi=300)
+    draw_boundary(plt.gca(), read_id, x, y, telo_boundary_point, maxlengthtelo, plotcp_range)
+    plt.tight_layout()
+    plt.grid(True)
+
+def draw_boundary(ax, read_id, x, y, telo_boundary_point, maxlengthtelo, plotcp_range=None):
+    '''
+    Draw the mean window values of one read end and its telomere boundary point on ax (a figure or a panel of a sheet)
+    '''
+    ax.plot(x, y, color='#000000', linestyle='-', linewidth=2)
+    ax.axvline(x=telo_boundary_point, color='#FF2C2C', linewidth=2, linestyle='--', label=f'x = boundary point: {telo_boundary_point}')
+    ax.set_title(f'mean window + boundary point of {read_id}')
+    ax.set_xlabel('base pair (bp)')
+    ax.set_ylabel('mean window value')
+    if plotcp_range:
+        ax.set_xlim(0,plotcp_range)
+    else:
+        ax.set_xlim(0, maxlengthtelo)
+
+def bound_detect_ends(read_id, length, seq_start, seq_end, pattern_telo, windowSize, slide, trimfirst, maxlengthtelo, cut_length, tail=None, plot_yes_no=None, plotcp_range=None,
+                      compiled_patterns=None, table=None, cp_backend="native", tracks=None, rawcounts=None, timings=None):
+    '''
+    Find telomere-subtelomere boundary point of one read from its ends
+    read_id: read name
+    length: read length
+    seq_start: first base pairs of the read (at least maxlengthtelo), upper case
+    seq_end: last base pairs of the read flipped (at least maxlengthtelo), upper case
+    compiled_patterns: optional, list of compiled patterns so they are not rebuilt for every read
+    table: optional, pattern_table(compiled_patterns), so it is not rebuilt for every read
+    cp_backend: changepoint backend, "native" (default) or "ruptures"
+    tracks: optional list, (read id, direction, x, y, boundary point, maxlengthtelo) of each end is appended to it, to plot later
+    rawcounts: optional list, (direction, window starts, counts of each pattern) of each end is appended to it, 
+               the raw counts of --rawcountpattern from the same window counts as the boundary (see window_counts)
+    timings: optional dict, seconds spent in "windowing" and "changepoint" are added to it (--profile)
+    other parameters: same as bound_detect
+
+    return: list of [read id, telomere boundary point]
+    '''
+    boundary = []
+    if compiled_patterns is None:
+        patterns = patterns_to_search(pattern_telo, cut_length=cut_length)
+        compiled_patterns = [re.compile(pattern) for pattern in patterns]
+    if table is None:
+        table = pattern_table(compiled_patterns)
+
+    if length < maxlengthtelo:
+        maxlengthtelo = length
+
+    # check both ends of the read to find telo boundary 
+    seq_start = seq_start[trimfirst:maxlengthtelo]
+    seq_end = seq_end[trimfirst:maxlengthtelo]  # flip chr end
+
+    # mean window values, only on the tail of read that have telomere if it is specified
+    def end_means(seq, direction):
+        start_time = time.perf_counter() if timings is not None else None
+        starts, counts = window_counts(seq, compiled_patterns, windowSize, slide, table=table)
+        if rawcounts is not None:
+            rawcounts.append((direction, starts, counts))
+        means = [(direction, start, mean) for start, mean in window_means(starts, counts)]
+        if timings is not None:
+            timings["windowing"] = timings.get("windowing", 0.0) + time.perf_counter() - start_time
+        return means
+
+    mean_s = []
+    mean_e = []
+    if tail != 'reverse':
+        mean_s = end_means(seq_start, "forward")
+    if tail != 'forward':
+        mean_e = end_means(seq_end, "reverse")
+
+    # check mean of end tail 
+    def process_mean(mean, direction):
+        if not mean:
+            return
+
+        x = [item[1] + trimfirst for item in mean if item[1] + trimfirst <= maxlengthtelo]
+        y = [item[2] for item in mean if item[1] + trimfirst <= maxlengthtelo]
+
+        if not x:
+            return
+
+        start_time = time.perf_counter() if timings is not None else None
+        result = changepoints(y, backend=cp_backend, n_bkps=1, pen=4)
+        if timings is not None:
+            timings["changepoint"] = timings.get("changepoint", 0.0) + time.perf_counter() - start_time
+        all_cps = [x[cp] for cp in result]
+
+        if all_cps:
+            telo_boundary_point = int(all_cps[0])
+            if plot_yes_no:
+                plot_boundary(read_id, x, y, telo_boundary_point, maxlengthtelo, plotcp_range)
+            if tracks is not None:
+                tracks.append((read_id, direction, x, y, telo_boundary_point, maxlengthtelo))
+
+            if telo_boundary_point <= maxlengthtelo and telo_boundary_point != 0:
+                boundary.append([read_id, telo_boundary_point]) #save the boundary point
+            else:
+                boundary.append([read_id, 0])
+
+    process_mean(mean_e, "reverse")
+    process_mean(mean_s, "forward")
+
+    return boundary
+
+def bound_detect_seq(seq, pattern_telo, windowSize, slide, trimfirst, maxlengthtelo, cut_length, tail=None, plot_yes_no=None, plotcp_range=None, compiled_patterns=None, table=None, cp_backend="native"):
+    '''
+    Find telomere-subtelomere boundary point of one read that is already in memory
+    seq: SeqRecord of the read
+    other parameters: same as bound_detect_ends
+
+    return: list of [read id, telomere boundary point]
+    '''
+    read_id, length, seq_start, seq_end = read_ends(seq, maxlengthtelo)
+    return bound_detect_ends(read_id, length, seq_start, seq_end, pattern_telo, windowSize, slide, trimfirst, maxlengthtelo, cut_length, tail=tail, 
+                             plot_yes_no=plot_yes_no, plotcp_range=plotcp_range, compiled_patterns=compiled_patterns, table=table, cp_backend=cp_backend)
+
+def read_ends_by_id(filepath, reads, span, index=None):
+    '''
+    Get the ends of reads from filepath: seek with the byte offset index when there is one, otherwise scan the file once
+    filepath: str, location of the file
+    reads: list of read names
+    span: number of base pairs to keep at each end
+    index: optional, dict from load_read_index. Used by default if filepath + ".idx" exists
+    yield: (read id, read length, first span base pairs, last span base pairs flipped) of each read found, in the order of reads
+    '''
+    if index is None and os.path.exists(filepath + ".idx"):
+        index = load_read_index(filepath)
+    if index is not None:
+        yield from fetch_read_ends(filepath, reads, span, index)
+        return
+
+    # no index, scan the file once and keep the wanted reads
+    wanted = set(reads)
+    found = {}
+    for ends in iter_ends(filepath, span):
+        if ends[0] in wanted and ends[0] not in found:
+            found[ends[0]] = ends
+    for read in reads:
+        if read in found:
+            yield found[read]
+
+def bound_detect_many(filepath, reads, pattern_telo, windowSize, slide, trimfirst, maxlengthtelo, cut_length, tails=None, plot_yes_no=None, plotcp_range=None, index=None, cp_backend="native",
+                      max_errors=None):
+    '''
+    bound_detect on many reads of the same file in one call 
+    reads: list of read names
+    tails: optional, dict of read name -> tail having telomere ('forward' or 'reverse')
+    other parameters: same as bound_detect
+
+    yield: (read name, telomere boundary point) for each read, in the order of reads. 
+    If plot_yes_no, the plot of that read is the current figure when it is yielded
+    '''
+    patterns = scan_patterns(pattern_telo, cut_length, max_errors)
+    compiled_patterns = [re.compile(pattern) for pattern in patterns]
+    table = pattern_table(compiled_patterns, max_errors)
+    tails = tails or {}
+
+    for read_id, length, seq_start, seq_end in read_ends_by_id(filepath, reads, maxlengthtelo, index):
+        yield read_id, bound_detect_ends(read_id, length, seq_start, seq_end, pattern_telo, windowSize, slide, trimfirst, maxlengthtelo, cut_length, tail=tails.get(read_id), 
+                                       plot_yes_no=plot_yes_no, plotcp_range=plotcp_range, compiled_patterns=compiled_patterns, table=table, cp_backend=cp_backend)
+
+def bound_detect(filepath, read, pattern_telo, windowSize, slide, trimfirst, maxlengthtelo, cut_length, tail=None, plot_yes_no=None,plotcp_range=None,index=None,cp_backend="native",max_errors=None):
     '''
     Find telomere-subtelomere boundary point in the sequence by using mean window value change and changepoint algo 
     filepath: location of fasta file
@@ -235,109 +789,35 @@ def bound_detect(filepath, read, pattern_telo, windowSize, slide, trimfirst, max
     region: cut the sequence - in telomere, just check for first 5000 bp
     trimfirst: number of nucleotide trim off 
     maxlengthtelo: max possible length of telomere in this species
+    index: optional, byte offset index of filepath (from load_read_index). Used by default if filepath + ".idx" exists
+    cp_backend: changepoint backend, "native" (default, exact single changepoint) or "ruptures" (Binseg, needs ruptures installed)
+    max_errors: optional, count the patterns (repeat units) with up to max_errors errors (--scanmode approx)
 
     return: telomere boundary point of each window 
     '''
 
     # Loop through reads in file, find interested read. Then find their matches and plot 
-    read_ids = []
     boundary = []
     if not isinstance(read, str):
         print("can only read in 1 read at a time")
         return None
 
-    patterns = patterns_to_search(pattern_telo, cut_length=cut_length)
+    # same patterns as step 1 counts: k-mers, or the repeat units with max_errors
+    patterns = scan_patterns(pattern_telo, cut_length, max_errors)
     compiled_patterns = [re.compile(pattern) for pattern in patterns]
+    table = pattern_table(compiled_patterns, max_errors)
 
-    sequences = unzip_file(filepath)
-    if sequences is None:
-        print("Problem in filepath, please double check")
-        return ["didn't run", filepath, 0]
-
-    for seq in sequences:
-        if seq.id != read or windowSize is None:
+    for read_id, length, seq_start, seq_end in read_ends_by_id(filepath, [read], maxlengthtelo, index):
+        if read_id != read or windowSize is None:
             continue
 
-        mean_s = []
-        mean_e = []
-        if len(seq) < maxlengthtelo:
-            maxlengthtelo = len(seq)
-
-        # check both ends of the read to find telo boundary 
-        seq_start = str(seq.seq[trimfirst:maxlengthtelo]).upper()
-        read_ids.append([seq.id, "forward"])
-
-        seq_end = str(seq.seq[::-1]).upper()
-        seq_end = seq_end[trimfirst:maxlengthtelo]  # flip chr end
-        read_ids.append([seq.id, "reverse"])
-
-        # cut sequence by windowSize and sliding
-        windows_start = seq_cut_windows(seq_start, windowSize, slide)
-        windows_end = seq_cut_windows(seq_end, windowSize, slide)
-
-        # initiate matches 
-        for start, seq_cut in windows_start:
-            count_matches_read = [
-                len([m.start() for m in pattern.finditer(seq_cut)]) or 1
-                for pattern in compiled_patterns
-            ]
-            mean_s.append(("forward", start, sum(count_matches_read) / len(count_matches_read)))
-
-        for start, seq_cut_2 in windows_end:
-            count_matches_read = [
-                len([m.start() for m in pattern.finditer(seq_cut_2)]) or 1
-                for pattern in compiled_patterns
-            ]
-            mean_e.append(("reverse", start, sum(count_matches_read) / len(count_matches_read)))
-
-        # specify the tail of read that have telomere 
-        if tail == 'forward':
-            mean_e = []
-        elif tail == 'reverse':
-            mean_s = []
-
-        # check mean of end tail 
-        def process_mean(mean, direction):
-            if not mean:
-                return
-
-            x = [item[1] + trimfirst for item in mean if item[1] + trimfirst <= maxlengthtelo]
-            y = [item[2] for item in mean if item[1] + trimfirst <= maxlengthtelo]
-
-            if not x:
-                return
-
-            algo = rpt.Binseg(model="l2").fit(np.array(y))
-            result = algo.predict(pen=4, n_bkps=1)
-            all_cps = [x[cp] for cp in result[:-1]]
-
-            if all_cps:
-                telo_boundary_point = int(all_cps[0])
-                if plot_yes_no:
-                    plt.figure(figsize=(7.5, 3), dpi=300)
-                    plt.plot(x, y, color='#000000', linestyle='-', linewidth=2)
-                    plt.axvline(x=telo_boundary_point, color='#FF2C2C', linewidth=2, linestyle='--', label=f'x = boundary point: {telo_boundary_point}')
-                    plt.title(f'mean window + boundary point of {seq.id}')
-                    plt.xlabel('base pair (bp)')
-                    plt.ylabel('mean window value')
-                    if plotcp_range:
-                        plt.xlim(0,plotcp_range)
-                    else:
-                        plt.xlim(0, maxlengthtelo)
-                    plt.tight_layout()
-                    plt.grid(True)
-
-                if telo_boundary_point <= maxlengthtelo and telo_boundary_point != 0:
-                    boundary.append([read, telo_boundary_point]) #save the boundary point
-                else:
-                    boundary.append([read, 0])
-
-        process_mean(mean_e, "reverse")
-        process_mean(mean_s, "forward")
+        boundary.extend(bound_detect_ends(read_id, length, seq_start, seq_end, pattern_telo, windowSize, slide, trimfirst, maxlengthtelo, cut_length, tail=tail, 
+                                         plot_yes_no=plot_yes_no, plotcp_range=plotcp_range, compiled_patterns=compiled_patterns, table=table, cp_backend=cp_backend))
 
     return boundary
 
 def plot_patterns(seq, patterns, read_ids, added_labels, ax, direction):
+    colors = palette()
     trans_table = str.maketrans('ACGT', 'TGCA')
     for patt in patterns:
         patterns.append(patt)
@@ -356,7 +836,72 @@ def plot_patterns(seq, patterns, read_ids, added_labels, ax, direction):
         else:
             ax.scatter(matches, [(i + 1) * 2] * len(matches), color=colors[i], marker='|', zorder=2)
 
-def rawCountPattern(filepath, read, pattern_telo, windowSize, slide, trimfirst, cut_length, minSeqLength, maxlengthtelo, tail=None, plot_raw=False):
+def rawCountPattern_ends(seq_start, seq_end, compiled_patterns, windowSize, slide, trimfirst, maxlengthtelo, tail=None):
+    '''
+    Raw count of each telomere-like k-mer in every window of one read, from its ends
+    seq_start: first base pairs of the read (at least maxlengthtelo), upper case
+    seq_end: last base pairs of the read flipped (at least maxlengthtelo), upper case
+    compiled_patterns: list of compiled k-mer patterns
+    other parameters: same as rawCountPattern
+
+    return: list of (tail, position, pattern, count)
+    '''
+    # check both ends of the read to find telo boundary 
+    seq_start = seq_start[trimfirst:maxlengthtelo]
+    seq_end = seq_end[trimfirst:maxlengthtelo]
+
+    windows_start = seq_cut_windows(seq_start, windowSize, slide)
+    windows_end = seq_cut_windows(seq_end, windowSize, slide)
+
+    rawpattern_s = [
+        ("forward", start, pattern.pattern, len([m.start() for m in pattern.finditer(seq_cut)]) or 1)
+        for start, seq_cut in windows_start
+        for pattern in compiled_patterns
+    ]
+
+    rawpattern_e = [
+        ("reverse", start, pattern.pattern, len([m.start() for m in pattern.finditer(seq_cut_2)]) or 1)
+        for start, seq_cut_2 in windows_end
+        for pattern in compiled_patterns
+    ]
+
+    if tail == 'forward':
+        rawpattern_e = []
+    elif tail == 'reverse':
+        rawpattern_s = []
+
+    return rawpattern_s + rawpattern_e
+
+def rawCountPattern_seq(seq, compiled_patterns, windowSize, slide, trimfirst, maxlengthtelo, tail=None):
+    '''
+    Raw count of each telomere-like k-mer in every window of one read that is already in memory
+    seq: SeqRecord of the read
+    other parameters: same as rawCountPattern_ends
+
+    return: list of (tail, position, pattern, count)
+    '''
+    read_id, length, seq_start, seq_end = read_ends(seq, maxlengthtelo)
+    return rawCountPattern_ends(seq_start, seq_end, compiled_patterns, windowSize, slide, trimfirst, maxlengthtelo, tail=tail)
+
+def rawCountPattern_many(filepath, reads, pattern_telo, windowSize, slide, trimfirst, cut_length, maxlengthtelo, tails=None, index=None):
+    '''
+    rawCountPattern on many reads of the same file in one call 
+    reads: list of read names
+    tails: optional, dict of read name -> tail having telomere ('forward' or 'reverse')
+    other parameters: same as rawCountPattern
+
+    yield: (read name, raw count DataFrame) for each read, in the order of reads
+    '''
+    import pandas as pd
+    patterns = patterns_to_search(pattern_telo, cut_length=cut_length)
+    compiled_patterns = [re.compile(pattern) for pattern in patterns]
+    tails = tails or {}
+
+    for read_id, length, seq_start, seq_end in read_ends_by_id(filepath, reads, maxlengthtelo, index):
+        rawcount = rawCountPattern_ends(seq_start, seq_end, compiled_patterns, windowSize, slide, trimfirst, maxlengthtelo, tail=tails.get(read_id))
+        yield read_id, pd.DataFrame(rawcount, columns=['tail', 'position', 'pattern', 'count'])
+
+def rawCountPattern(filepath, read, pattern_telo, windowSize, slide, trimfirst, cut_length, minSeqLength, maxlengthtelo, tail=None, plot_raw=False, index=None):
     '''
     To get raw count of telomere-like repeat in the sequence
     filepath: location of fasta file
@@ -366,10 +911,12 @@ def rawCountPattern(filepath, read, pattern_telo, windowSize, slide, trimfirst,
     slide: step of each window
     region: cut the sequence - in telomere, just check for first 5000 bp
     trimfirst: number of nucleotide trim off 
+    index: optional, byte offset index of filepath (from load_read_index). Used by default if filepath + ".idx" exists
 
     return: raw count  
     '''
 
+    import pandas as pd
     # Loop through reads in file, find interested read. Then find their matches and plot 
     if not isinstance(read, str):
         print("can only read in 1 read at a time")
@@ -378,56 +925,30 @@ def rawCountPattern(filepath, read, pattern_telo, windowSize, slide, trimfirst,
     patterns = patterns_to_search(pattern_telo, cut_length=cut_length)
     compiled_patterns = [re.compile(pattern) for pattern in patterns]
 
-    sequences = unzip_file(filepath)
-    if sequences is None:
-        print("Problem in filepath, please double check")
-        return ["didn't run", filepath, 0]
+    sequences = list(read_ends_by_id(filepath, [read], maxlengthtelo, index))
 
     rawcount_all = []
 
-    for seq in sequences:
-        if seq.id != read or windowSize is None:
+    for read_id, length, seq_start, seq_end in sequences:
+        if read_id != read or windowSize is None:
             continue
 
-        # print('working on:', seq.id)
-
-        # check both ends of the read to find telo boundary 
-        seq_start = str(seq.seq[trimfirst:maxlengthtelo]).upper()
-        seq_end = str(seq.seq[::-1]).upper()[trimfirst:maxlengthtelo]
-
-        windows_start = seq_cut_windows(seq_start, windowSize, slide)
-        windows_end = seq_cut_windows(seq_end, windowSize, slide)
-
-        rawpattern_s = [
-            ("forward", start, pattern.pattern, len([m.start() for m in pattern.finditer(seq_cut)]) or 1)
-            for start, seq_cut in windows_start
-            for pattern in compiled_patterns
-        ]
-
-        rawpattern_e = [
-            ("reverse", start, pattern.pattern, len([m.start() for m in pattern.finditer(seq_cut_2)]) or 1)
-            for start, seq_cut_2 in windows_end
-            for pattern in compiled_patterns
-        ]
-
-        if tail == 'forward':
-            rawpattern_e = []
-        elif tail == 'reverse':
-            rawpattern_s = []
-
-        rawcount_all.extend(rawpattern_s)
-        rawcount_all.extend(rawpattern_e)
+        # print('working on:', read_id)
+        rawcount_all.extend(rawCountPattern_ends(seq_start, seq_end, compiled_patterns, windowSize, slide, trimfirst, maxlengthtelo, tail=tail))
 
     plot_raw=False
+    if plot_raw:
+        sns = seaborn()
+        plt = pyplot()
     if (tail == 'forward' or tail is None) and plot_raw==True:
         sns.set_style("whitegrid", {'grid.color': 'grey', 'grid.linestyle': '--'})
         fig, ax = plt.subplots(figsize=(12, 8))
         read_ids = []
         added_labels = set()
 
-        for seqraw in sequences:
-            if len(seqraw.seq) > maxlengthtelo and seqraw.id == read:
-                seq = str(seqraw.seq[:maxlengthtelo]).upper()
+        for read_id, length, seq_start, seq_end in sequences:
+            if length > maxlengthtelo and read_id == read:
+                seq = seq_start[:maxlengthtelo]
                 plot_patterns(seq, patterns, read_ids, added_labels, ax, "forward")
 
         ax.set_title(f'Matches of telomere phrases in {read} forward')
@@ -446,9 +967,9 @@ def rawCountPattern(filepath, read, pattern_telo, windowSize, slide, trimfirst,
         read_ids = []
         added_labels = set()
 
-        for seqraw in sequences:
-            if len(seqraw.seq) > maxlengthtelo and seqraw.id == read:
-                seq_2 = str(seqraw.seq[::-1][:maxlengthtelo]).upper()
+        for read_id, length, seq_start, seq_end in sequences:
+            if length > maxlengthtelo and read_id == read:
+                seq_2 = seq_end[:maxlengthtelo]
                 plot_patterns(seq_2, patterns, read_ids, added_labels, ax, "reverse")
 
         ax.set_title(f'Matches of telomere phrases in {read} reverse')
@@ -484,6 +1005,7 @@ def fit_quadratic_and_find_vertex(trc_list, telo_length_list,inputtrc,median_trc
         
     #plot trc vs telomere length fit
     if save_path:
+        plt = pyplot()
         x_fit = np.linspace(min(trc_arr), max(trc_arr), 100)
         y_fit = a * x_fit**2 + b * x_fit + c
         plt.figure(figsize=(7, 5))
@@ -499,4 +1021,24 @@ def fit_quadratic_and_find_vertex(trc_list, telo_length_list,inputtrc,median_trc
             plt.savefig(save_path, dpi=300)
         plt.close()
 
-    return vertex_x, vertex_y, coeffs
\ No newline at end of file
+    return vertex_x, vertex_y, coeffs
+
+def cutoff_sweep(trc_list, telo_length_list, cutoffs):
+    '''
+    Number of reads and median telomere length over many TRC cutoffs at once, from reads sorted by TRC
+    trc_list: TRC of each read
+    telo_length_list: telomere length of each read
+    cutoffs: list of TRC cutoffs, a read is kept if its TRC > cutoff (same as step 1)
+    return: list of (cutoff, number of reads, median telomere length or nan)
+    '''
+    trc_arr = np.asarray(trc_list, dtype=float)
+    order = np.argsort(trc_arr, kind="stable")
+    trc_sorted = trc_arr[order]
+    telo_sorted = np.asarray(telo_length_list, dtype=float)[order]
+    starts = np.searchsorted(trc_sorted, cutoffs, side="right")
+
+    sweep = []
+    for cutoff, start in zip(cutoffs, starts):
+        n_reads = len(trc_sorted) - start
+        sweep.append((float(cutoff), int(n_reads), float(np.median(telo_sorted[start:])) if n_reads else float("nan")))
+    return sweep
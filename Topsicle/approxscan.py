@@ -0,0 +1,138 @@
+# Topsicle
+# approximate repeat scanning engine (--scanmode approx)
+# instead of enumerating every k-mer of the repeat and counting each exactly, the full repeat unit (and its complement,
+# for the flipped read end) is matched with up to max_errors substitutions, insertions or deletions, with Myers'
+# bit-parallel algorithm: the dynamic programming column of the unit against the read is kept as bit vectors
+# (one uint64 per sequence and unit), and every base of the read is one round of a few bit operations.
+# sequences are cut into overlapping segments and all segments of all sequences go through the same numpy
+# operations, so one pass over a batch of read ends (or one long read end) costs SEGMENT + overlap rounds.
+# an occurrence of the unit is a run of consecutive end positions with at most max_errors errors, counted at its
+# first end position; counts feed TRC and the mean window values the same way k-mer counts do
+
+import numpy as np
+
+from Topsicle.kmercount import encode_seqs
+
+# longest repeat unit, it has to fit a uint64 bit vector
+MAX_UNIT = 63
+# length of the segments sequences are cut into
+SEGMENT = 256
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+def approx_patterns(telopattern):
+    '''
+    Units matched in approx mode: the repeat unit and its complement (the telomere at the flipped end of a read)
+    telopattern: str, repeat unit such as CCCTAAA
+    '''
+    if not isinstance(telopattern, str) or "|" in telopattern or not telopattern or set(telopattern.upper()) - set("ACGT"):
+        raise ValueError(f"--scanmode approx needs a plain A/C/G/T repeat unit, got {telopattern}")
+    unit = telopattern.upper()
+    return [unit, unit.translate(COMPLEMENT)]
+
+def max_errors_allowed(unit_length):
+    '''
+    Most errors that keep two neighbouring occurrences of a unit in a tandem repeat apart (2 * errors + 1 < unit length)
+    '''
+    return max((unit_length - 2) // 2, 0)
+
+def approx_table(patterns, max_errors):
+    '''
+    Prepare the units for matching
+    patterns: list of units of the same length (A/C/G/T only), from approx_patterns
+    max_errors: most substitutions, insertions and deletions in an occurrence
+    return: dict with the units, their length m, max_errors and peq, the bit mask of each base in each unit (code 4, N, matches nothing)
+    '''
+    m = len(patterns[0])
+    if m > MAX_UNIT or any(len(pattern) != m for pattern in patterns):
+        raise ValueError(f"repeat units must have the same length, at most {MAX_UNIT} bp")
+    if not 0 <= max_errors <= max_errors_allowed(m):
+        raise ValueError(f"--maxerrors must be between 0 and {max_errors_allowed(m)} for a {m} bp repeat unit")
+    peq = np.zeros((5, len(patterns)), dtype=np.uint64)
+    for j, pattern in enumerate(patterns):
+        for i, base in enumerate(pattern):
+            peq["ACGT".index(base), j] |= np.uint64(1 << i)
+    return {"patterns": list(patterns), "m": m, "max_errors": max_errors, "peq": peq}
+
+def is_approx_table(table):
+    return table is not None and "max_errors" in table
+
+def myers_hits(encoded, table):
+    '''
+    Myers bit-parallel search of every unit in every row of encoded
+    encoded: uint8 array (rows, length) from encode_seqs
+    return: bool array (rows, number of units, length), True where an occurrence with at most max_errors errors ends
+    '''
+    rows, length = encoded.shape
+    n_units = table["peq"].shape[1]
+    m = table["m"]
+    mask = np.uint64((1 << m) - 1)
+    high = np.uint64(1 << (m - 1))
+    one = np.uint64(1)
+    pv = np.full((rows, n_units), mask, dtype=np.uint64)
+    mv = np.zeros((rows, n_units), dtype=np.uint64)
+    score = np.full((rows, n_units), m, dtype=np.int16)
+    hits = np.zeros((rows, n_units, length), dtype=bool)
+    for t in range(length):
+        eq = table["peq"][encoded[:, t]]
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        score += (ph & high) != 0
+        score -= (mh & high) != 0
+        # the read can start anywhere, so the top row stays 0 (no carry in)
+        ph = (ph << one) & mask
+        mh = (mh << one) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        hits[:, :, t] = score <= table["max_errors"]
+    return hits
+
+def approx_ends(seqs, table, segment=SEGMENT):
+    '''
+    Where each occurrence of each unit ends, in many sequences
+    seqs: list of str, upper case
+    return: bool array (number of sequences, number of units, longest sequence), True at the first end position of each occurrence
+    '''
+    n_units = table["peq"].shape[1]
+    width = max((len(seq) for seq in seqs), default=0)
+    if width == 0:
+        return np.zeros((len(seqs), n_units, 0), dtype=bool)
+    # an occurrence spans at most m + max_errors bases, so each segment starts that many bases early
+    overlap = table["m"] + table["max_errors"]
+    n_segments = -(-width // segment)
+    encoded = np.full((len(seqs), overlap + n_segments * segment), 4, dtype=np.uint8)
+    encoded[:, overlap:overlap + width] = encode_seqs(seqs, width)
+    windows = np.lib.stride_tricks.sliding_window_view(encoded, overlap + segment, axis=1)[:, ::segment]
+    hits = myers_hits(windows.reshape(-1, overlap + segment), table)[:, :, overlap:]
+    hits = hits.reshape(len(seqs), n_segments, n_units, segment).transpose(0, 2, 1, 3).reshape(len(seqs), n_units, -1)[:, :, :width]
+
+    # one occurrence gives a run of neighbouring end positions (the unit with one base more or less), keep its first
+    starts = hits.copy()
+    starts[:, :, 1:] &= ~hits[:, :, :-1]
+    return starts
+
+def approx_count_matrix(seqs, table):
+    '''
+    Count the occurrences of every unit in many sequences in one pass
+    return: int array (number of sequences, number of units), like kmercount.kmer_count_matrix
+    '''
+    if not seqs:
+        return np.zeros((0, len(table["patterns"])), dtype=np.intp)
+    return approx_ends(seqs, table).sum(axis=2).astype(np.intp)
+
+def approx_window_counts(seq, table, window_size, step):
+    '''
+    Count the occurrences of every unit in all sliding windows of seq, like kmercount.kmer_window_counts:
+    windows are seq[i:i + window_size - 1] and an occurrence is in a window if its first end position is at least
+    m - 1 bases into the window
+    return: window starts (int array) and counts (number of windows, number of units)
+    '''
+    m = table["m"]
+    starts = np.arange(0, len(seq) - window_size + 1, step)
+    ends = approx_ends([seq], table)[0].T
+    end_sums = np.zeros((len(seq) + 1, ends.shape[1]), dtype=np.int64)
+    np.cumsum(ends, axis=0, out=end_sums[1:])
+    lo = np.minimum(starts + m - 1, len(seq))
+    hi = np.maximum(np.minimum(starts + window_size - 1, len(seq)), lo)
+    return starts, end_sums[hi] - end_sums[lo]
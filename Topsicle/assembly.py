@@ -0,0 +1,278 @@
+# Topsicle
+# assembly mode (--assembly): telomere length at both ends of every contig of genome assemblies (fasta)
+# contigs are chromosome sized, so they are never read as a whole. The samtools .fai index (built next to the fasta
+# when it is missing) says where the bases of each contig are and how its lines are wrapped, the fasta is memory mapped
+# and only the first/last maxlengthtelo base pairs of each contig are sliced out of it.
+# a bgzipped fasta is read through its .gzi index (also built when missing), only the BGZF blocks that hold contig ends are inflated.
+# each contig end is then checked like a read end: TRC of its first 1000 bp, and the boundary (step 2) if it is over the cutoff
+
+import bisect
+import mmap
+import os
+import numpy as np
+
+from Topsicle.bgzf import is_gzip, is_bgzf, bgzf_chunks, load_gzi, inflate_block
+from Topsicle.fastreader import make_ends
+
+# bytes of the fasta scanned at a time while building the .fai
+CHUNK_SIZE = 1 << 24
+NEWLINE, CARRIAGE_RETURN, HEADER = ord("\n"), ord("\r"), ord(">")
+
+class FaiBuilder:
+    '''
+    Build the .fai index of a fasta from its content, given in chunks of any size (so it works on the inflated blocks of a bgzipped fasta).
+    Lines are found with numpy, only header lines are looked at one by one.
+    Like samtools faidx, all sequence lines of a contig must have the same length, except the last one
+    '''
+    def __init__(self):
+        self.entries = []
+        self.contig = None
+        self.pos = 0  # offset of the next chunk in the fasta
+        # line that is not finished at the end of the last chunk: length, first and last byte, text if it is a header
+        self.partial_len = 0
+        self.partial_first = None
+        self.partial_last = None
+        self.partial_header = None
+
+    def extend(self, chunk, start, end):
+        if end <= start:
+            return
+        if self.partial_len == 0:
+            self.partial_first = chunk[start]
+            self.partial_header = bytearray() if self.partial_first == HEADER else None
+        if self.partial_header is not None:
+            self.partial_header += chunk[start:end]
+        self.partial_last = chunk[end - 1]
+        self.partial_len += end - start
+
+    def end_line(self, next_offset):
+        if self.partial_len and self.partial_first == HEADER:
+            self.header(bytes(self.partial_header), next_offset)
+        else:
+            lengths = np.array([self.partial_len], dtype=np.int64)
+            self.seq_lines(lengths, lengths - (self.partial_len > 0 and self.partial_last == CARRIAGE_RETURN))
+        self.partial_len = 0
+        self.partial_header = None
+
+    def header(self, line, next_offset):
+        self.close_contig()
+        words = line[1:].split(None, 1)
+        self.contig = {"name": words[0].decode("utf-8", "replace") if words else "", "offset": next_offset,
+                       "linebases": None, "linewidth": None, "length": 0, "ended": False}
+
+    def seq_lines(self, lengths, bases):
+        '''
+        lengths: bytes of each line without the line break, bases: base pairs of each line (without a trailing \\r)
+        '''
+        contig = self.contig
+        if contig is None:
+            if bases.any():
+                raise ValueError("fasta has sequence before its first header")
+            return
+        if contig["linebases"] is None:
+            # the first sequence line sets the line length, blank lines before it are left out
+            filled = np.flatnonzero(bases > 0)
+            if len(filled) == 0:
+                return
+            lengths, bases = lengths[filled[0]:], bases[filled[0]:]
+            contig["linebases"], contig["linewidth"] = int(bases[0]), int(lengths[0]) + 1
+        if contig["ended"]:
+            # after the short last line of a contig, only blank lines
+            if bases.any():
+                raise ValueError(f"Different line length in sequence '{contig['name']}', can not index the fasta")
+        else:
+            short = np.flatnonzero((lengths + 1 != contig["linewidth"]) | (bases != contig["linebases"]))
+            if len(short):
+                first = short[0]
+                if bases[first] > contig["linebases"] or bases[first + 1:].any():
+                    raise ValueError(f"Different line length in sequence '{contig['name']}', can not index the fasta")
+                contig["ended"] = True
+        contig["length"] += int(bases.sum())
+
+    def close_contig(self):
+        if self.contig is not None:
+            contig = self.contig
+            self.entries.append((contig["name"], contig["length"], contig["offset"], contig["linebases"] or 0, contig["linewidth"] or 0))
+        self.contig = None
+
+    def feed(self, chunk):
+        '''
+        Index the next chunk (bytes) of the fasta
+        '''
+        arr = np.frombuffer(chunk, dtype=np.uint8)
+        breaks = np.flatnonzero(arr == NEWLINE)
+        if len(breaks) == 0:
+            self.extend(chunk, 0, len(chunk))
+            self.pos += len(chunk)
+            return
+        # the first line can have started in an earlier chunk
+        self.extend(chunk, 0, breaks[0])
+        self.end_line(self.pos + int(breaks[0]) + 1)
+
+        # lines that start and end in this chunk, cut at the headers
+        starts, ends = breaks[:-1] + 1, breaks[1:]
+        lengths = ends - starts
+        nonempty = lengths > 0
+        firsts = np.where(nonempty, arr[np.minimum(starts, len(arr) - 1)], 0)
+        lasts = np.where(nonempty, arr[ends - 1], 0)
+        bases = lengths - (lasts == CARRIAGE_RETURN)
+        previous = 0
+        for h in np.flatnonzero(firsts == HEADER).tolist() + [len(starts)]:
+            if h > previous:
+                self.seq_lines(lengths[previous:h], bases[previous:h])
+            if h < len(starts):
+                self.header(bytes(chunk[starts[h]:ends[h]]), self.pos + int(ends[h]) + 1)
+            previous = h + 1
+
+        self.extend(chunk, int(breaks[-1]) + 1, len(chunk))
+        self.pos += len(chunk)
+
+    def finish(self):
+        '''
+        return: list of .fai entries (contig name, length, offset of the first base, bases per line, bytes per line)
+        '''
+        if self.partial_len:
+            self.end_line(self.pos)
+        self.close_contig()
+        return self.entries
+
+def check_compression(fasta):
+    '''
+    Contig ends can only be found in a plain or bgzipped fasta, plain gzip can not be read from the middle
+    '''
+    if is_gzip(fasta) and not is_bgzf(fasta):
+        raise ValueError(f"{fasta} is gzip compressed, compress the assembly with bgzip (or decompress it)")
+
+def fai_chunks(fasta, threads=None):
+    '''
+    Content of a plain or bgzipped fasta, in chunks
+    '''
+    if is_bgzf(fasta):
+        yield from bgzf_chunks(fasta, threads)
+        return
+    with open(fasta, "rb") as handle:
+        while True:
+            chunk = handle.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+def write_fai(fasta, entries):
+    '''
+    Save the .fai index of fasta, same format as samtools faidx
+    '''
+    tmp_path = fasta + ".fai.tmp"
+    with open(tmp_path, "w") as handle:
+        for entry in entries:
+            handle.write("\t".join(str(value) for value in entry) + "\n")
+    os.replace(tmp_path, fasta + ".fai")
+
+def build_fai(fasta, threads=None):
+    '''
+    Scan a plain or bgzipped fasta once and save its .fai index
+    threads: number of decompression threads for a bgzipped fasta
+    return: list of (contig name, length, offset, bases per line, bytes per line)
+    '''
+    check_compression(fasta)
+    builder = FaiBuilder()
+    for chunk in fai_chunks(fasta, threads):
+        builder.feed(chunk)
+    entries = builder.finish()
+    write_fai(fasta, entries)
+    return entries
+
+def load_fai(fasta, threads=None):
+    '''
+    Load the .fai index of fasta (samtools faidx), (re)build it if it is missing or older than the fasta
+    return: list of (contig name, length, offset, bases per line, bytes per line), in file order
+    '''
+    check_compression(fasta)
+    fai_path = fasta + ".fai"
+    if not os.path.exists(fai_path) or os.path.getmtime(fai_path) < os.path.getmtime(fasta):
+        return build_fai(fasta, threads)
+
+    entries = []
+    with open(fai_path) as handle:
+        for line in handle:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 5:
+                entries.append((fields[0], *[int(value) for value in fields[1:5]]))
+    return entries
+
+class IndexedFasta:
+    '''
+    Random access to the bases of a fasta with its .fai index: memory mapped when it is plain,
+    through the .gzi index when it is bgzipped (only the blocks holding the bases asked for are inflated)
+    '''
+    def __init__(self, fasta, threads=None):
+        self.index = load_fai(fasta, threads)
+        self.handle = open(fasta, "rb")
+        size = os.fstat(self.handle.fileno()).st_size
+        self.map = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.blocks = None
+        if is_bgzf(fasta):
+            pairs = load_gzi(fasta)
+            self.blocks = {"compressed": [compressed for compressed, uncompressed in pairs] + [size],
+                           "uncompressed": [uncompressed for compressed, uncompressed in pairs]}
+
+    def raw(self, start, end):
+        '''
+        Bytes start to end of the (uncompressed) fasta
+        '''
+        if self.blocks is None:
+            return self.map[start:end]
+        compressed, uncompressed = self.blocks["compressed"], self.blocks["uncompressed"]
+        i = max(bisect.bisect_right(uncompressed, start) - 1, 0)
+        first = uncompressed[i]
+        data = []
+        while i < len(uncompressed) and uncompressed[i] < end:
+            data.append(inflate_block(self.map[compressed[i]:compressed[i + 1]]))
+            i += 1
+        return b"".join(data)[start - first:end - first]
+
+    def bases(self, entry, start, end):
+        '''
+        Base pairs start to end of a contig, as they are in the fasta (bytes, without line breaks)
+        entry: .fai entry of the contig
+        '''
+        name, length, offset, linebases, linewidth = entry
+        if end <= start:
+            return b""
+        first = offset + (start // linebases) * linewidth + start % linebases
+        last = offset + ((end - 1) // linebases) * linewidth + (end - 1) % linebases
+        data = self.raw(first, last + 1)
+        return data.translate(None, b"\r\n") if linewidth > linebases else data
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def contig_ends(fasta, span, read_length=0, threads=None):
+    '''
+    Ends of every contig longer than read_length of a plain or bgzipped fasta, without reading the contigs
+    span: number of base pairs to keep at each end
+    threads: number of decompression threads, only used to build the .fai of a bgzipped fasta
+    yield: (contig name, contig length, first span base pairs, last span base pairs flipped), upper case, like fastreader.iter_ends
+    '''
+    with IndexedFasta(fasta, threads) as indexed:
+        for entry in indexed.index:
+            name, length = entry[0], entry[1]
+            if length <= read_length or length == 0:
+                continue
+            keep = min(span, length)
+            head = indexed.bases(entry, 0, keep)
+            tail = indexed.bases(entry, length - keep, length)
+            yield make_ends(name, length, head, tail, span)
+
+def is_index_file(filepath):
+    '''
+    True for the index files next to a fasta (.fai, .gzi), left out when a folder of assemblies is the input
+    '''
+    return filepath.endswith((".fai", ".gzi", ".fai.tmp", ".gzi.tmp"))
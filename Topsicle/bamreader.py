@@ -0,0 +1,142 @@
+# Topsicle
+# unaligned BAM (uBAM) input, as written by the ONT basecallers, read without samtools or pysam
+# a BAM file is BGZF compressed (inflated block-parallel by bgzf.open_gzip), then a header and one binary record per read.
+# each record is read into a buffer reused from read to read, and only the first/last span base pairs of its sequence
+# (4 bits per base) are decoded, quality values and tags are skipped.
+# secondary and supplementary records are left out, a record on the reverse strand (aligned BAM) is turned back to the read as sequenced
+
+import struct
+import numpy as np
+
+from Topsicle.bgzf import is_bgzf, bgzf_blocks, inflate_block, open_gzip
+
+BAM_MAGIC = b"BAM\x01"
+# refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq, next_refID, next_pos, tlen
+RECORD_FIELDS = struct.Struct("<iiBBHHHiiii")
+FLAG_REVERSE = 0x10
+FLAG_SECONDARY = 0x100
+FLAG_SUPPLEMENTARY = 0x800
+# base of each 4 bit code
+SEQ_CODES = np.frombuffer(b"=ACMGRSVTWYHKDBN", dtype=np.uint8)
+COMPLEMENT = bytes.maketrans(b"ACGTMRWSYKVHDBN", b"TGCAKYWSRMBDHVN")
+# fastq text of each phred quality value
+QUAL_TEXT = bytes(min(value + 33, 126) for value in range(256))
+
+def is_bam(filepath):
+    '''
+    True if the file is BAM: BGZF compressed, and its content starts with the BAM magic bytes
+    '''
+    if not is_bgzf(filepath):
+        return False
+    with open(filepath, "rb") as handle:
+        block = next(bgzf_blocks(handle), None)
+    return block is not None and inflate_block(block)[:4] == BAM_MAGIC
+
+def read_exactly(handle, size):
+    data = handle.read(size)
+    if len(data) < size:
+        raise ValueError("Truncated BAM file")
+    return data
+
+def skip_header(handle):
+    '''
+    Read the BAM header (text and reference list), the handle is then at the first record
+    '''
+    if read_exactly(handle, 4) != BAM_MAGIC:
+        raise ValueError("Not a BAM file")
+    l_text = struct.unpack("<i", read_exactly(handle, 4))[0]
+    read_exactly(handle, l_text)
+    n_ref = struct.unpack("<i", read_exactly(handle, 4))[0]
+    for _ in range(n_ref):
+        l_name = struct.unpack("<i", read_exactly(handle, 4))[0]
+        read_exactly(handle, l_name + 4)
+
+def bam_records(handle):
+    '''
+    Records of a BAM handle, after skip_header
+    yield: (memoryview of the record (without its block_size), read name, flag, sequence length, offset of the sequence in the record).
+           The record is only valid until the next one is read
+    '''
+    buffer = bytearray(1 << 16)
+    while True:
+        size_bytes = handle.read(4)
+        if not size_bytes:
+            return
+        if len(size_bytes) < 4:
+            raise ValueError("Truncated BAM file")
+        block_size = struct.unpack("<i", size_bytes)[0]
+        if block_size > len(buffer):
+            # a new buffer instead of resizing, the old one may still be viewed
+            buffer = bytearray(max(block_size, 2 * len(buffer)))
+        view = memoryview(buffer)[:block_size]
+        got = 0
+        while got < block_size:
+            n = handle.readinto(view[got:])
+            if not n:
+                raise ValueError("Truncated BAM file")
+            got += n
+        ref_id, pos, l_read_name, mapq, bin_, n_cigar_op, flag, l_seq, next_ref_id, next_pos, tlen = RECORD_FIELDS.unpack_from(buffer, 0)
+        name = bytes(view[32:32 + l_read_name - 1]).decode("utf-8", "replace")
+        yield view, name, flag, l_seq, 32 + l_read_name + 4 * n_cigar_op
+
+def decode_bases(record, seq_offset, start, end):
+    '''
+    Base pairs start to end of the 4 bit encoded sequence at seq_offset in record
+    return: bytes, upper case
+    '''
+    if end <= start:
+        return b""
+    first = start // 2
+    packed = np.frombuffer(record, dtype=np.uint8, count=(end + 1) // 2 - first, offset=seq_offset + first)
+    bases = np.empty(2 * len(packed), dtype=np.uint8)
+    bases[0::2] = SEQ_CODES[packed >> 4]
+    bases[1::2] = SEQ_CODES[packed & 15]
+    skip = start % 2
+    return bases[skip:skip + end - start].tobytes()
+
+def primary(flag):
+    return not flag & (FLAG_SECONDARY | FLAG_SUPPLEMENTARY)
+
+def bam_ends(handle, span, read_length=0):
+    '''
+    Ends of every read longer than read_length in a BAM handle (after skip_header), only the ends are decoded
+    yield: (read id, read length, first span base pairs, last span base pairs flipped), upper case, like fastreader.iter_ends
+    '''
+    for record, name, flag, length, seq_offset in bam_records(handle):
+        if not primary(flag) or length <= read_length or length == 0:
+            continue
+        keep = min(span, length)
+        head = decode_bases(record, seq_offset, 0, keep)
+        tail = decode_bases(record, seq_offset, length - keep, length)[::-1]
+        if flag & FLAG_REVERSE:
+            # the stored sequence is the reverse complement of the read
+            head, tail = tail.translate(COMPLEMENT), head.translate(COMPLEMENT)
+        yield (name, length, head.decode("latin-1"), tail.decode("latin-1"))
+
+def bam_reads(handle, wanted):
+    '''
+    Whole reads of a BAM handle (after skip_header) whose name is in wanted, the others are not decoded
+    yield: (read id, sequence, quality as fastq text (phred + 33, "!" when the record has none)), as sequenced
+    '''
+    for record, name, flag, length, seq_offset in bam_records(handle):
+        if not primary(flag) or name not in wanted:
+            continue
+        seq = decode_bases(record, seq_offset, 0, length)
+        qual_offset = seq_offset + (length + 1) // 2
+        qual = bytes(record[qual_offset:qual_offset + length])
+        qual = b"!" * length if length and qual[0] == 0xFF else qual.translate(QUAL_TEXT)
+        if flag & FLAG_REVERSE:
+            seq, qual = seq[::-1].translate(COMPLEMENT), qual[::-1]
+        yield name, seq.decode("latin-1"), qual.decode("latin-1")
+
+def open_bam(filepath, threads=None):
+    '''
+    Open a BAM file with its blocks inflated in parallel (see bgzf.open_gzip), positioned at the first record
+    '''
+    handle = open_gzip(filepath, threads)
+    try:
+        skip_header(handle)
+    except Exception:
+        handle.close()
+        raise
+    return handle
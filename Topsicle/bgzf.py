@@ -0,0 +1,290 @@
+# Topsicle
+# gzip input without a single-threaded bottleneck
+# BGZF (what bgzip writes) is a series of independent gzip blocks of at most 64 kb, so blocks are inflated in parallel
+# on a thread pool (zlib releases the GIL) and put back in order. The block boundaries come from the .gzi index
+# (bgzip -i) when there is one, otherwise from the block headers.
+# plain gzip can not be split, so it is inflated on a background thread that runs ahead of the parser.
+
+import gzip
+import io
+import os
+import queue
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+GZIP_MAGIC = b"\x1f\x8b"
+# gzip header with FEXTRA set, BGZF puts the block size in the "BC" extra subfield
+BGZF_HEADER = b"\x1f\x8b\x08\x04"
+HEADER_SIZE = 18
+# size of the chunks read from plain gzip
+CHUNK_SIZE = 1 << 20
+
+def default_threads():
+    '''
+    Number of decompression threads when none is given: available cores, at most 8
+    '''
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(1, min(cores, 8))
+
+def is_gzip(filepath):
+    '''
+    True if the file starts with the gzip magic bytes
+    '''
+    with open(filepath, "rb") as handle:
+        return handle.read(2) == GZIP_MAGIC
+
+def block_size(header):
+    '''
+    Total size of a BGZF block from its first bytes (at least the fixed header and the extra field)
+    return: int, or None if the header is not a BGZF block header
+    '''
+    if len(header) < HEADER_SIZE or not header.startswith(BGZF_HEADER):
+        return None
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = header[12:12 + xlen]
+    pos = 0
+    while pos + 4 <= len(extra):
+        si, slen = extra[pos:pos + 2], struct.unpack("<H", extra[pos + 2:pos + 4])[0]
+        if si == b"BC" and slen == 2:
+            return struct.unpack("<H", extra[pos + 4:pos + 6])[0] + 1
+        pos += 4 + slen
+    return None
+
+def is_bgzf(filepath):
+    '''
+    True if the file is BGZF compressed (bgzip output), which can be inflated block by block in parallel
+    '''
+    with open(filepath, "rb") as handle:
+        header = handle.read(HEADER_SIZE)
+    return block_size(header) is not None
+
+def read_gzi_pairs(filepath):
+    '''
+    BGZF blocks from the .gzi index next to filepath (bgzip -i / samtools faidx)
+    return: sorted list of (compressed offset, uncompressed offset) of every block start (including (0, 0)), 
+            or None if there is no usable index
+    '''
+    gzi_path = filepath + ".gzi"
+    if not os.path.exists(gzi_path) or os.path.getmtime(gzi_path) < os.path.getmtime(filepath):
+        return None
+    with open(gzi_path, "rb") as handle:
+        data = handle.read()
+    if len(data) < 8:
+        return None
+    n = struct.unpack("<Q", data[:8])[0]
+    if len(data) < 8 + 16 * n:
+        return None
+    # pairs of (compressed offset, uncompressed offset), the first block at 0 is not listed
+    pairs = struct.unpack(f"<{2 * n}Q", data[8:8 + 16 * n])
+    return [(0, 0)] + list(zip(pairs[0::2], pairs[1::2]))
+
+def read_gzi(filepath):
+    '''
+    Compressed offsets of the BGZF blocks from the .gzi index next to filepath
+    return: sorted list of block start offsets (including 0), or None if there is no usable index
+    '''
+    pairs = read_gzi_pairs(filepath)
+    return None if pairs is None else [compressed for compressed, uncompressed in pairs]
+
+def build_gzi(filepath):
+    '''
+    Scan the block headers of a BGZF file and save its .gzi index (same as bgzip -r), blocks are not inflated:
+    the uncompressed size of a block is in its last 4 bytes
+    return: list of (compressed offset, uncompressed offset), same as read_gzi_pairs
+    '''
+    pairs = []
+    compressed, uncompressed = 0, 0
+    with open(filepath, "rb") as handle:
+        for block in bgzf_blocks(handle):
+            pairs.append((compressed, uncompressed))
+            compressed += len(block)
+            uncompressed += struct.unpack("<I", block[-4:])[0]
+    tmp_path = filepath + ".gzi.tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(struct.pack("<Q", len(pairs) - 1 if pairs else 0))
+        for pair in pairs[1:]:
+            handle.write(struct.pack("<QQ", *pair))
+    os.replace(tmp_path, filepath + ".gzi")
+    return pairs or [(0, 0)]
+
+def load_gzi(filepath):
+    '''
+    .gzi index of a BGZF file, built if it is missing or older than the file
+    return: list of (compressed offset, uncompressed offset), same as read_gzi_pairs
+    '''
+    pairs = read_gzi_pairs(filepath)
+    return pairs if pairs is not None else build_gzi(filepath)
+
+def bgzf_blocks(handle, offsets=None):
+    '''
+    Raw BGZF blocks of a binary handle, in file order
+    offsets: optional, block start offsets from read_gzi, so blocks are read in large runs without parsing headers
+    yield: bytes of each compressed block
+    '''
+    if offsets is not None:
+        file_size = os.fstat(handle.fileno()).st_size
+        bounds = list(offsets) + [file_size]
+        # read runs of blocks at once, then cut them
+        run = 64
+        for i in range(0, len(bounds) - 1, run):
+            starts = bounds[i:i + run + 1]
+            handle.seek(starts[0])
+            data = handle.read(starts[-1] - starts[0])
+            for a, b in zip(starts[:-1], starts[1:]):
+                yield data[a - starts[0]:b - starts[0]]
+        return
+
+    while True:
+        header = handle.read(12)
+        if not header:
+            return
+        if len(header) < 12 or not header.startswith(BGZF_HEADER):
+            raise ValueError("Not a BGZF block, file is corrupted or not bgzip compressed")
+        header += handle.read(struct.unpack("<H", header[10:12])[0])  # extra field, has the block size
+        size = block_size(header)
+        if size is None:
+            raise ValueError("Not a BGZF block, file is corrupted or not bgzip compressed")
+        block = header + handle.read(size - len(header))
+        if len(block) < size:
+            raise ValueError("Truncated BGZF block")
+        yield block
+
+def inflate_block(block):
+    '''
+    Decompress one BGZF block and check it against its CRC32 and size
+    '''
+    xlen = struct.unpack("<H", block[10:12])[0]
+    data = zlib.decompress(block[12 + xlen:-8], -15)
+    crc, isize = struct.unpack("<II", block[-8:])
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise ValueError("BGZF block failed CRC check")
+    return data
+
+def inflate_blocks(blocks):
+    '''
+    inflate_block on a list of blocks, so each thread pool task is big enough to be worth it
+    '''
+    return b"".join(inflate_block(block) for block in blocks)
+
+def bgzf_chunks(filepath, threads=None, blocks_per_task=16):
+    '''
+    Decompressed content of a BGZF file, blocks inflated in parallel
+    threads: number of decompression threads, default default_threads()
+    yield: bytes, in file order
+    '''
+    threads = threads or default_threads()
+    with open(filepath, "rb") as handle:
+        blocks = bgzf_blocks(handle, read_gzi(filepath))
+        if threads == 1:
+            for block in blocks:
+                yield inflate_block(block)
+            return
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            pending = deque()
+            task = []
+            for block in blocks:
+                task.append(block)
+                if len(task) >= blocks_per_task:
+                    pending.append(pool.submit(inflate_blocks, task))
+                    task = []
+                # keep a few tasks per thread ahead of the parser, not the whole file
+                while len(pending) > 2 * threads:
+                    yield pending.popleft().result()
+            if task:
+                pending.append(pool.submit(inflate_blocks, task))
+            while pending:
+                yield pending.popleft().result()
+
+def gzip_chunks(filepath, chunk_size=CHUNK_SIZE, read_ahead=8):
+    '''
+    Decompressed content of a plain gzip file, inflated on a background thread so it overlaps with parsing
+    read_ahead: number of chunks the thread can be ahead of the parser
+    yield: bytes, in file order
+    '''
+    chunks = queue.Queue(maxsize=read_ahead)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def inflate():
+        try:
+            with gzip.open(filepath, "rb") as handle:
+                while True:
+                    chunk = handle.read(chunk_size)
+                    if not chunk or not put(chunk):
+                        break
+            put(done)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=inflate, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # the parser can stop early, let the thread finish
+        stop.set()
+        thread.join()
+
+class ChunkReader(io.RawIOBase):
+    '''
+    Read-only binary stream over an iterator of bytes chunks, wrap it in io.BufferedReader for readline
+    '''
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.pos >= len(self.buffer):
+            self.buffer = next(self.chunks, None)
+            self.pos = 0
+            if self.buffer is None:
+                self.buffer = b""
+                return 0
+        n = min(len(b), len(self.buffer) - self.pos)
+        b[:n] = self.buffer[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed and hasattr(self.chunks, "close"):
+            self.chunks.close()
+        super().close()
+
+def open_gzip(filepath, threads=None):
+    '''
+    Open a gzip file for reading in binary mode: BGZF is inflated block-parallel, plain gzip on a background thread.
+    With 1 thread it is the same as gzip.open
+    threads: number of decompression threads, default default_threads()
+    '''
+    threads = threads or default_threads()
+    if is_bgzf(filepath):
+        return io.BufferedReader(ChunkReader(bgzf_chunks(filepath, threads)), buffer_size=CHUNK_SIZE)
+    if threads == 1:
+        return gzip.open(filepath, "rb")
+    return io.BufferedReader(ChunkReader(gzip_chunks(filepath)), buffer_size=CHUNK_SIZE)
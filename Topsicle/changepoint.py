@@ -0,0 +1,78 @@
+# Topsicle
+# changepoint detection on the mean window values (step 2)
+# native: exact single changepoint under the l2 cost in one pass with cumulative sums,
+#         gives the same breakpoint as rpt.Binseg(model="l2").fit(y).predict(pen=4, n_bkps=1)
+# ruptures: optional backend, for experiments with more than 1 breakpoint (pip install ruptures)
+
+import numpy as np
+
+# same defaults as ruptures Binseg
+MIN_SIZE = 2
+JUMP = 5
+
+def l2_error(signal, start, end):
+    '''
+    l2 cost of signal[start:end], computed the same way as ruptures CostL2 so near-ties are broken the same way
+    signal: array of shape (n_samples, 1)
+    '''
+    return signal[start:end].var(axis=0).sum() * (end - start)
+
+def single_changepoint(y, min_size=MIN_SIZE, jump=JUMP):
+    '''
+    Best single breakpoint of y under the l2 cost (least squared deviation)
+    y: list or array of mean window values
+    min_size: minimum number of windows in each segment
+    jump: only every jump-th window can be a breakpoint
+    return: index of the breakpoint (first window of the second segment), or None if there is no admissible one
+    '''
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    bkps = np.arange(0, n, jump)
+    bkps = bkps[(bkps >= min_size) & (n - bkps >= min_size)]
+    if n == 0 or len(bkps) == 0:
+        return None
+
+    # cost of [a, b) = sum of squares - square of sum / length, for every split at once
+    sums = np.concatenate(([0.0], np.cumsum(y)))
+    squares = np.concatenate(([0.0], np.cumsum(y * y)))
+    def cost(a, b):
+        return (squares[b] - squares[a]) - (sums[b] - sums[a]) ** 2 / (b - a)
+    gains = cost(0, n) - cost(0, bkps) - cost(bkps, n)
+
+    # cumulative sums carry rounding error, so recompute the splits that are (nearly) tied for best exactly,
+    # and break ties by the later breakpoint like Binseg does
+    tol = 1e-8 * (squares[-1] + 1.0)
+    close = bkps[gains >= gains.max() - tol]
+    signal = y.reshape(-1, 1)
+    segment_cost = l2_error(signal, 0, n)
+    gain, bkp = max((segment_cost - l2_error(signal, 0, b) - l2_error(signal, b, n), b) for b in close.tolist())
+    return bkp
+
+def ruptures_changepoints(y, n_bkps=1, pen=4):
+    '''
+    Breakpoints of y with ruptures Binseg (l2 cost), needs ruptures installed
+    return: list of breakpoint indexes, without the end of the signal
+    '''
+    try:
+        import ruptures as rpt
+    except ImportError:
+        raise ImportError("ruptures is not installed, use pip install ruptures or the native changepoint backend")
+    algo = rpt.Binseg(model="l2").fit(np.array(y))
+    return algo.predict(pen=pen, n_bkps=n_bkps)[:-1]
+
+def changepoints(y, backend="native", n_bkps=1, pen=4):
+    '''
+    Breakpoints of the mean window values y
+    backend: "native" (single breakpoint, no ruptures needed) or "ruptures"
+    n_bkps: number of breakpoints, native only does 1
+    pen: penalty, only used by ruptures
+    return: list of breakpoint indexes (empty if there is none)
+    '''
+    if backend == "ruptures":
+        return ruptures_changepoints(y, n_bkps=n_bkps, pen=pen)
+    if backend != "native":
+        raise ValueError(f"Unknown changepoint backend: {backend}")
+    if n_bkps != 1:
+        raise ValueError("native changepoint backend finds 1 breakpoint only, use backend='ruptures' for more")
+    bkp = single_changepoint(y)
+    return [] if bkp is None else [bkp]
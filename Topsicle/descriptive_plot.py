@@ -16,6 +16,7 @@ from Bio import SeqIO
 import logging
 
 import re
+from Topsicle.fastreader import iter_ends
 import seaborn as sns
 import matplotlib.pyplot as plt
 
@@ -112,16 +113,17 @@ def descriptive_plot(filepath, pattern, minSeqLength):
     read_ids=[]
     added_labels=set()
     iin=0
-    if unzip_file(filepath) == None: 
+    if not isinstance(filepath, str): 
         print('problem in filepath, can not have descriptive plot')
         return None 
-    for read in unzip_file(filepath):
-        if len(read.seq) > minSeqLength:   # length of sequence > minSeqLength, which default - 9kbp 
+    # only the ends of the reads are plotted, so read just those
+    for read_id, length, seq_start, seq_end in iter_ends(filepath, minSeqLength):
+        if length > minSeqLength:   # length of sequence > minSeqLength, which default - 9kbp 
             iin+=1
             
-            seq = str(read.seq[:minSeqLength]).upper()   # no need to plot all, just to some first kbp is enough to observe
-            read_ids.append(read.name)
-            seq_2 = str(read.seq[::-1][:minSeqLength]).upper() # comp strand (reverse of reverse comp)
+            seq = seq_start   # no need to plot all, just to some first kbp is enough to observe
+            read_ids.append(read_id)
+            seq_2 = seq_end # comp strand (reverse of reverse comp)
 
             # Loop through each pattern
             for i, pattern in enumerate(patterns):
@@ -253,17 +255,17 @@ def patterns_vs_match_heatmap (filepath, telopattern,telophrase,minSeqLength):
     matches=[]
     matches_2_list=[]
 
-    if unzip_file(filepath) == None: 
+    if not isinstance(filepath, str): 
         print('problem in filepath, can not have heatmap')
         return None 
     y_axis_order=set()
 
-    for read in unzip_file(filepath):
-        if len(read.seq) > minSeqLength: #and read.name=="55c8cfdf-b256-4fbc-b526-0191c4a4591c"
+    for read_id, length, seq_start, seq_end in iter_ends(filepath, 2000):
+        if length > minSeqLength: #and read_id=="55c8cfdf-b256-4fbc-b526-0191c4a4591c"
             read_ids=[]
-            seq = str(read.seq[100:2000]).upper()   # plot telomere patterns + matches from 100-2000bp positions
-            read_ids.append(read.name)
-            seq_2 = str(read.seq[::-1][100:2000]).upper()
+            seq = seq_start[100:2000]   # plot telomere patterns + matches from 100-2000bp positions
+            read_ids.append(read_id)
+            seq_2 = seq_end[100:2000]
             trans_table = str.maketrans('ACGT', 'TGCA')
     
             #translation for 2nd strand 
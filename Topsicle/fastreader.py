@@ -0,0 +1,260 @@
+# Topsicle
+# lightweight fastq/fasta reader that only keeps the ends of each read
+# TRC and boundary detection only look at the first/last few kbp and the read length, so there is no need
+# to build full SeqRecord objects (with quality arrays) for reads that can be 100 kb+ long.
+# parsing follows Bio.SeqIO: read id is the first word of the title, sequence lines are joined without spaces,
+# fastq quality lines are skipped by counting their length only.
+# a read can be 100-500 kb on one line, so lines are never stripped or reversed as a whole: only the first/last span
+# base pairs are copied out of the line (reversed and upper cased once), the rest is only measured
+
+import io
+import logging
+from Topsicle.bgzf import is_gzip, open_gzip, CHUNK_SIZE
+from Topsicle.bamreader import is_bam, open_bam, bam_ends
+
+def open_reads(filepath, threads=None):
+    '''
+    Open a fastq/fasta file (can be gzip or bgzip compressed) in binary mode
+    threads: number of decompression threads for compressed input, see bgzf.open_gzip
+    '''
+    # a line longer than the read buffer is put together from pieces (twice its size in memory), 
+    # so the buffer is as large as the one of the compressed readers
+    return open_gzip(filepath, threads) if is_gzip(filepath) else open(filepath, "rb", buffering=CHUNK_SIZE)
+
+def sniff_format(first_line):
+    '''
+    "fastq" or "fasta" from the first line of the file, None if it is neither
+    '''
+    if first_line.startswith(b"@"):
+        return "fastq"
+    if first_line.startswith(b">"):
+        return "fasta"
+    return None
+
+def title_id(title):
+    '''
+    Read id from the title line (without '@' or '>'), first word like SeqRecord.id
+    '''
+    words = title.split(None, 1)
+    return words[0].decode("utf-8", "replace") if words else ""
+
+WHITESPACE = b" \t\n\r\x0b\x0c"
+
+def stripped_length(line, start=0, end=None):
+    '''
+    Length of line[start:end] without its trailing whitespace, like len(line[start:end].rstrip()) without copying the line
+    '''
+    end = len(line) if end is None else end
+    while end > start and line[end - 1] in WHITESPACE:
+        end -= 1
+    return end - start
+
+def upper_text(raw):
+    # raw is a slice of bytes, or of a memoryview (copied here, only span base pairs).
+    # sequences are almost always upper case already, then there is nothing more to copy
+    raw = bytes(raw)
+    return (raw if raw.isupper() else raw.upper()).decode("latin-1")
+
+def make_ends(read_id, length, head, tail, span, head_end=None, tail_end=None):
+    '''
+    (read id, read length, first span base pairs, last span base pairs flipped), upper case
+    head: bytes (or memoryview), at least the first span base pairs (or the whole read)
+    tail: bytes (or memoryview), at least the last span base pairs (or the whole read)
+    head_end, tail_end: optional, where the sequence ends in head and tail (e.g. before the line break), default their length.
+                        Only the span base pairs of each end are copied, the tail is reversed while it is copied
+    '''
+    head_end = len(head) if head_end is None else head_end
+    tail_end = len(tail) if tail_end is None else tail_end
+    tail_start = max(tail_end - span, 0)
+    first = head[:min(span, head_end)]
+    # tail[tail_start:tail_end] reversed, in one slice (a stop of -1 would wrap around, None goes to the start)
+    last = tail[tail_end - 1:tail_start - 1 if tail_start else None:-1] if tail_end else b""
+    return (read_id, length, upper_text(first), upper_text(last))
+
+def skip_quality(handle, length, buffer):
+    '''
+    Read the first quality line(s) of a read of length (> 0) bases into buffer, a bytearray reused from read to read,
+    so a 500 kb quality line does not make a new bytes object. Quality lines are only counted, as in fastq_ends
+    return: (quality length read, next line)
+    '''
+    if len(buffer) < length:
+        buffer.extend(bytes(length - len(buffer)))
+    view = memoryview(buffer)
+    got = 0
+    while got < length:
+        n = handle.readinto(view[got:length])
+        if not n:
+            break
+        got += n
+    view.release()
+
+    last_break = buffer.rfind(b"\n", 0, got)
+    if last_break < 0:
+        # one line so far, it ends with the rest of the line (its line break, or more quality)
+        rest = handle.readline()
+        rest_length = stripped_length(rest)
+        return (got + rest_length if rest_length else stripped_length(buffer, 0, got)), handle.readline()
+
+    # wrapped quality: the length bytes have fewer than length quality values, so every line in them is quality
+    qual_length = 0
+    start = 0
+    while start <= last_break:
+        line_break = buffer.find(b"\n", start, got)
+        qual_length += stripped_length(buffer, start, line_break)
+        start = line_break + 1
+    qual_length += stripped_length(bytes(buffer[start:got]) + handle.readline())
+    return qual_length, handle.readline()
+
+def fastq_ends(handle, span, line=None):
+    '''
+    Ends of every read in a fastq handle, quality lines are skipped without being stored
+    handle: binary handle, positioned at a title line
+    span: number of base pairs to keep at each end
+    line: optional, first line if it was already read from handle
+    yield: (read id, read length, first span base pairs, last span base pairs flipped)
+    '''
+    if line is None:
+        line = handle.readline()
+    while line and line[:1] != b"@":  # skip anything before the first record
+        line = handle.readline()
+
+    qual_buffer = bytearray()
+    while line:
+        read_id = title_id(line[1:].rstrip())
+
+        # sequence, usually 1 line but can be wrapped, until the "+" line
+        seq_lines = []
+        line = handle.readline()
+        while line and line[:1] != b"+":
+            seq_lines.append(line)
+            line = handle.readline()
+        if not line:
+            raise ValueError(f"End of file without quality information for {read_id}")
+        if len(seq_lines) == 1:
+            # the line is used as it is, its end is found instead of stripping it
+            seq = seq_lines[0]
+            length = stripped_length(seq)
+        else:
+            seq = b"".join(seq_line.rstrip() for seq_line in seq_lines)
+            length = len(seq)
+
+        # quality, as many characters as the sequence. A quality line can start with "@" too,
+        # so a new record only starts once there is enough quality
+        if length:
+            qual_length, line = skip_quality(handle, length, qual_buffer)
+        else:
+            qual_length, line = 0, handle.readline()
+        while line and (qual_length < length or line[:1] != b"@"):
+            qual_length += stripped_length(line)
+            line = handle.readline()
+        if qual_length != length:
+            raise ValueError(f"Lengths of sequence and quality values differs for {read_id} ({length} and {qual_length}).")
+
+        yield make_ends(read_id, length, seq, seq, span, head_end=length, tail_end=length)
+
+def join_block(lines, length, head, tail, span):
+    '''
+    Add a block of fasta sequence lines to a read, keeping only its first and last span base pairs
+    return: (read length so far, head, tail)
+    '''
+    part = b"".join(lines).replace(b" ", b"").replace(b"\r", b"")
+    if len(head) < span:
+        head += part[:span - len(head)]
+    return length + len(part), head, (tail + part)[-span:]
+
+def fasta_ends(handle, span, line=None):
+    '''
+    Ends of every read in a fasta handle, only about span base pairs of each end are kept in memory
+    handle: binary handle
+    span: number of base pairs to keep at each end
+    line: optional, first line if it was already read from handle
+    yield: (read id, read length, first span base pairs, last span base pairs flipped)
+    '''
+    # sequence lines are joined in blocks, so a long read is never held in memory at once
+    block_size = max(4 * span, 1 << 16)
+    if line is None:
+        line = handle.readline()
+    while line and line[:1] != b">":  # skip anything before the first record
+        line = handle.readline()
+
+    while line:
+        read_id = title_id(line[1:].rstrip())
+        length, head, tail = 0, b"", b""
+        lines = []
+        pending = 0
+        line = b""
+        for line in handle:
+            if line[:1] == b">":
+                break
+            lines.append(line.rstrip())
+            pending += len(line)
+            if pending > block_size:
+                length, head, tail = join_block(lines, length, head, tail, span)
+                lines = []
+                pending = 0
+        else:
+            line = b""  # end of file
+        length, head, tail = join_block(lines, length, head, tail, span)
+        yield make_ends(read_id, length, head, tail, span)
+
+def record_ends(data, span):
+    '''
+    Ends of the read in data, one record read from an uncompressed fastq/fasta file at its byte offset (see allsteps.fetch_read_ends)
+    A 4 line fastq record (as written by Bio.SeqIO) is sliced in place, without copying its sequence or quality line,
+    anything else goes through parse_ends
+    yield: (read id, read length, first span base pairs, last span base pairs flipped)
+    '''
+    if data[:1] == b"@":
+        title_end = data.find(b"\n")
+        seq_end = data.find(b"\n", title_end + 1) if title_end >= 0 else -1
+        plus_end = data.find(b"\n", seq_end + 1) if seq_end >= 0 and data[seq_end + 1:seq_end + 2] == b"+" else -1
+        if plus_end >= 0 and data.find(b"\n", plus_end + 1, len(data) - 1) < 0:
+            view = memoryview(data)[title_end + 1:seq_end]
+            length = stripped_length(view)
+            if stripped_length(data, plus_end + 1) == length:
+                # empty reads are left out, same as parse_ends
+                if length:
+                    yield make_ends(title_id(data[1:title_end].rstrip()), length, view, view, span, head_end=length, tail_end=length)
+                return
+    yield from parse_ends(io.BytesIO(data), span)
+
+def iter_ends(filepath, span, read_length=0, threads=None):
+    '''
+    Ends of every read longer than read_length in a fastq/fasta file (can be .gz) or an unaligned BAM, without Bio.SeqIO
+    filepath: str, location of the file
+    span: number of base pairs to keep at each end
+    read_length: minimum length, shorter or equal reads are skipped
+    threads: number of decompression threads for compressed input, default bgzf.default_threads()
+    yield: (read id, read length, first span base pairs, last span base pairs flipped), upper case
+    '''
+    if not isinstance(filepath, str):
+        logging.error("Input must be a string representing the file path.")
+        return
+
+    try:
+        if is_bam(filepath):
+            with open_bam(filepath, threads) as handle:
+                yield from bam_ends(handle, span, read_length)
+            return
+        with open_reads(filepath, threads) as handle:
+            yield from parse_ends(handle, span, read_length)
+    except Exception as e:
+        logging.error(f"Error parsing file: {e}")
+
+def parse_ends(handle, span, read_length=0):
+    '''
+    iter_ends on an already open binary handle, the format is found from its first line
+    '''
+    line = handle.readline()
+    while line and not line.strip():  # skip blank lines at the start
+        line = handle.readline()
+    file_type = sniff_format(line)
+    if file_type is None:
+        if line:
+            logging.error("File type could not be determined or is unsupported.")
+        return
+
+    parser = fastq_ends if file_type == "fastq" else fasta_ends
+    for ends in parser(handle, span, line=line):
+        if ends[1] > read_length:
+            yield ends
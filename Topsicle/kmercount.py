@@ -0,0 +1,250 @@
+# Topsicle
+# vectorized k-mer counting engine
+# read ends are encoded as uint8 arrays (A/C/G/T -> 0..3) and every target k-mer is counted in one pass
+# with rolling 2-bit k-mer codes and a lookup table, instead of one regex scan per k-mer.
+# counts are the same as len(re.finditer(kmer, seq)), i.e. non-overlapping matches from the left.
+# count_bounds gives a cheap upper bound of the same counts from the 3-mer composition of the sequence,
+# used to skip the counting of read ends that can not reach the TRC cutoff
+
+import numpy as np
+
+# A/C/G/T -> 0..3, anything else -> 4, which breaks every k-mer over it (a regex never matches N either)
+BASE_CODE = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate(b"ACGT"):
+    BASE_CODE[base] = i
+
+# largest k-mer that still fits a lookup table indexed by k-mer code (4**10 entries)
+MAX_LOOKUP_K = 10
+# largest k-mer that fits a 2-bit code in uint64
+MAX_K = 31
+
+def is_plain_kmers(patterns):
+    '''
+    Check the patterns can go through the numpy engine: non-empty list of A/C/G/T strings, all of the same length
+    patterns: list of str, from patterns_to_search
+    '''
+    if not isinstance(patterns, list) or not patterns:
+        return False
+    k = len(patterns[0])
+    if k == 0 or k > MAX_K:
+        return False
+    return all(isinstance(p, str) and len(p) == k and set(p) <= set("ACGT") for p in patterns)
+
+def kmer_code(kmer):
+    '''
+    2-bit code of a k-mer, first base in the highest bits
+    '''
+    code = 0
+    for base in kmer.encode("ascii"):
+        code = (code << 2) | int(BASE_CODE[base])
+    return code
+
+def has_border(kmer):
+    '''
+    True if the k-mer can overlap itself (a proper prefix is also a suffix, e.g. AAA or ACAC).
+    Non-overlapping counts of those need a greedy pass instead of a plain count
+    '''
+    return any(kmer[:i] == kmer[-i:] for i in range(1, len(kmer)))
+
+def kmer_table(patterns):
+    '''
+    Prepare the patterns for counting
+    patterns: list of k-mers (same length, A/C/G/T only), duplicates allowed
+    return: dict with k, the patterns, their codes and the lookup from k-mer code to unique k-mer
+    '''
+    k = len(patterns[0])
+    unique_codes = sorted(set(kmer_code(p) for p in patterns))
+    code_to_unique = {code: i for i, code in enumerate(unique_codes)}
+
+    table = {
+        "k": k,
+        "patterns": list(patterns),
+        "unique_codes": np.array(unique_codes, dtype=np.uint64),
+        "pattern_unique": np.array([code_to_unique[kmer_code(p)] for p in patterns], dtype=np.intp),
+        # unique k-mers that can overlap themselves, with their code
+        "border": [(code_to_unique[kmer_code(p)], kmer_code(p)) for p in sorted(set(patterns)) if has_border(p)],
+        "lookup": None,
+        # words of each unique k-mer for count_bounds, made when first needed
+        "bound_words": None,
+    }
+    if k <= MAX_LOOKUP_K:
+        lookup = np.full(4 ** k, -1, dtype=np.int32)
+        lookup[table["unique_codes"].astype(np.intp)] = np.arange(len(unique_codes), dtype=np.int32)
+        table["lookup"] = lookup
+    return table
+
+def encode_seqs(seqs, width):
+    '''
+    Encode upper case sequences as a (number of sequences, width) uint8 array of 0..3, 4 for any other letter.
+    Shorter sequences are padded with N
+    '''
+    joined = "".join(seq.ljust(width, "N") for seq in seqs).encode("ascii", "replace")
+    return BASE_CODE[np.frombuffer(joined, dtype=np.uint8)].reshape(len(seqs), width)
+
+def kmer_codes(encoded, k):
+    '''
+    Rolling 2-bit codes of every k-mer in each row of the encoded sequences
+    encoded: uint8 array from encode_seqs
+    k: k-mer length
+    return: codes (one per row and start position) and valid (False where the k-mer has a non A/C/G/T base)
+    '''
+    n_rows, width = encoded.shape
+    n_kmers = max(width - k + 1, 0)
+    dtype = np.uint32 if k <= 16 else np.uint64
+
+    codes = np.zeros((n_rows, n_kmers), dtype=dtype)
+    bases = (encoded & 3).astype(dtype)
+    for j in range(k):
+        codes <<= dtype(2)
+        codes |= bases[:, j:j + n_kmers]
+
+    bad = encoded == 4
+    if bad.any():
+        bad = np.concatenate((np.zeros((n_rows, 1), dtype=np.intp), np.cumsum(bad, axis=1)), axis=1)
+        valid = (bad[:, k:] - bad[:, :n_kmers]) == 0
+    else:
+        valid = np.ones((n_rows, n_kmers), dtype=bool)
+    return codes, valid
+
+def kmer_index(codes, valid, table):
+    '''
+    Index of the unique target k-mer at every start position, -1 where there is none
+    '''
+    if table["lookup"] is not None:
+        idx = table["lookup"][codes]
+    else:
+        unique_codes = table["unique_codes"]
+        pos = np.searchsorted(unique_codes, codes.astype(np.uint64))
+        pos[pos == len(unique_codes)] = 0
+        idx = np.where(unique_codes[pos] == codes, pos, -1)
+    idx[~valid] = -1
+    return idx
+
+def non_overlapping(positions, k):
+    '''
+    Greedy left-to-right count of non-overlapping hits, same as re.finditer
+    positions: sorted start positions of all (overlapping) hits
+    '''
+    count = 0
+    next_free = -1
+    for pos in positions:
+        if pos >= next_free:
+            count += 1
+            next_free = pos + k
+    return count
+
+def kmer_count_matrix(seqs, table):
+    '''
+    Count every target k-mer in many sequences in one vectorized pass
+    seqs: list of str, upper case
+    table: from kmer_table
+    return: int array (number of sequences, number of patterns), non-overlapping count of each pattern in each sequence
+    '''
+    k = table["k"]
+    n_unique = len(table["unique_codes"])
+    if not seqs:
+        return np.zeros((0, len(table["patterns"])), dtype=np.intp)
+    width = max(len(seq) for seq in seqs)
+
+    codes, valid = kmer_codes(encode_seqs(seqs, width), k)
+    idx = kmer_index(codes, valid, table)
+    rows = np.broadcast_to(np.arange(len(seqs))[:, None], idx.shape)
+    hit = idx >= 0
+    counts = np.bincount(rows[hit] * n_unique + idx[hit], minlength=len(seqs) * n_unique).reshape(len(seqs), n_unique)
+
+    # k-mers that can overlap themselves: redo the count greedily where there is more than 1 hit
+    for u, code in table["border"]:
+        for row in np.flatnonzero(counts[:, u] > 1):
+            positions = np.flatnonzero(valid[row] & (codes[row] == code))
+            counts[row, u] = non_overlapping(positions, k)
+
+    return counts[:, table["pattern_unique"]]
+
+def kmer_counts(seq, table):
+    '''
+    Count every target k-mer in one sequence
+    return: list of int, in the order of table["patterns"]
+    '''
+    return kmer_count_matrix([seq], table)[0].tolist()
+
+def kmer_window_counts(seq, table, window_size, step):
+    '''
+    Count every target k-mer in all sliding windows of seq from cumulative sums of the k-mer hits,
+    instead of cutting and scanning every window. Windows are the same as seq_cut_windows: seq[i:i + window_size - 1]
+    seq: str, upper case
+    table: from kmer_table
+    window_size: size of window
+    step: window sliding step
+    return: window starts (int array) and counts (number of windows, number of patterns), non-overlapping count in each window
+    '''
+    k = table["k"]
+    n_unique = len(table["unique_codes"])
+    starts = np.arange(0, len(seq) - window_size + 1, step)
+
+    codes, valid = kmer_codes(encode_seqs([seq], len(seq)), k)
+    idx = kmer_index(codes, valid, table)[0]
+
+    # hit_sums[j, u]: number of hits of unique k-mer u starting before position j
+    hit_sums = np.zeros((len(idx) + 1, n_unique), dtype=np.int64)
+    np.cumsum(idx[:, None] == np.arange(n_unique), axis=0, out=hit_sums[1:])
+
+    # a k-mer is in the window if it starts in [start, start + window_size - k]
+    ends = np.maximum(starts + window_size - k, starts)
+    counts = hit_sums[np.minimum(ends, len(idx))] - hit_sums[np.minimum(starts, len(idx))]
+
+    # k-mers that can overlap themselves: greedy count window by window where there is more than 1 hit
+    for u, code in table["border"]:
+        positions = np.flatnonzero(idx == u)
+        for w in np.flatnonzero(counts[:, u] > 1):
+            lo, hi = np.searchsorted(positions, [starts[w], ends[w]])
+            counts[w, u] = non_overlapping(positions[lo:hi], k)
+
+    return starts, counts[:, table["pattern_unique"]]
+
+# length of the words of count_bounds
+BOUND_WORD = 3
+
+def word_counts(encoded, w):
+    '''
+    Count of every w-mer (overlapping, none over a non A/C/G/T base) in each row of the encoded sequences
+    return: int array (number of rows, 4 ** w)
+    '''
+    n_rows, width = encoded.shape
+    n_words = max(width - w + 1, 0)
+    # base 5 codes (N is a digit too) need no mask of the words over an N, their columns are dropped at the end
+    codes = np.zeros((n_rows, n_words), dtype=np.uint8 if 5 ** w <= 256 else np.intp)
+    for j in range(w):
+        codes *= 5
+        codes += encoded[:, j:j + n_words]
+    rows = (np.arange(n_rows, dtype=np.intp) * 5 ** w)[:, None]
+    counts = np.bincount((codes + rows).ravel(), minlength=n_rows * 5 ** w).reshape(n_rows, 5 ** w)
+    acgt = [sum(digit * 5 ** (w - 1 - i) for i, digit in enumerate(digits)) for digits in np.ndindex(*(4,) * w)]
+    return counts[:, acgt]
+
+def bound_words(table, w=BOUND_WORD):
+    '''
+    Words of length w in each unique k-mer of the table, with how many times each occurs in it
+    return: list (one per unique k-mer) of (word codes, occurrences) int arrays
+    '''
+    if table.get("bound_words") is None:
+        words = []
+        for code in table["unique_codes"].tolist():
+            kmer = [(code >> (2 * (table["k"] - 1 - i))) & 3 for i in range(table["k"])]
+            word_codes = [sum(base << (2 * (w - 1 - j)) for j, base in enumerate(kmer[i:i + w])) for i in range(table["k"] - w + 1)]
+            unique, occurrences = np.unique(word_codes, return_counts=True)
+            words.append((unique.astype(np.intp), occurrences))
+        table["bound_words"] = words
+    return table["bound_words"]
+
+def count_bounds(counts, table, w=BOUND_WORD):
+    '''
+    Upper bound of the count of every pattern of the table from word counts alone, never below kmer_count_matrix:
+    non-overlapping hits of a k-mer are disjoint, so a word that occurs n times in the k-mer occurs at least
+    n times per hit in the sequence, and the number of hits is at most (count of the word) // n for every word of the k-mer
+    counts: from word_counts(encoded, w), with w <= k
+    return: int array (number of rows, number of patterns)
+    '''
+    bounds = np.empty((counts.shape[0], len(table["unique_codes"])), dtype=np.intp)
+    for u, (word_codes, occurrences) in enumerate(bound_words(table, w)):
+        bounds[:, u] = (counts[:, word_codes] // occurrences).min(axis=1)
+    return bounds[:, table["pattern_unique"]]
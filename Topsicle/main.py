@@ -4,8 +4,6 @@ import sys
 import os
 import gzip
 import numpy as np
-import pandas as pd
-from Bio import SeqIO 
 import time
 import datetime
 from collections import defaultdict
@@ -16,17 +14,27 @@ from multiprocessing import Pool, Manager, Lock, cpu_count
 
 import argparse
 
-# result output
-import seaborn as sns
-import matplotlib.pyplot as plt
-colors = sns.color_palette("colorblind",n_colors=30) 
-sns.set_style("whitegrid", {'grid.color': 'grey', 'grid.linestyle': '--'})
-
 import csv 
+import re
+import functools
+import glob
+import itertools
+import threading
+import resource
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 # import our package here 
 from Topsicle.allsteps import *
+from Topsicle.fastreader import iter_ends
+from Topsicle.sink import ResultSink, QueueRows
+from Topsicle.memory import peak_rss_mb, children_peak_rss_mb, reset_peak_rss, batches_in_flight, trc_batch_size
+from Topsicle.manifest import Manifest, MANIFEST_NAME, run_params
+from Topsicle.trccache import trc_cache, cached_matches
+from Topsicle.render import render_plots
+from Topsicle.trackstore import TrackWriter
+from Topsicle.rawcount import RawCountWriter
+from Topsicle.profiling import Profile, write_metrics
+from Topsicle.assembly import contig_ends, is_index_file
 
 def get_log_path(args):
     # Use outputDir if available, else current directory
@@ -39,119 +47,604 @@ def tprint(*args, **kwargs):
     now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{now}] {msg}"
     print(line)
-    # Log file 
+    # Log file, opened once (line buffered, so worker processes forked later do not write buffered lines twice)
     if hasattr(tprint, "logfile"):
-        with open(tprint.logfile, "a") as f:
-            f.write(line + "\n")
+        if getattr(tprint, "loghandle", None) is None or tprint.loghandle.name != tprint.logfile:
+            tprint.loghandle = open(tprint.logfile, "a", buffering=1)
+        tprint.loghandle.write(line + "\n")
+
+def log_memory(stage):
+    '''
+    Write the peak resident memory of this process during stage to the log, and start a new peak for the next stage
+    '''
+    tprint(f"peak memory (RSS) of {stage}: {peak_rss_mb():.1f} MB")
+    reset_peak_rss()
 
 verbose = False
 def vprint(*args, **kwargs):
     if verbose:
         print(*args, **kwargs)
 
-def process_file(args, seq_loc, telo_phrase, pattern,sliding_val,lock):
+def stream_params(args, telo_phrases, patterns, sliding_val):
+    '''
+    Run parameters needed by process_batch, small enough to send to the workers with every batch
+    telo_phrases: list of k-mer lengths, all computed from the same reads
+    patterns: dict of k-mer length -> patterns to search
+    '''
+    return {
+        "telopattern": args.pattern, "kmers": list(telo_phrases), "patterns": patterns, "no_bp": 1000, "engine": args.engine,
+        "cutoff": min(args.cutoff) if isinstance(args.cutoff, (list, tuple)) else args.cutoff,
+        "windowSize": args.windowSize, "slide": sliding_val, "trimfirst": args.trimfirst, "maxlengthtelo": args.maxlengthtelo,
+        "changepoint": args.changepoint, "read_check": args.read_check, "plot": args.plot, "rawcountpattern": args.rawcountpattern,
+        "trackstore": args.trackstore, "profile": args.profile, "cprofile": args.cprofile, "max_errors": scan_errors(args), "prefilter": not args.noprefilter,
+    }
+
+def scan_errors(args):
+    '''
+    max_errors of the approximate scan with --scanmode approx, None for k-mer counting
+    '''
+    return args.maxerrors if args.scanmode == "approx" else None
+
+def process_batch(batch, params):
+    '''
+    Worker of the streaming mode: TRC and telomere boundary of a batch of reads, for every k-mer length
+    batch: list of (read id, read length, first base pairs, last base pairs flipped), from fastreader.iter_ends
+    params: dict from stream_params
+    return: (list of (read id, k-mer length, tail, TRC, boundary, tracks of the read ends checked (with --plot or --trackstore), raw count) of the reads over the TRC cutoff, 
+            in batch order and then k-mer order, metrics of the batch with --profile or None)
+    '''
+    profile = Profile(params["profile"], params["cprofile"])
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    no_bp = params["no_bp"]
+    read_ids = [item[0] for item in batch]
+    seq_starts = [item[2][:no_bp] for item in batch]
+    seq_ends = [item[3][:no_bp] for item in batch]
+    ratio_perfect_hit = no_bp / len(params["telopattern"])
+
+    # step 1: TRC of all k-mer lengths on the same read ends
+    with profile.stage("trc", hot=True):
+        counters = trc_counters(params["telopattern"], params["kmers"], params["engine"], params["max_errors"])
+        matches = trc_kmers(read_ids, seq_starts, seq_ends, counters, ratio_perfect_hit, params["cutoff"], params["prefilter"])
+    if params["profile"]:
+        profile.count("reads_scanned", len(batch))
+        profile.count("reads_over_cutoff", sum(1 for i in range(len(batch)) if any(matches[kmer][i] is not None for kmer in params["kmers"])))
+
+    # step 2: boundary of reads over the cutoff
+    timings = {} if params["profile"] else None
+    with profile.stage("step2", hot=True):
+        compiled = {kmer: [re.compile(patt) for patt in patterns_to_search(params["patterns"][kmer], cut_length=kmer)] for kmer in params["kmers"]}
+        tables = {kmer: pattern_table(compiled[kmer], params["max_errors"]) for kmer in params["kmers"]}
+        results = []
+        for i, (read_id, length, seq_start, seq_end) in enumerate(batch):
+            if params["read_check"] and read_id != params["read_check"]:
+                continue
+            for kmer in params["kmers"]:
+                match = matches[kmer][i]
+                if match is None:
+                    continue
+                tail, trc_val = match[2], match[3]
+                tracks = []
+                rawcount = [] if params["rawcountpattern"] else None
+                bound_res = bound_detect_ends(read_id, length, seq_start, seq_end, pattern_telo=params["patterns"][kmer], windowSize=params["windowSize"], tail=tail, 
+                                              cut_length=kmer, slide=params["slide"], trimfirst=params["trimfirst"], maxlengthtelo=params["maxlengthtelo"],
+                                              compiled_patterns=compiled[kmer], table=tables[kmer], cp_backend=params["changepoint"], tracks=tracks, 
+                                              rawcounts=rawcount, timings=timings)
+                results.append((read_id, kmer, tail, trc_val, bound_res, tracks if (params["plot"] or params["trackstore"]) else None, rawcount))
+    if timings:
+        profile.add_timings(timings, prefix="step2_")
+    profile.add_time("worker", time.perf_counter() - start_wall, time.process_time() - start_cpu)
+    return results, profile.result()
+
+def count_columns(patterns):
+    '''
+    Patterns counted in each window of step 2 (columns of the raw counts), for each k-mer length
+    '''
+    return {kmer: patterns_to_search(patterns[kmer], cut_length=kmer) for kmer in patterns}
+
+def read_batches(read_ends, batch_size):
+    '''
+    Group read ends into lists of batch_size reads
+    '''
+    batch = []
+    for item in read_ends:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def bounded_imap(pool, func, iterable, max_in_flight):
+    '''
+    pool.imap that keeps at most max_in_flight items read ahead, so the reader can not run away from the workers
+    yield: results in the order of iterable
+    '''
+    slots = threading.BoundedSemaphore(max_in_flight)
+    def feeder():
+        for item in iterable:
+            slots.acquire()
+            yield item
+    for result in pool.imap(func, feeder()):
+        slots.release()
+        yield result
+
+def keep_plot(plotted, read_id, plotmax):
+    '''
+    True if read_id is plotted: every read without plotmax, otherwise the first plotmax reads of the input
+    plotted: set of read ids plotted so far in this input, updated
+    '''
+    if plotmax and read_id not in plotted and len(plotted) >= plotmax:
+        return False
+    plotted.add(read_id)
+    return True
+
+def process_file_stream(args, seq_loc, telo_phrases, patterns, sliding_val, sink, pool=None, max_in_flight=4, resume=None):
+    '''
+    Streaming version of process_file: TRC and telomere boundary in a single pass over the input, for all k-mer lengths.
+    The reader (this process) sends batches of read ends to the pool workers, which compute TRC and boundaries, 
+    and results are written here in input order. Without pool, batches are processed in this process.
+    sink: where the result rows go, ResultSink (or QueueRows in a worker process)
+    max_in_flight: number of batches read ahead of the workers
+    resume: optional, state of an interrupted run of this file from resume_state, its first batches are skipped
+    No subset fastq is written to disk.
+    return: same as process_file, the metrics are those of every batch and of the reading here
+    '''
+    tprint("streaming TRC and boundary detection on:", seq_loc)
+    base_name = os.path.basename(seq_loc)
+    file_name = os.path.splitext(base_name)[0]
+    params = stream_params(args, telo_phrases, patterns, sliding_val)
+
+    span = max(params["no_bp"], args.maxlengthtelo)
+    # reading is done here, its time is the time spent waiting for the next batch
+    profile = Profile(args.profile)
+    profile.count("bytes_read", os.path.getsize(seq_loc))
+    batches = profile.timed_iter("parse", read_batches(iter_ends(seq_loc, span, read_length=args.minSeqLength, threads=args.threads), args.batchsize))
+    resume = resume or {}
+    units, rows_total = resume.get("units", 0), resume.get("rows", 0)
+    if units:
+        tprint(f"resuming {file_name} after {units} batches")
+        batches = itertools.islice(batches, units, None)
+    worker = functools.partial(process_batch, params=params)
+    if pool is None:
+        batch_results = map(worker, batches)
+    else:
+        batch_results = bounded_imap(pool, worker, batches, max_in_flight=max_in_flight)
+
+    bound_all_detected = []
+    plot_jobs = []
+    plotted = set()
+    track_writer = TrackWriter(args.outputDir, file_name, append=bool(units)) if args.trackstore else None
+    rawcount_writer = RawCountWriter(args.outputDir, file_name, count_columns(patterns), append=bool(units)) if args.rawcountpattern else None
+    image_num = {telo_phrase: resume.get("image_num", {}).get(telo_phrase, 1) for telo_phrase in telo_phrases}
+    work_metrics = []
+    for results, batch_metrics in batch_results:
+        if batch_metrics is not None:
+            work_metrics.append((file_name, batch_metrics))
+        for read_id, telo_phrase, tail, trc_val, bound_res, tracks, rawcount in results:
+            # no boundary when the track is too short for a changepoint, the read gets telomere length 0 (like a contig end in --assembly)
+            bound_res = bound_res or [[read_id, 0]]
+            readID, telolen = bound_res[0]
+            sink.add([file_name, telo_phrase, f"{trc_val:.3f}", readID, telolen])
+
+            bound_all_detected.append((file_name, telo_phrase, bound_res, trc_val))
+
+            # the plot is drawn later by render_plots, only its track is kept here
+            if args.plot and tracks and keep_plot(plotted, read_id, args.plotmax):
+                plot_jobs.append((f"{args.outputDir}/plot_{telo_phrase}_{image_num[telo_phrase]}.png", telo_phrase, tracks[-1], args.rangecp))
+            if track_writer is not None:
+                for track in tracks:
+                    track_writer.add(telo_phrase, track)
+
+            if rawcount_writer is not None:
+                rawcount_writer.add(read_id, telo_phrase, rawcount)
+
+            image_num[telo_phrase] += 1
+
+        # the batch is complete, mark it in the manifest
+        if track_writer is not None:
+            track_writer.flush()
+        if rawcount_writer is not None:
+            rawcount_writer.flush()
+        units += 1
+        rows_total += len(results)
+        sink.progress(seq_loc, units, rows_total)
+
+    if track_writer is not None:
+        track_writer.close()
+    if rawcount_writer is not None:
+        rawcount_writer.close()
+    sink.progress(seq_loc, units, rows_total, done=True)
+    log_memory(f"streaming of {file_name} (reader and writer process)")
+    if args.profile:
+        work_metrics.append((file_name, profile.result()))
+    return bound_all_detected, plot_jobs, work_metrics
+
+def find_read_subset(output_dir, file_name, min_cutoff, read_ids):
+    '''
+    Subset file of an earlier run that has all reads in read_ids: the one at min_cutoff, or one at a lower cutoff
+    return: (subset file, its index) or (None, None)
+    '''
+    subsets = []
+    for path in glob.glob(os.path.join(glob.escape(output_dir), f"{glob.escape(file_name)}_trc_over_*.fast[aq]")):
+        try:
+            subset_cutoff = float(path[len(os.path.join(output_dir, f"{file_name}_trc_over_")):-len(".fasta")])
+        except ValueError:
+            continue
+        if subset_cutoff <= min_cutoff:
+            subsets.append((subset_cutoff, path))
+
+    # closest cutoff first, it is the smallest file
+    for subset_cutoff, path in sorted(subsets, reverse=True):
+        index = load_read_index(path)
+        if index is not None and all(read_id in index for read_id in read_ids):
+            return path, index
+    return None, None
+
+def process_file(args, seq_loc, telo_phrases, patterns, sliding_val, rows_queue, max_memory=None, resume=None, threads=1):
+    '''
+    TRC and telomere boundary of the reads of one input, for all k-mer lengths.
+    Step 1 reads the input once for every k-mer length, the reads over cutoff for any of them are written to one subset file,
+    and step 2 reads that subset once
+    telo_phrases: list of k-mer lengths
+    patterns: dict of k-mer length -> patterns to search
+    rows_queue: queue to the ResultSink writer, result rows are sent to it in chunks
+    max_memory: memory budget of this worker in MB, limits how many reads are counted together in step 1
+    resume: optional, state of an interrupted run of this file from resume_state, step 2 continues after the reads already done
+    threads: number of decompression threads of this worker for .gz and BAM input
+    return: (list of (file name, k-mer length, boundary, TRC), list of plot jobs for render_plots, 
+             list of (file name, metrics) with --profile, see profiling.write_metrics)
+    '''
+    rows = QueueRows(rows_queue)
+    reset_peak_rss()
+    profile = Profile(args.profile, args.cprofile)
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+
     tprint("subsetting raw dataset based on TRC cutoff")
     base_name = os.path.basename(seq_loc)
     file_name = os.path.splitext(base_name)[0]
     min_cutoff = min(args.cutoff) if isinstance(args.cutoff, (list, tuple)) else args.cutoff
-    read_w_telo_mver = patternTRC_count(filepath=seq_loc, no_bp=1000, read_length=args.minSeqLength, telopattern=args.pattern, cutoff=min_cutoff, kmer=telo_phrase)
-    
-    read_ID_w_telo_mver = [item[0] for item in read_w_telo_mver]
-    trc_read_w_telo_all = [item[3] for item in read_w_telo_mver]
-    read_ID_w_telo_mver_tail = {item[0]: item[2] for item in read_w_telo_mver}
-
-    # get reads that potentially have telomere
-    fasta_temp = os.path.join(args.outputDir, f"{file_name}_trc_over_{min_cutoff}.fasta")
-    if os.path.exists(fasta_temp):
-        tprint(f"Temporary fasta file already exists: {fasta_temp}. Using existing file.")
-    else:
-        if seq_loc.endswith(".gz"):
-            open_func = lambda f: gzip.open(f, "rt", encoding="utf-8")
-            seq_format = "fastq" if seq_loc.endswith(".fastq.gz") or seq_loc.endswith(".fq.gz") else "fasta"
+    # reads over cutoff are kept as read id -> {k-mer length: (tail, TRC)} in file order
+    trc_hits = {}
+    batch_size = trc_batch_size(max_memory, 1000, len(telo_phrases))
+    with profile.stage("trc", hot=True):
+        if args.notrccache:
+            profile.count("bytes_read", os.path.getsize(seq_loc))
+            # reads are counted in batches as they are read, and only the reads over cutoff are kept, 
+            # so memory does not grow with the number of reads in the input
+            for ends, matches in patternTRC_multi_stream(filepath=seq_loc, no_bp=1000, read_length=args.minSeqLength, telopattern=args.pattern, cutoff=min_cutoff, 
+                                                         kmers=telo_phrases, engine=args.engine, batch_size=batch_size, threads=threads, max_errors=scan_errors(args),
+                                                         prefilter=not args.noprefilter):
+                trc_hits[ends[0]] = {telo_phrase: (match[2], match[3]) for telo_phrase, match in matches.items() if match is not None}
         else:
-            open_func = lambda f: open(f, "rt")
-            seq_format = "fastq" if seq_loc.endswith(".fastq") or seq_loc.endswith(".fq") else "fasta"
-
-        # Decide output format and extension
-        if seq_format == "fastq":
-            out_format = "fastq"
-            fasta_temp = os.path.join(args.outputDir, f"{file_name}_trc_over_{min_cutoff}.fastq")
+            # TRC of every read is saved in the cache, a run with another cutoff or window does not count it again
+            cache, cached = trc_cache(seq_loc, args.cachedir or args.outputDir, args.pattern, telo_phrases, no_bp=1000, read_length=args.minSeqLength, 
+                                      engine=args.engine, batch_size=batch_size, threads=threads, max_errors=scan_errors(args),
+                                      prefilter_cutoff=None if args.noprefilter else min_cutoff)
+            if cached:
+                tprint(f"TRC of {file_name} loaded from cache")
+            else:
+                profile.count("bytes_read", os.path.getsize(seq_loc))
+            for read_id, matches in cached_matches(cache, telo_phrases, min_cutoff):
+                trc_hits[read_id] = {telo_phrase: (match[2], match[3]) for telo_phrase, match in matches.items() if match is not None}
+            profile.count("reads_scanned", len(cache["length"]))
+            profile.count("trc_cache_hits", int(cached))
+            del cache
+    profile.count("reads_over_cutoff", len(trc_hits))
+    log_memory(f"step 1 (TRC) of {file_name}")
+
+    with profile.stage("subset"):
+        # get reads that potentially have telomere, a subset of an earlier run at the same or a lower cutoff has all of them
+        fasta_temp, read_index = find_read_subset(args.outputDir, file_name, min_cutoff, trc_hits)
+        if fasta_temp is not None:
+            tprint(f"Temporary fasta file already exists: {fasta_temp}. Using existing file.")
         else:
-            out_format = "fasta"
-            fasta_temp = os.path.join(args.outputDir, f"{file_name}_trc_over_{min_cutoff}.fasta")
+            if is_bam(seq_loc):
+                seq_format = "bam"
+            elif seq_loc.endswith(".gz"):
+                seq_format = "fastq" if seq_loc.endswith(".fastq.gz") or seq_loc.endswith(".fq.gz") else "fasta"
+            else:
+                seq_format = "fastq" if seq_loc.endswith(".fastq") or seq_loc.endswith(".fq") else "fasta"
 
-        with open_func(seq_loc) as in_handle, open(fasta_temp, "w") as out_handle:
-            for record in SeqIO.parse(in_handle, seq_format):
-                if record.id in read_ID_w_telo_mver:
-                    SeqIO.write(record, out_handle, out_format)
-        tprint(f"Temporary fasta file with TRC more than {min_cutoff}:", fasta_temp)
+            # Decide output format and extension
+            if seq_format in ("fastq", "bam"):
+                out_format = "fastq"
+                fasta_temp = os.path.join(args.outputDir, f"{file_name}_trc_over_{min_cutoff}.fastq")
+            else:
+                out_format = "fasta"
+                fasta_temp = os.path.join(args.outputDir, f"{file_name}_trc_over_{min_cutoff}.fasta")
+
+            # write the subset with its byte offset index, so step 2 seeks to each read instead of rescanning the file
+            read_index = write_read_subset(seq_loc, fasta_temp, trc_hits, seq_format, out_format, threads=threads)
+            tprint(f"Temporary fasta file with TRC more than {min_cutoff}:", fasta_temp)
+            log_memory(f"subsetting of {file_name}")
 
     bound_all_detected = []
-    image_num = 1
+    plot_jobs = []
+    plotted = set()
+    resume = resume or {}
+    units, rows_total = resume.get("units", 0), resume.get("rows", 0)
+    track_writer = TrackWriter(args.outputDir, file_name, append=bool(units)) if args.trackstore and not args.read_check else None
+    rawcount_writer = RawCountWriter(args.outputDir, file_name, count_columns(patterns), append=bool(units)) if args.rawcountpattern and not args.read_check else None
+    image_num = {telo_phrase: resume.get("image_num", {}).get(telo_phrase, 1) for telo_phrase in telo_phrases}
     # in case wanting to check a specific read only 
     if args.read_check:
         tprint("checking specific read:", args.read_check)
-        tail = read_ID_w_telo_mver_tail.get(args.read_check, None)
-        tprint("step 2 on:", args.read_check)
-        bound_res = bound_detect(filepath=fasta_temp, read=args.read_check, pattern_telo=pattern, windowSize=args.windowSize, tail=tail, cut_length=telo_phrase,
-                                 slide=sliding_val, trimfirst=args.trimfirst, plot_yes_no=args.plot, maxlengthtelo=args.maxlengthtelo,plotcp_range=args.rangecp)
-        
-        readID, telolen = bound_res[0]
-
-        try:
-            idx = read_ID_w_telo_mver.index(args.read_check)
-            trc_val = trc_read_w_telo_all[idx]
-        except ValueError:
-            trc_val = ""
+        for telo_phrase in telo_phrases:
+            match = trc_hits.get(args.read_check, {}).get(telo_phrase)
+            tail = match[0] if match is not None else None
+            tprint("step 2 on:", args.read_check)
+            bound_res = bound_detect(filepath=fasta_temp, read=args.read_check, pattern_telo=patterns[telo_phrase], windowSize=args.windowSize, tail=tail, cut_length=telo_phrase,
+                                     slide=sliding_val, trimfirst=args.trimfirst, plot_yes_no=args.plot, maxlengthtelo=args.maxlengthtelo,plotcp_range=args.rangecp,index=read_index, cp_backend=args.changepoint,
+                                     max_errors=scan_errors(args))
+            
+            # no boundary found, telomere length 0
+            bound_res = bound_res or [[args.read_check, 0]]
+            readID, telolen = bound_res[0]
+            trc_val = match[1] if match is not None else ""
 
-        with open(f'{args.outputDir}/telolengths_all.csv', mode='a', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow([file_name, telo_phrase, f"{trc_val:.3f}", readID,telolen])
+            rows.add([file_name, telo_phrase, f"{trc_val:.3f}", readID,telolen])
+            rows_total += 1
 
-        bound_all_detected.append((file_name, telo_phrase, bound_res, trc_val))
-        
-        if args.plot:
-            plt.savefig(f"{args.outputDir}/plot_{telo_phrase}_{image_num}.png", format='png', dpi=300)
-            plt.close()
+            bound_all_detected.append((file_name, telo_phrase, bound_res, trc_val))
+            
+            if args.plot:
+                pyplot().savefig(f"{args.outputDir}/plot_{telo_phrase}_{image_num[telo_phrase]}.png", format='png', dpi=300)
+                pyplot().close()
 
-        if args.rawcountpattern:
-            allrawcount = rawCountPattern(filepath=fasta_temp, read=read, pattern_telo=pattern, windowSize=args.windowSize, maxlengthtelo=args.maxlengthtelo,
-                                          slide=sliding_val, trimfirst=args.trimfirst, cut_length=telo_phrase, tail=tail, minSeqLength=args.minSeqLength, plot_raw=False)
             if args.rawcountpattern:
-                allrawcount.to_csv(f"{args.outputDir}/rawcount_{telo_phrase}_{image_num}.csv")
+                allrawcount = rawCountPattern(filepath=fasta_temp, read=args.read_check, pattern_telo=patterns[telo_phrase], windowSize=args.windowSize, maxlengthtelo=args.maxlengthtelo,
+                                              slide=sliding_val, trimfirst=args.trimfirst, cut_length=telo_phrase, tail=tail, minSeqLength=args.minSeqLength, plot_raw=False,
+                                              index=read_index)
+                if args.rawcountpattern:
+                    allrawcount.to_csv(f"{args.outputDir}/rawcount_{telo_phrase}_{image_num[telo_phrase]}.csv")
+
+            image_num[telo_phrase] += 1
 
     # check all filtered reads, no specifying read
     else:   
-        for idx, read in enumerate(read_ID_w_telo_mver):
-            tail = read_ID_w_telo_mver_tail.get(read, None)
-            #tprint("step 2 on:", read)
-
-            bound_res = bound_detect(filepath=fasta_temp, read=read, pattern_telo=pattern, windowSize=args.windowSize, tail=tail, cut_length=telo_phrase,
-                                    slide=sliding_val, trimfirst=args.trimfirst, plot_yes_no=args.plot, maxlengthtelo=args.maxlengthtelo,plotcp_range=args.rangecp)
-
-
-            readID, telolen = bound_res[0]
-            trc_val = trc_read_w_telo_all[idx]
-            with lock:
-                with open(f'{args.outputDir}/telolengths_all.csv', mode='a', newline='') as file:
-                    writer = csv.writer(file)
-                    writer.writerow([file_name, telo_phrase,f"{trc_val:.3f}", readID,telolen])
+        compiled = {telo_phrase: [re.compile(patt) for patt in patterns_to_search(patterns[telo_phrase], cut_length=telo_phrase)] for telo_phrase in telo_phrases}
+        tables = {telo_phrase: pattern_table(compiled[telo_phrase], scan_errors(args)) for telo_phrase in telo_phrases}
+
+        # one pass over the subset, every k-mer length on the same read ends.
+        # progress is the number of reads done in trc_hits order, a resumed run starts after them
+        read_ids = list(trc_hits)
+        position = {read_id: i for i, read_id in enumerate(read_ids)}
+        if units:
+            tprint(f"resuming {file_name} after {units} reads")
+        profile.count("bytes_read", os.path.getsize(fasta_temp))
+        timings = {} if args.profile else None
+        with profile.stage("step2", hot=True):
+            read_ends = profile.timed_iter("step2_file_scan", read_ends_by_id(fasta_temp, read_ids[units:], args.maxlengthtelo, read_index))
+            for read_id, length, seq_start, seq_end in read_ends:
+                for telo_phrase in telo_phrases:
+                    match = trc_hits[read_id].get(telo_phrase)
+                    if match is None:
+                        continue
+                    tail, trc_val = match
+                    #tprint("step 2 on:", read_id)
+
+                    tracks = [] if (args.plot or args.trackstore) else None
+                    rawcount = [] if rawcount_writer is not None else None
+                    bound_res = bound_detect_ends(read_id, length, seq_start, seq_end, pattern_telo=patterns[telo_phrase], windowSize=args.windowSize, tail=tail, 
+                                                  cut_length=telo_phrase, slide=sliding_val, trimfirst=args.trimfirst, maxlengthtelo=args.maxlengthtelo,
+                                                  plotcp_range=args.rangecp, compiled_patterns=compiled[telo_phrase], table=tables[telo_phrase], cp_backend=args.changepoint, 
+                                                  tracks=tracks, rawcounts=rawcount, timings=timings)
+                    # no boundary found, telomere length 0
+                    bound_res = bound_res or [[read_id, 0]]
+                    readID, telolen = bound_res[0]
+                    rows.add([file_name, telo_phrase,f"{trc_val:.3f}", readID,telolen])
+                    rows_total += 1
+
+                    bound_all_detected.append((file_name, telo_phrase, bound_res,trc_val))
+                
+                    # the plot is drawn later by render_plots, from the track of the last read end checked
+                    if args.plot and tracks and keep_plot(plotted, read_id, args.plotmax):
+                        plot_jobs.append((f"{args.outputDir}/plot_{telo_phrase}_{image_num[telo_phrase]}.png", telo_phrase, tracks[-1], args.rangecp))
+                    if track_writer is not None:
+                        for track in tracks:
+                            track_writer.add(telo_phrase, track)
+
+                    if rawcount_writer is not None:
+                        rawcount_writer.add(read_id, telo_phrase, rawcount)
+
+                    image_num[telo_phrase] += 1
+
+                if track_writer is not None:
+                    track_writer.flush()
+                if rawcount_writer is not None:
+                    rawcount_writer.flush()
+                rows.progress(seq_loc, position[read_id] + 1, rows_total)
+        if timings:
+            profile.add_timings(timings, prefix="step2_")
+
+    if track_writer is not None:
+        track_writer.close()
+    if rawcount_writer is not None:
+        rawcount_writer.close()
+    rows.progress(seq_loc, len(trc_hits), rows_total, done=True)
+    log_memory(f"step 2 (boundary) of {file_name}")
+    profile.add_time("worker", time.perf_counter() - start_wall, time.process_time() - start_cpu)
+    return bound_all_detected, plot_jobs, [(file_name, profile.result())] if args.profile else []
+
+def resume_state(output_csv, manifest, filenames):
+    '''
+    Rows of an interrupted run to keep, and where each input continues from, from the manifest.
+    Rows of a file written after its last progress marker are dropped (they are computed again), 
+    and so are all rows of a file that is not in the manifest or changed since
+    return: (rows to keep, dict of input file -> {"units", "rows", "done", "image_num", "entries"}), 
+            entries are the kept rows in the form returned by process_file (TRC as written in the csv, 3 decimals)
+    '''
+    saved_rows = defaultdict(list)
+    with open(output_csv, newline='') as handle:
+        reader = csv.reader(handle)
+        next(reader, None)  # header
+        for row in reader:
+            saved_rows[row[0]].append(row)
+
+    kept_rows = []
+    states = {}
+    for seq_loc in filenames:
+        file_name = os.path.splitext(os.path.basename(seq_loc))[0]
+        state = manifest.file_state(seq_loc)
+        if state is None or len(saved_rows[file_name]) < state["rows"]:
+            states[seq_loc] = {"units": 0, "rows": 0, "done": False, "image_num": {}, "entries": []}
+            continue
+
+        states[seq_loc] = {"units": state["units"], "rows": state["rows"], "done": state["done"], "image_num": {}, "entries": []}
+        for file_name, phrase, trc, readID, telolen in saved_rows[file_name][:state["rows"]]:
+            phrase, telolen = int(phrase), int(telolen)
+            kept_rows.append([file_name, phrase, trc, readID, telolen])
+            states[seq_loc]["entries"].append((file_name, phrase, [[readID, telolen]], float(trc)))
+            states[seq_loc]["image_num"][phrase] = states[seq_loc]["image_num"].get(phrase, 1) + 1
+    return kept_rows, states
+
+def report_cutoff(phrase, trc_list, telo_list, inputtrc, plot_path):
+    '''
+    Median telomere length and quadratic fit recommendation of one k-mer length at one TRC cutoff
+    trc_list, telo_list: TRC and telomere length of the reads over that cutoff
+    plot_path: where to save the quadratic fit plot
+    return: [phrase, cutoff, number of reads, median telomere length, recommended cutoff, median telomere length at the recommended cutoff]
+    '''
+    if len(telo_list) == 0:
+        tprint(f"k-mer: {phrase}, no read with TRC >= {inputtrc}")
+        return [phrase, inputtrc, 0, "", "", ""]
+
+    median_telo = np.median(telo_list)
+    median_trc = np.median(trc_list)
+    # telling TRC distribution and print obs 
+    tprint(f"k-mer: {phrase}, with TRC >= {inputtrc}, median telomere length is {median_telo:.2f} bp")
+    row = [phrase, inputtrc, len(telo_list), f"{median_telo:.2f}", "", ""]
+
+    if len(telo_list) >= 3:
+        max_trc=max(trc_list)
+        vertex_x, vertex_y, coeffs = fit_quadratic_and_find_vertex(
+            trc_list, telo_list, 
+            inputtrc=inputtrc, median_trc=median_trc, save_path=plot_path)
+        
+        #vertex_x, vertex_y, coeffs = fit_quadratic_and_find_vertex(trc_list, telo_list)
 
-            bound_all_detected.append((file_name, telo_phrase, bound_res,trc_val))
-            
-            if args.plot:
-                plt.savefig(f"{args.outputDir}/plot_{telo_phrase}_{image_num}.png", format='png', dpi=300)
-                plt.close()
+        if vertex_x > max_trc:
+            tprint(f"Asymptotic TRC {vertex_x:.3f} is greater than max TRC, which is not expected. See plot.")
+            if median_trc < 1.0:
+                tprint(f"Using median TRC value ({median_trc:.3f}) as asymptotic TRC instead.")
+                vertex_x = median_trc
+            else:
+                tprint(f"Using 0.9 as asymptotic TRC instead, since asymptotic is greater than 1.0.")
+                vertex_x = 0.9
+        if vertex_x < 0.4:
+            tprint("Quadratic fit suggests asymptotic TRC less than 0.4. See plot with fit line")
+            if max_trc < 0.4:
+                tprint(f"Maximum TRC value in data is {max_trc:.3f}, which is less than 0.4, indicating low confidence in telomere detection.")
+            if vertex_x < inputtrc:
+                tprint(f"Asymptotic TRC {vertex_x:.3f} is less than input cutoff {inputtrc:.3f}. Topsicle declares input TRC (={inputtrc}) as asymptotic TRC.")
+                vertex_x = inputtrc
+        
+        tprint(f"asymptotic TRC, or recommended cutoff: {vertex_x:.3f}")
+        row[4] = f"{vertex_x:.3f}"
+
+        # Get telomere lengths where TRC > vertex_x
+        filtered_telolen = [
+            telo for trc, telo in zip(trc_list, telo_list)
+            if trc >= vertex_x
+        ]
+        if filtered_telolen:
+            median_filtered_telolen = np.median(filtered_telolen)
+            tprint(f"Median telomere length for reads with TRC cutoff >= {vertex_x:.3f}: {median_filtered_telolen:.2f} bp")
+            row[5] = f"{median_filtered_telolen:.2f}"
+        else:
+            tprint(f"No read has TRC >= {vertex_x:.3f}, please double check the data or submit log to GitHub.")
+    else:
+        tprint("Not enough data points to recommend TRC cutoff.")
 
-            if args.rawcountpattern:
-                allrawcount = rawCountPattern(filepath=fasta_temp, read=read, pattern_telo=pattern, windowSize=args.windowSize, maxlengthtelo=args.maxlengthtelo,
-                                            slide=sliding_val, trimfirst=args.trimfirst, cut_length=telo_phrase, tail=tail, minSeqLength=args.minSeqLength, plot_raw=False)
-                if args.rawcountpattern:
-                    allrawcount.to_csv(f"{args.outputDir}/rawcount_{telo_phrase}_{image_num}.csv")
+    return row
 
-            image_num += 1
+ASSEMBLY_HEADER = ['file_number', 'phrase', 'contig', 'end', 'contig_length', 'trc', 'telo_length']
 
-    return bound_all_detected
+def process_assembly(args, seq_loc, telo_phrases, patterns, sliding_val, num_cores):
+    '''
+    Telomere length at both ends of every contig of one assembly (--assembly): the contig ends come from the indexed fasta 
+    (see assembly.contig_ends), and each end is checked on its own, TRC and then the boundary if it is over the cutoff
+    return: (list of rows of telolengths_assembly.csv, list of plot jobs for render_plots)
+    '''
+    base_name = os.path.basename(seq_loc)
+    file_name = os.path.splitext(base_name)[0]
+    no_bp = 1000
+    cutoff = min(args.cutoff) if isinstance(args.cutoff, (list, tuple)) else args.cutoff
+    ends = list(contig_ends(seq_loc, max(no_bp, args.maxlengthtelo), read_length=args.minSeqLength, threads=num_cores))
+    tprint(f"{file_name}: {len(ends)} contigs longer than {args.minSeqLength} bp")
+
+    # TRC of every contig end is reported, so there is no prefilter
+    counters = trc_counters(args.pattern, telo_phrases, args.engine, scan_errors(args))
+    scores = trc_kmer_scores([item[2][:no_bp] for item in ends], [item[3][:no_bp] for item in ends], counters, no_bp / len(args.pattern))
+
+    rows = []
+    plot_jobs = []
+    plotted = set()
+    for telo_phrase, compiled_patterns, table in counters:
+        step2_table = pattern_table(compiled_patterns, scan_errors(args))
+        for i, (contig, length, seq_start, seq_end) in enumerate(ends):
+            if args.read_check and contig != args.read_check:
+                continue
+            trc_forward, trc_reverse, best = scores[telo_phrase][i]
+            for end, tail, trc_val in (("start", "forward", trc_forward), ("end", "reverse", trc_reverse)):
+                telolen = 0
+                if trc_val > cutoff:
+                    tracks = []
+                    bound_res = bound_detect_ends(contig, length, seq_start, seq_end, pattern_telo=patterns[telo_phrase], windowSize=args.windowSize, tail=tail,
+                                                  cut_length=telo_phrase, slide=sliding_val, trimfirst=args.trimfirst, maxlengthtelo=args.maxlengthtelo,
+                                                  compiled_patterns=compiled_patterns, table=step2_table, cp_backend=args.changepoint, tracks=tracks)
+                    if bound_res:
+                        telolen = bound_res[0][1]
+                    if args.plot and tracks and keep_plot(plotted, contig, args.plotmax):
+                        plot_jobs.append((f"{args.outputDir}/plot_{telo_phrase}_{file_name}_{contig}_{end}.png", telo_phrase, tracks[-1], args.rangecp))
+                rows.append([file_name, telo_phrase, contig, end, length, f"{trc_val:.3f}", telolen])
+    return rows, plot_jobs
+
+def assembly_run(args, filenames, telo_phrases, num_cores):
+    '''
+    --assembly: telomere length at the ends of the contigs of each assembly in filenames, in telolengths_assembly.csv
+    '''
+    # the .fai and .gzi next to the assemblies are not inputs, nor anything else that is not fasta
+    assemblies = []
+    for seq_loc in filenames:
+        if is_index_file(seq_loc):
+            continue
+        if check_file_type(seq_loc) != "fasta":
+            tprint(f"{seq_loc} is not a fasta file, skipped")
+            continue
+        assemblies.append(seq_loc)
+    patterns = {telo_phrase: scan_patterns(args.pattern, telo_phrase, scan_errors(args)) for telo_phrase in telo_phrases}
+    sliding_val = args.slide if args.slide else len(args.pattern)
+    output_csv = f'{args.outputDir}/telolengths_assembly.csv'
+    if os.path.exists(output_csv) and os.path.getsize(output_csv) > 0 and not args.override:
+        tprint(f"Output file {output_csv} already exists and is not empty. Exiting to avoid overwrite. Use --override to force overwrite.")
+        sys.exit(1)
+    tprint(f"Assembly mode, output will be here: {output_csv}")
+
+    rows = []
+    plot_jobs = []
+    for seq_loc in assemblies:
+        try:
+            file_rows, file_jobs = process_assembly(args, seq_loc, telo_phrases, patterns, sliding_val, num_cores)
+        except ValueError as e:
+            tprint(f"Can not read {seq_loc} as an assembly, skipped: {e}")
+            continue
+        rows += file_rows
+        plot_jobs += file_jobs
+
+    with open(output_csv, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(ASSEMBLY_HEADER)
+        writer.writerows(rows)
+    found = sum(1 for row in rows if row[-1])
+    tprint(f"{found} of {len(rows)} contig ends have a telomere")
+    log_memory("assembly mode")
+
+    if plot_jobs:
+        tprint(f"drawing {len(plot_jobs)} plots on {num_cores} processes")
+        plot_files = render_plots(plot_jobs, processes=num_cores, per_sheet=args.plotsheet)
+        tprint(f"{plot_files} plot files are in here: {args.outputDir}")
+    return tprint("All telomere found, have a nice day.")
 
 def analysis_run(args):
     print("---- Topsicle run parameters ---")
@@ -160,9 +653,9 @@ def analysis_run(args):
     print("---------------------")
 
     tprint("Starting Topsicle analysis")
+    run_start, run_cpu = time.perf_counter(), time.process_time()
+    main_profile = Profile(args.profile)
 
-    manager = Manager()
-    bound_all_detected = manager.list()
     os.makedirs(args.outputDir, exist_ok=True)  #make sure we have output directory
 
     if args.threads is not None:
@@ -176,136 +669,189 @@ def analysis_run(args):
             num_cores = cpu_count()
             tprint(f"By default, Topsicle allocates number of cores: {num_cores}")
 
+    if args.scanmode == "approx":
+        # the whole repeat unit is matched, so there is a single "k-mer length", the unit length
+        telo_phrases = [len(args.pattern)]
+        try:
+            approx_table(approx_patterns(args.pattern), args.maxerrors)
+        except ValueError as e:
+            tprint(e)
+            sys.exit(1)
+        tprint(f"Approximate scan of the whole repeat unit with up to {args.maxerrors} errors")
+    elif args.telophrase is None:
+        telo_phrases= [len(args.pattern) - 2]
+        tprint(f"No telophrase provided, use kmer: {telo_phrases}")
+    else:
+        telo_phrases = args.telophrase if isinstance(args.telophrase, list) else [args.telophrase]
+    # all k-mer lengths are computed from the same pass over each input
+    telo_phrases = list(dict.fromkeys(telo_phrases))
+
+    filenames = []
+    if os.path.isdir(args.inputDir):
+        for root, dirs, files in os.walk(args.inputDir):
+            for filename in files:
+                filenames.append(os.path.join(root, filename))
+    else:
+        filenames.append(args.inputDir)
+
+    if args.assembly:
+        return assembly_run(args, filenames, telo_phrases, num_cores)
+
     output_csv = f'{args.outputDir}/telolengths_all.csv'
     tprint(f"Output will be here: {output_csv}")
+    # the manifest records how far each input got, so an interrupted run can be resumed with the same command
+    manifest_path = os.path.join(args.outputDir, MANIFEST_NAME)
+    kept_rows = None
+    states = {}
     if os.path.exists(output_csv) and os.path.getsize(output_csv) > 0:
         if args.override:
             tprint(f"Output file {output_csv} already exists and will be overridden becuz having --override flag.")
             os.remove(output_csv)
-        else:
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+        elif not os.path.exists(manifest_path):
             tprint(f"Output file {output_csv} already exists and is not empty. Exiting to avoid overwrite. Use --override to force overwrite.")
             sys.exit(1)   
-
-    if args.telophrase is None:
-        telo_phrases= [len(args.pattern) - 2]
-        tprint(f"No telophrase provided, use kmer: {telo_phrases}")
+    manifest = Manifest(manifest_path, run_params(args, telo_phrases))
+    if os.path.exists(output_csv) and os.path.getsize(output_csv) > 0:
+        if not manifest.matches():
+            tprint(f"Output file {output_csv} is from a run with different parameters ({manifest_path}). Exiting to avoid overwrite. Use --override to force overwrite.")
+            sys.exit(1)
+        kept_rows, states = resume_state(output_csv, manifest, filenames)
+        done = [seq_loc for seq_loc in filenames if states[seq_loc]["done"]]
+        tprint(f"Resuming run from {manifest_path}: {len(done)} of {len(filenames)} files already done, keeping {len(kept_rows)} rows of {output_csv}")
     else:
-        telo_phrases = args.telophrase if isinstance(args.telophrase, list) else [args.telophrase]
-    
+        manifest.clear()
         
     print("---------------------")
 
-    with open(f'{args.outputDir}/telolengths_all.csv', mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(['file_number', 'phrase','trc', "readID", 'telo_length'])
-    
-    bound_all_detected = []
+    # every result row goes through this single writer
+    sink = ResultSink(output_csv, columnar=args.resultformat, kept_rows=kept_rows, manifest=manifest)
+
     phrase_to_telo = defaultdict(list)
     phrase_to_trc = defaultdict(list)
-
+    patterns = {}
     for telo_phrase in telo_phrases:
         if telo_phrase > len(args.pattern):
             tprint(f"Cannot have length of subset larger than length of pattern")
             tprint(f"Cannot get {telo_phrase}-bp cut from {len(args.pattern)}-bp pattern")
             sys.exit()
-        
-        if args.slide:
-            sliding_val = args.slide
-        else:
-            sliding_val=len(args.pattern)
             
-        pattern = patterns_to_search(telopattern=args.pattern, cut_length=telo_phrase)
-        tprint("patterns to search:", pattern)
-
-        filenames = []
-        if not os.path.exists(args.outputDir):
-            os.makedirs(args.outputDir)
+        patterns[telo_phrase] = scan_patterns(args.pattern, telo_phrase, scan_errors(args))
+        tprint("patterns to search:", patterns[telo_phrase])
 
-        if os.path.isdir(args.inputDir):
-            for root, dirs, files in os.walk(args.inputDir):
-                for filename in files:
-                    filenames.append(os.path.join(root, filename))
+    if args.slide:
+        sliding_val = args.slide
+    else:
+        sliding_val=len(args.pattern)
+
+    if not os.path.exists(args.outputDir):
+        os.makedirs(args.outputDir)
+
+    # files finished in an interrupted run are not read again, their rows are already in the csv
+    todo = [seq_loc for seq_loc in filenames if not states.get(seq_loc, {}).get("done")]
+    results = [(states[seq_loc]["entries"], [], []) for seq_loc in filenames if seq_loc in states]
+
+    tprint("begin processing reads")
+    log_memory("setup")
+    pool_start = time.perf_counter()
+    if args.streaming:
+        # one file at a time, reads of that file are spread over the cores. 
+        # the memory budget sets how many batches can be read ahead of the workers
+        span = max(1000, args.maxlengthtelo)
+        max_in_flight = batches_in_flight(args.maxmemory, args.batchsize, span, 1000, len(telo_phrases), workers=num_cores)
+        if args.maxmemory and max_in_flight < num_cores:
+            tprint(f"--maxmemory {args.maxmemory} MB allows {max_in_flight} batches in flight for {num_cores} cores, use a smaller --batchsize to use all cores")
+        if num_cores > 1:
+            with Pool(processes=num_cores) as pool:
+                results += [process_file_stream(args, seq_loc, telo_phrases, patterns, sliding_val, sink, pool=pool, max_in_flight=max_in_flight, resume=states.get(seq_loc)) for seq_loc in todo]
         else:
-            filenames.append(args.inputDir)
-
-        tprint("begin processing reads")
-        with Manager() as manager:
-            lock = manager.Lock()
-            with Pool(processes=num_cores) as pool: 
-                results = pool.starmap(process_file, [(args, seq_loc, telo_phrase, pattern,sliding_val,lock) for seq_loc in filenames])
-
-        tprint("finished processing all reads")
-        print("---------------------")
-
-        for file_result in results:
-            for entry in file_result:
-                telophrase = entry[1]
-                telolen = float(entry[2][0][1])
-                trc_val = float(entry[3])
-                phrase_to_telo[telophrase].append(telolen)
-                phrase_to_trc[telophrase].append(trc_val)
-
-    # Compute medians for each telo_phrase
-    telo_phrases_sorted = sorted(phrase_to_telo)
-    telo_phrase_medians = []
-    median_telolen_list = []
-    median_trc_list=[]
-
-    if isinstance(args.cutoff, (list, tuple)):
-        inputtrc = args.cutoff[0]
+            results += [process_file_stream(args, seq_loc, telo_phrases, patterns, sliding_val, sink, resume=states.get(seq_loc)) for seq_loc in todo]
     else:
-        inputtrc = args.cutoff
-
-    for phrase in telo_phrases_sorted:
-        median_telo = np.median(phrase_to_telo[phrase])
-        median_trc = np.median(phrase_to_trc[phrase])
-        telo_phrase_medians.append(phrase)
-        median_telolen_list.append(median_telo)
-        median_trc_list.append(median_trc)
-        # telling TRC distribution and print obs 
-        tprint(f"k-mer: {phrase}, with TRC >= {inputtrc}, median telomere length is {median_telo:.2f} bp")
-
-        if len(phrase_to_telo[phrase]) >= 3:
-            max_trc=max(phrase_to_trc[phrase])
-            plot_path = os.path.join(args.outputDir, f"quadfit_{phrase}mer_{args.pattern}.png")
-            vertex_x, vertex_y, coeffs = fit_quadratic_and_find_vertex(
-                phrase_to_trc[phrase], phrase_to_telo[phrase], 
-                inputtrc=inputtrc, median_trc=median_trc, save_path=plot_path)
-            
-            #vertex_x, vertex_y, coeffs = fit_quadratic_and_find_vertex(phrase_to_trc[phrase], phrase_to_telo[phrase])
-
-            if vertex_x > max_trc:
-                tprint(f"Asymptotic TRC {vertex_x:.3f} is greater than max TRC, which is not expected. See plot.")
-                if median_trc < 1.0:
-                    tprint(f"Using median TRC value ({median_trc:.3f}) as asymptotic TRC instead.")
-                    vertex_x = median_trc
-                else:
-                    tprint(f"Using 0.9 as asymptotic TRC instead, since asymptotic is greater than 1.0.")
-                    vertex_x = 0.9
-            if vertex_x < 0.4:
-                tprint("Quadratic fit suggests asymptotic TRC less than 0.4. See plot with fit line")
-                if max_trc < 0.4:
-                    tprint(f"Maximum TRC value in data is {max_trc:.3f}, which is less than 0.4, indicating low confidence in telomere detection.")
-                if vertex_x < inputtrc:
-                    tprint(f"Asymptotic TRC {vertex_x:.3f} is less than input cutoff {inputtrc:.3f}. Topsicle declares input TRC (={inputtrc}) as asymptotic TRC.")
-                    vertex_x = inputtrc
-            
-            tprint(f"asymptotic TRC, or recommended cutoff: {vertex_x:.3f}")
-
-            # Get telomere lengths where TRC > vertex_x
-            filtered_telolen = [
-                telo for trc, telo in zip(phrase_to_trc[phrase], phrase_to_telo[phrase])
-                if trc >= vertex_x
-            ]
-            if filtered_telolen:
-                median_filtered_telolen = np.median(filtered_telolen)
-                tprint(f"Median telomere length for reads with TRC cutoff >= {vertex_x:.3f}: {median_filtered_telolen:.2f} bp")
+        with Manager() as manager:
+            # workers send their rows in chunks, a thread here writes them
+            rows_queue = manager.Queue()
+            writer_thread = threading.Thread(target=sink.drain, args=(rows_queue,))
+            writer_thread.start()
+            try:
+                with Pool(processes=num_cores) as pool: 
+                    worker_memory = args.maxmemory / num_cores if args.maxmemory else None
+                    # every worker inflates its own input, the cores left over when there are fewer inputs than workers are shared out
+                    worker_threads = max(1, num_cores // max(1, min(num_cores, len(todo))))
+                    results += pool.starmap(process_file, [(args, seq_loc, telo_phrases, patterns, sliding_val, rows_queue, worker_memory, states.get(seq_loc), worker_threads)
+                                                           for seq_loc in todo])
+            finally:
+                rows_queue.put(None)
+                writer_thread.join()
+    sink.close()
+    pool_wall = time.perf_counter() - pool_start
+    main_profile.add_time("analysis", pool_wall)
+    if children_peak_rss_mb() > 0:
+        tprint(f"peak memory (RSS) of the largest worker process: {children_peak_rss_mb():.1f} MB")
+    if args.resultformat:
+        tprint(f"Results are also in here: {sink.columnar_path()}")
+
+    tprint("finished processing all reads")
+
+    # figures are drawn after the analysis, on all cores
+    plot_jobs = [job for file_result, file_jobs, file_metrics in results for job in file_jobs]
+    if plot_jobs:
+        tprint(f"drawing {len(plot_jobs)} plots on {num_cores} processes")
+        with main_profile.stage("plotting"):
+            plot_files = render_plots(plot_jobs, processes=num_cores, per_sheet=args.plotsheet)
+        main_profile.count("plots", plot_files)
+        tprint(f"{plot_files} plot files are in here: {args.outputDir}")
+    print("---------------------")
+
+    for file_result, file_jobs, file_metrics in results:
+        for entry in file_result:
+            telophrase = entry[1]
+            telolen = float(entry[2][0][1])
+            trc_val = float(entry[3])
+            phrase_to_telo[telophrase].append(telolen)
+            phrase_to_trc[telophrase].append(trc_val)
+
+    # report each telo_phrase at every requested cutoff, from the TRC and boundary already computed at the lowest one
+    cutoffs = list(dict.fromkeys(args.cutoff)) if isinstance(args.cutoff, (list, tuple)) else [args.cutoff]
+    summary_rows = []
+    sweep_rows = []
+
+    for phrase in sorted(phrase_to_telo):
+        trc_arr = np.array(phrase_to_trc[phrase])
+        telo_arr = np.array(phrase_to_telo[phrase])
+        for inputtrc in cutoffs:
+            if len(cutoffs) == 1:
+                plot_path = os.path.join(args.outputDir, f"quadfit_{phrase}mer_{args.pattern}.png")
             else:
-                tprint(f"No read has TRC >= {vertex_x:.3f}, please double check the data or submit log to GitHub.")
-        else:
-            tprint("Not enough data points to recommend TRC cutoff.")
+                plot_path = os.path.join(args.outputDir, f"quadfit_{phrase}mer_{args.pattern}_trc{inputtrc}.png")
+            # same reads as a run with only this cutoff
+            keep = trc_arr > inputtrc
+            summary_rows.append(report_cutoff(phrase, trc_arr[keep], telo_arr[keep], inputtrc, plot_path))
+
+        if args.cutoffstep:
+            grid = np.arange(min(cutoffs), trc_arr.max() + args.cutoffstep, args.cutoffstep) if len(trc_arr) else []
+            sweep_rows.extend([phrase] + list(row) for row in cutoff_sweep(trc_arr, telo_arr, np.round(grid, 6)))
+
+    with open(f'{args.outputDir}/cutoff_summary.csv', mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['phrase', 'cutoff', 'reads', 'median_telo_length', 'recommended_cutoff', 'median_telo_length_recommended'])
+        writer.writerows(summary_rows)
+
+    if args.cutoffstep:
+        with open(f'{args.outputDir}/cutoff_sweep.csv', mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['phrase', 'cutoff', 'reads', 'median_telo_length'])
+            writer.writerows(sweep_rows)
+        tprint(f"TRC cutoff sweep is in here: {args.outputDir}/cutoff_sweep.csv")
+
+    if args.profile:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        run = {"mode": "streaming" if args.streaming else "default", "threads": num_cores, "files": len(filenames), "files_processed": len(todo),
+               "wall": time.perf_counter() - run_start, "cpu_main": time.process_time() - run_cpu, "cpu_workers": children.ru_utime + children.ru_stime}
+        work_metrics = [item for file_result, file_jobs, file_metrics in results for item in file_metrics]
+        metrics_path = write_metrics(args.outputDir, run, work_metrics, main_profile.result(), num_cores, pool_wall)
+        tprint(f"Run metrics are in here: {metrics_path}")
 
-        
     return tprint("All telomere found, have a nice day.")
 
 version_number = "1.0.0"
@@ -323,17 +869,36 @@ def main():
     parser.add_argument('--rawcountpattern', action='store_true', help='Output raw count of the k-mer for each window')
     parser.add_argument('--telophrase', nargs='+', metavar="INT",type=int, help='Length of telomere k-mer to search. By default will use telomere k-mer length minus 2')
     parser.add_argument('--cutoff',nargs='+',metavar="FLOAT", type=float, help='TRC statistics threshold', default=0.7)
+    parser.add_argument('--cutoffstep',metavar="FLOAT", type=float, help='Optional, also report read count and median telomere length for a grid of TRC cutoffs with this step, from the lowest --cutoff (cutoff_sweep.csv)')
     parser.add_argument('--windowSize',metavar="INT", type=int, help='Sliding window size', default=100)
     parser.add_argument('--slide',metavar="INT", type=int, help='Window sliding step. Default is telomere k-mer length')
     parser.add_argument('--trimfirst',metavar="INT", type=int, help='Length of intial number of base pairs to trim', default=100)
     parser.add_argument('--maxlengthtelo',metavar="INT", type=int, help='Longest possible length of telomere for any given read', default=20000)
     parser.add_argument('--plot', action='store_true', help='Optional, generate plot showing for each telomere read the abundance across the sequencing reead and the changepoint')
+    parser.add_argument('--plotmax', metavar="INT", type=int, help='Optional, with --plot, plot only the first INT reads over the TRC cutoff of each input', default=None)
+    parser.add_argument('--plotsheet', metavar="INT", type=int, help='Optional, with --plot, put INT read ends on each png (plot_<k-mer>_sheet_<number>.png) instead of one png per read end', default=0)
+    parser.add_argument('--trackstore', action='store_true', help='Optional, save the mean window track of every read end checked in step 2 (<input name>.tracks.bin and .tracks.idx), to replot or try other changepoint settings without reading the input again')
     parser.add_argument('--rangecp',metavar="INT", type=int, help='Optional, set range of changepoint plot for visualization, default is maxlengthtelo')
     parser.add_argument('--read_check',metavar="STR", type=str, help='Optional, get telomere of a specific read')
-    parser.add_argument('--override','-ov', action='store_true', help='Override telolengths_all.csv file but keep subset fastq')
+    parser.add_argument('--override','-ov', action='store_true', help='Override telolengths_all.csv file but keep subset fastq. Without it, an interrupted run in the same output directory is resumed (topsicle_manifest.json)')
+    parser.add_argument('--streaming', action='store_true', help='Optional, compute TRC and telomere boundary in one pass over each input, without writing the subset fastq. Reads of each input are processed in batches on all threads')
+    parser.add_argument('--batchsize', metavar="INT", type=int, help='Number of reads sent to a worker at a time in --streaming mode', default=500)
+    parser.add_argument('--engine', type=str, choices=['numpy', 'regex'], help='K-mer counting engine for TRC (step 1), both give the same TRC', default='numpy')
+    parser.add_argument('--scanmode', type=str, choices=['kmer', 'approx'], help='Optional, kmer counts every k-mer of the repeat exactly. approx matches the whole repeat unit (and its complement) allowing up to --maxerrors substitutions, insertions or deletions, in one bit-parallel pass per read end, for both TRC and the mean window values (--telophrase is not used)', default='kmer')
+    parser.add_argument('--maxerrors', metavar="INT", type=int, help='Optional, with --scanmode approx, most errors in one occurrence of the repeat unit (at most (unit length - 2) / 2)', default=1)
+    parser.add_argument('--noprefilter', action='store_true', help='Optional, count the TRC of every read in full. By default reads that can not reach the lowest --cutoff (bounded from the 3-mer composition of their ends) are skipped, with the same results, and their TRC is not saved in the TRC cache: a later run with a lower --cutoff counts every read again. Use it when the same input will be run at several cutoffs, the TRC of every read is then cached')
+    parser.add_argument('--changepoint', type=str, choices=['native', 'ruptures'], help='Changepoint backend for the telomere boundary (step 2). native gives the same boundary as ruptures Binseg, which is optional to install', default='native')
+    parser.add_argument('--maxmemory', '--max-memory', metavar="MB", type=float, help='Optional, memory budget in MB for the reads being processed (on top of the base memory of each process). Limits the number of batches read ahead in --streaming mode, and the number of reads counted together in step 1', default=None)
+    parser.add_argument('--cachedir', metavar="FOLDER", type=str, help='Optional, folder of the per-read TRC cache (<input name>.<path hash>.trc.npz), by default outputDir. A run with the same input, pattern, telophrase and minSeqLength reuses it and starts at step 2 (not used in --streaming mode)', default=None)
+    parser.add_argument('--notrccache', action='store_true', help='Optional, do not read or write the per-read TRC cache')
+    parser.add_argument('--resultformat', type=str, choices=['npz', 'csv.gz'], help='Optional, also save telolengths_all.csv in a compact format next to it, for fast loading (telolengths_all.npz or telolengths_all.csv.gz)', default=None)
+    parser.add_argument('--profile', action='store_true', help='Optional, record wall and CPU time, bytes read and reads of each stage and input, and how busy the workers were, in metrics.json next to telolengths_all.csv')
+    parser.add_argument('--cprofile', action='store_true', help='Optional, same as --profile and also run the hot loop (step 2, or the batches in --streaming mode) under cProfile in every worker, stats of all workers in profile.prof')
+    parser.add_argument('--assembly', action='store_true', help='Optional, the inputs are genome assemblies (fasta, plain or bgzipped): report the telomere length at both ends of every contig (telolengths_assembly.csv). Only the ends of the contigs are read, through the .fai index (and .gzi for bgzip), built next to the fasta if missing')
     parser.add_argument('--threads','-t',metavar="INT", type=int, help='Number of CPU cores to use (by default, all available cores)', default=None)
 
     args = parser.parse_args()
+    args.profile = args.profile or args.cprofile
     tprint.logfile = get_log_path(args)
     
     analysis_run(args)
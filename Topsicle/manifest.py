@@ -0,0 +1,91 @@
+# Topsicle
+# resumable runs: the manifest (topsicle_manifest.json in the output directory) records, for every input file,
+# its size and mtime and how far its results got into telolengths_all.csv (batches or reads done, rows written).
+# the run parameters that change the results are saved with it, so a rerun with the same input and parameters
+# skips the finished files, continues the unfinished ones and only appends the missing rows
+
+import json
+import os
+import time
+
+MANIFEST_NAME = "topsicle_manifest.json"
+
+def run_params(args, telo_phrases):
+    '''
+    Parameters that change the rows of telolengths_all.csv (or how work is split into batches), as a json-able dict
+    '''
+    return {
+        "pattern": args.pattern, "telophrase": list(telo_phrases), "cutoff": min(args.cutoff) if isinstance(args.cutoff, (list, tuple)) else args.cutoff,
+        "minSeqLength": args.minSeqLength, "windowSize": args.windowSize, "slide": args.slide, "trimfirst": args.trimfirst,
+        "maxlengthtelo": args.maxlengthtelo, "changepoint": args.changepoint, "read_check": args.read_check,
+        "streaming": bool(args.streaming), "batchsize": args.batchsize if args.streaming else None,
+        "plot": bool(args.plot), "rawcountpattern": bool(args.rawcountpattern),
+        "scanmode": args.scanmode, "maxerrors": args.maxerrors if args.scanmode == "approx" else None,
+    }
+
+def file_fingerprint(filepath):
+    '''
+    Size and modification time of an input file, it is redone if they change
+    '''
+    stat = os.stat(filepath)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+class Manifest:
+    '''
+    Completion markers of the input files of one run
+    path: manifest file
+    params: from run_params
+    save_every: seconds between two saves of the manifest while a file is in progress (it is always saved when a file is done)
+    '''
+    def __init__(self, path, params, save_every=2.0):
+        self.path = path
+        self.params = params
+        self.save_every = save_every
+        self.last_save = 0.0
+        self.files = {}
+        self.saved_params = None
+        if os.path.exists(path):
+            with open(path) as handle:
+                saved = json.load(handle)
+            self.saved_params = saved.get("params")
+            if self.saved_params == params:
+                self.files = saved.get("files", {})
+
+    def matches(self):
+        '''
+        True if there is a saved manifest from a run with the same parameters
+        '''
+        return self.saved_params == self.params
+
+    def clear(self):
+        '''
+        Forget the saved files, for a new run in the same output directory
+        '''
+        self.files = {}
+
+    def file_state(self, filepath):
+        '''
+        Saved state of filepath: {"units": batches or reads done, "rows": rows written, "done": bool},
+        None if the file was not started or changed since
+        '''
+        state = self.files.get(os.path.abspath(filepath))
+        if state is None or state.get("fingerprint") != file_fingerprint(filepath):
+            return None
+        return state
+
+    def mark(self, filepath, units, rows, done=False):
+        '''
+        Record that the first units batches (streaming) or reads (step 2) of filepath are written, as rows rows of the csv
+        '''
+        key = os.path.abspath(filepath)
+        self.files[key] = {"fingerprint": file_fingerprint(filepath), "units": units, "rows": rows, "done": done}
+        if done or time.time() - self.last_save >= self.save_every:
+            self.save()
+
+    def save(self):
+        # write to a temporary file and rename, so a crash never leaves a half written manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as handle:
+            json.dump({"params": self.params, "files": self.files}, handle, indent=1)
+        os.replace(tmp_path, self.path)
+        self.last_save = time.time()
@@ -0,0 +1,71 @@
+# Topsicle
+# memory accounting: peak resident memory (RSS) of each stage for the run log,
+# and how much work can be in flight under a memory budget (--maxmemory)
+
+import sys
+import resource
+
+# rough size of what a read end costs while it is in flight: the str itself, its pickled copy to the worker
+# and the numpy k-mer arrays (codes, index, valid) built from it, per base pair
+BYTES_PER_BP_IN_FLIGHT = 4
+BYTES_PER_BP_COUNTED = 32
+
+def peak_rss_mb():
+    '''
+    Peak resident memory of this process in MB, since it started or since the last reset_peak_rss
+    '''
+    try:
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def children_peak_rss_mb():
+    '''
+    Largest peak resident memory of the finished child processes (pool workers) in MB
+    '''
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def reset_peak_rss():
+    '''
+    Start a new peak for peak_rss_mb (Linux only, elsewhere the peak stays the peak since the process started)
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as handle:
+            handle.write("5")
+    except OSError:
+        pass
+
+def batch_memory(batch_size, span, no_bp, n_kmers=1):
+    '''
+    Estimated bytes of one batch of reads in flight: its read ends, and the k-mer arrays while it is counted
+    span: base pairs kept at each end of a read
+    n_kmers: number of k-mer lengths counted on the batch
+    '''
+    return batch_size * 2 * (span * BYTES_PER_BP_IN_FLIGHT + no_bp * BYTES_PER_BP_COUNTED * n_kmers)
+
+def batches_in_flight(max_memory_mb, batch_size, span, no_bp, n_kmers=1, workers=1):
+    '''
+    Number of batches that can be read ahead of the workers under max_memory_mb
+    max_memory_mb: memory budget in MB, None for no budget (2 batches per worker)
+    return: int, at least 1
+    '''
+    if not max_memory_mb:
+        return 2 * workers
+    fit = int(max_memory_mb * 1024 * 1024 // batch_memory(batch_size, span, no_bp, n_kmers))
+    return max(1, min(fit, 2 * workers))
+
+def trc_batch_size(max_memory_mb, no_bp, n_kmers=1, default=256):
+    '''
+    Number of reads counted together in step 1 under max_memory_mb (for one worker)
+    return: int, at most default, at least 1
+    '''
+    if not max_memory_mb:
+        return default
+    fit = int(max_memory_mb * 1024 * 1024 // (2 * no_bp * BYTES_PER_BP_COUNTED * n_kmers))
+    return max(1, min(fit, default))
@@ -0,0 +1,31 @@
+# Topsicle
+# matplotlib and seaborn are only imported when something is plotted: together they take seconds to import,
+# and runs without plots (and every pool worker) do not need them
+
+_style = {}
+
+def pyplot():
+    '''
+    matplotlib.pyplot, with the Topsicle plot style (seaborn whitegrid, grey dashed grid) set the first time it is used
+    '''
+    import matplotlib.pyplot as plt
+    if not _style:
+        import seaborn as sns
+        _style["colors"] = sns.color_palette("colorblind", n_colors=30)
+        sns.set_style("whitegrid", {'grid.color': 'grey', 'grid.linestyle': '--'})
+    return plt
+
+def seaborn():
+    '''
+    seaborn, with the Topsicle plot style set
+    '''
+    pyplot()
+    import seaborn as sns
+    return sns
+
+def palette():
+    '''
+    Colors of the k-mers in pattern plots (seaborn colorblind palette)
+    '''
+    pyplot()
+    return _style["colors"]
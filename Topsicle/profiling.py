@@ -0,0 +1,156 @@
+# Topsicle
+# run metrics of --profile: wall and CPU time of each stage of each input, with what it went through
+# (bytes read, reads scanned, reads over the TRC cutoff), how step 2 time splits into reading the subset, window counts,
+# changepoint and plotting, and how busy the pool workers were. Workers send their metrics back with their results,
+# the main process adds them up and writes metrics.json next to telolengths_all.csv.
+# with --cprofile, the hot loop (step 2, or the batches of --streaming) also runs under cProfile in every worker,
+# and the stats of all workers are written together to profile.prof (python -m pstats profile.prof)
+
+import cProfile
+import json
+import os
+import pstats
+import time
+from contextlib import contextmanager
+
+METRICS_NAME = "metrics.json"
+CPROFILE_NAME = "profile.prof"
+
+class Profile:
+    '''
+    Metrics of one unit of work (an input file, a batch of reads, or the main process)
+    enabled: without it every call does nothing, so runs without --profile do not pay for it
+    cprofile: also run the hot stages under cProfile
+    '''
+    def __init__(self, enabled=False, cprofile=False):
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = {}
+        self.profiler = cProfile.Profile() if enabled and cprofile else None
+
+    @contextmanager
+    def stage(self, name, hot=False):
+        '''
+        Time the block as stage name, hot: run it under cProfile with --cprofile
+        '''
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        if hot and self.profiler is not None:
+            self.profiler.enable()
+        try:
+            yield
+        finally:
+            if hot and self.profiler is not None:
+                self.profiler.disable()
+            self.add_time(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add_time(self, name, wall, cpu=None, calls=1):
+        if not self.enabled:
+            return
+        stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        stage["wall"] += wall
+        stage["cpu"] += cpu if cpu is not None else 0.0
+        stage["calls"] += calls
+
+    def add_timings(self, timings, prefix=""):
+        '''
+        Add a dict of name -> seconds (wall only), such as the timings of bound_detect_ends
+        '''
+        for name, seconds in timings.items():
+            self.add_time(prefix + name, seconds, calls=0)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timed_iter(self, name, iterable):
+        '''
+        Iterate over iterable, the time spent getting each item is added to stage name
+        '''
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - wall, time.process_time() - cpu, calls=0)
+                return
+            self.add_time(name, time.perf_counter() - wall, time.process_time() - cpu)
+            yield item
+
+    def result(self):
+        '''
+        Picklable metrics to send back to the main process, None if not enabled
+        '''
+        if not self.enabled:
+            return None
+        stats = None
+        if self.profiler is not None:
+            self.profiler.create_stats()
+            stats = self.profiler.stats
+        return {"pid": os.getpid(), "stages": self.stages, "counters": self.counters, "cprofile": stats}
+
+def merge_into(total, metrics):
+    '''
+    Add the stages and counters of metrics (from Profile.result) to total
+    '''
+    for name, stage in metrics["stages"].items():
+        into = total["stages"].setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        for key in ("wall", "cpu", "calls"):
+            into[key] += stage[key]
+    for name, value in metrics["counters"].items():
+        total["counters"][name] = total["counters"].get(name, 0) + value
+
+class _Stats:
+    # what pstats.Stats needs to load the stats of another process
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+def write_metrics(output_dir, run, work_metrics, main_metrics, workers, pool_wall):
+    '''
+    Write metrics.json (and profile.prof if there are cProfile stats) in output_dir
+    run: dict describing the run (mode, threads, total time)
+    work_metrics: list of (input file name, metrics from Profile.result) of the work done on each input, 
+                  the time of its "worker" stage counts as busy time of the process that did it
+    main_metrics: metrics of the main process (reading in --streaming mode, plotting, summary)
+    workers: number of processes doing the work (pool workers, or 1 when it is done in the main process)
+    pool_wall: wall time in seconds while the pool was working
+    return: path of metrics.json
+    '''
+    per_file = {}
+    busy = {}
+    for file_name, metrics in work_metrics:
+        merge_into(per_file.setdefault(file_name, {"stages": {}, "counters": {}}), metrics)
+        if "worker" in metrics["stages"]:
+            busy[metrics["pid"]] = busy.get(metrics["pid"], 0.0) + metrics["stages"]["worker"]["wall"]
+    utilization = sum(busy.values()) / (pool_wall * workers) if pool_wall > 0 and workers else None
+
+    totals = {"stages": {}, "counters": {}}
+    for file_metrics in per_file.values():
+        merge_into(totals, file_metrics)
+    merge_into(totals, main_metrics)
+
+    report = {
+        "run": run,
+        "totals": totals,
+        "main": {"stages": main_metrics["stages"], "counters": main_metrics["counters"]},
+        "files": per_file,
+        "workers": {"processes": workers, "pool_wall": pool_wall, "busy": {str(pid): seconds for pid, seconds in busy.items()},
+                    "utilization": utilization},
+    }
+    path = os.path.join(output_dir, METRICS_NAME)
+    with open(path, "w") as handle:
+        json.dump(report, handle, indent=2)
+
+    stats = [metrics["cprofile"] for metrics in [metrics for file_name, metrics in work_metrics] + [main_metrics] if metrics.get("cprofile")]
+    if stats:
+        pstats.Stats(*[_Stats(stat) for stat in stats]).dump_stats(os.path.join(output_dir, CPROFILE_NAME))
+    return path
@@ -0,0 +1,143 @@
+# Topsicle
+# raw window counts of --rawcountpattern, one compressed file per input (<input name>.rawcount.npz) instead of one csv per read.
+# the counts come from the same window counts as the boundary (bound_detect_ends rawcounts), as integer arrays.
+# for each k-mer length k the file has:
+#   read_id_k, tail_k, offset_k, windows_k: one entry per read end, its windows are rows offset_k:offset_k + windows_k
+#   position_k: window start of every row, count_k: count of each pattern (columns, patterns_k) in every row
+# while the run goes, rows are spooled to <input name>.rawcount.part.* files, so memory does not grow with the number of reads
+
+import os
+import numpy as np
+
+class RawCountWriter:
+    '''
+    Collect the raw window counts of one input, written to <input name>.rawcount.npz on close
+    patterns: dict of k-mer length -> patterns (count columns)
+    append: continue the spool of an interrupted run (resumed run), otherwise start a new one
+    '''
+    def __init__(self, output_dir, file_name, patterns, append=False):
+        self.path = os.path.join(output_dir, f"{file_name}.rawcount.npz")
+        self.spool = os.path.join(output_dir, f"{file_name}.rawcount.part")
+        self.patterns = patterns
+        self.mode = "ab" if append and os.path.exists(self.spool + ".idx") else "wb"
+        self.positions = {}
+        self.counts = {}
+        self.offset = {}
+        if self.mode == "ab":
+            self.truncate_spool()
+        self.index = open(self.spool + ".idx", self.mode[0])
+
+    def truncate_spool(self):
+        '''
+        Drop what an interrupted run wrote after its last complete index line, so rows and index stay in step
+        '''
+        with open(self.spool + ".idx") as handle:
+            lines = [line for line in handle if line.endswith("\n") and len(line.split("\t")) == 5]
+        with open(self.spool + ".idx", "w") as handle:
+            handle.writelines(lines)
+        for line in lines:
+            fields = line.split("\t")
+            kmer = int(fields[1])
+            self.offset[kmer] = max(self.offset.get(kmer, 0), int(fields[3]) + int(fields[4]))
+        for kmer, patterns in self.patterns.items():
+            for name, width in (("positions", 1), ("counts", len(patterns))):
+                path = f"{self.spool}.{kmer}.{name}"
+                if os.path.exists(path):
+                    os.truncate(path, 4 * width * self.offset.get(kmer, 0))
+
+    def spool_files(self, kmer):
+        if kmer not in self.positions:
+            self.positions[kmer] = open(f"{self.spool}.{kmer}.positions", self.mode)
+            self.counts[kmer] = open(f"{self.spool}.{kmer}.counts", self.mode)
+            self.offset.setdefault(kmer, 0)
+        return self.positions[kmer], self.counts[kmer]
+
+    def add(self, read_id, kmer, rawcounts):
+        '''
+        rawcounts: list of (tail, window starts, counts) of the read ends of read_id, from bound_detect_ends
+        '''
+        positions, counts = self.spool_files(kmer)
+        for direction, starts, end_counts in rawcounts:
+            positions.write(np.asarray(starts, dtype=np.int32).tobytes())
+            counts.write(np.asarray(end_counts, dtype=np.int32).tobytes())
+            self.index.write(f"{read_id}\t{kmer}\t{direction}\t{self.offset[kmer]}\t{len(starts)}\n")
+            self.offset[kmer] += len(starts)
+
+    def flush(self):
+        # rows first, so an index line never points past the end of the rows
+        for handle in list(self.positions.values()) + list(self.counts.values()):
+            handle.flush()
+        self.index.flush()
+
+    def close(self):
+        '''
+        Write <input name>.rawcount.npz from the spool and remove the spool
+        '''
+        self.flush()
+        for handle in list(self.positions.values()) + list(self.counts.values()) + [self.index]:
+            handle.close()
+
+        entries = {}
+        with open(self.spool + ".idx") as handle:
+            for line in handle:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 5:
+                    # a read end computed again in a resumed run is kept once, the last time
+                    entries[(fields[0], int(fields[1]), fields[2])] = (int(fields[3]), int(fields[4]))
+
+        arrays = {}
+        for kmer, patterns in self.patterns.items():
+            keys = [key for key in entries if key[1] == kmer]
+            n_patterns = len(patterns)
+            positions = spool_array(f"{self.spool}.{kmer}.positions")
+            counts = spool_array(f"{self.spool}.{kmer}.counts").reshape(-1, n_patterns) if n_patterns else np.zeros((0, 0), dtype=np.int32)
+            spans = [entries[key] for key in keys]
+            # rows are already in order unless a resumed run computed some read ends again
+            if all(spans[i][0] + spans[i][1] == spans[i + 1][0] for i in range(len(spans) - 1)) and (not spans or spans[0][0] == 0):
+                rows = slice(0, spans[-1][0] + spans[-1][1] if spans else 0)
+            else:
+                rows = np.concatenate([np.arange(start, start + windows) for start, windows in spans])
+            windows = np.array([windows for start, windows in spans], dtype=np.int64)
+            arrays[f"read_id_{kmer}"] = np.array([key[0] for key in keys], dtype=str)
+            arrays[f"tail_{kmer}"] = np.array([key[2] for key in keys], dtype=str)
+            arrays[f"windows_{kmer}"] = windows
+            arrays[f"offset_{kmer}"] = np.concatenate([[0], np.cumsum(windows)[:-1]]).astype(np.int64) if len(windows) else windows
+            arrays[f"position_{kmer}"] = positions[rows]
+            arrays[f"count_{kmer}"] = counts[rows]
+            arrays[f"patterns_{kmer}"] = np.array(patterns, dtype=str)
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as handle:
+            np.savez_compressed(handle, **arrays)
+        os.replace(tmp_path, self.path)
+
+        for kmer in self.patterns:
+            for name in ("positions", "counts"):
+                if os.path.exists(f"{self.spool}.{kmer}.{name}"):
+                    os.remove(f"{self.spool}.{kmer}.{name}")
+        os.remove(self.spool + ".idx")
+
+def spool_array(path):
+    '''
+    int32 values of a spool file, memory mapped
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.int32)
+    return np.memmap(path, dtype=np.int32, mode="r")
+
+def read_rawcount(path, read_id, kmer):
+    '''
+    Raw window counts of one read from a <input name>.rawcount.npz file
+    return: pandas DataFrame with columns tail, position, pattern, count, same as the rawcount csv of earlier versions
+    '''
+    import pandas as pd
+    rows = []
+    with np.load(path) as data:
+        patterns = data[f"patterns_{kmer}"].tolist()
+        for i in np.flatnonzero(data[f"read_id_{kmer}"] == read_id):
+            start, windows = data[f"offset_{kmer}"][i], data[f"windows_{kmer}"][i]
+            tail = str(data[f"tail_{kmer}"][i])
+            positions = data[f"position_{kmer}"][start:start + windows].tolist()
+            counts = data[f"count_{kmer}"][start:start + windows].tolist()
+            rows.extend((tail, position, pattern, count) for position, row in zip(positions, counts) for pattern, count in zip(patterns, row))
+    return pd.DataFrame(rows, columns=['tail', 'position', 'pattern', 'count'])
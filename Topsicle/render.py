@@ -0,0 +1,108 @@
+# Topsicle
+# plot rendering stage: boundary detection only records the mean window track and boundary of each read it plots,
+# and the figures are drawn afterwards, in a process pool with the Agg backend, so plotting does not slow down the analysis
+# a plot job is (png path, k-mer length, track, plotcp_range), track is (read id, tail, x, y, boundary point, maxlengthtelo)
+# as recorded by bound_detect_ends
+
+import os
+from multiprocessing import Pool
+
+from Topsicle.allsteps import plot_boundary, draw_boundary
+from Topsicle.plotstyle import pyplot
+
+# panels per row of a sheet
+SHEET_COLUMNS = 2
+
+def use_agg():
+    '''
+    Draw without a display (and without the cost of an interactive backend)
+    '''
+    import matplotlib
+    matplotlib.use("Agg")
+
+def render_plot(job):
+    '''
+    Draw one read end in its own figure, same as --plot always did
+    return: path of the png
+    '''
+    use_agg()
+    plt = pyplot()
+    path, telo_phrase, track, plotcp_range = job
+    read_id, direction, x, y, telo_boundary_point, maxlengthtelo = track
+    plot_boundary(read_id, x, y, telo_boundary_point, maxlengthtelo, plotcp_range)
+    plt.savefig(path, format='png', dpi=300)
+    plt.close()
+    return path
+
+def render_sheet(sheet):
+    '''
+    Draw several read ends as the panels of one figure
+    sheet: (png path, list of plot jobs)
+    return: path of the png
+    '''
+    use_agg()
+    plt = pyplot()
+    path, jobs = sheet
+    columns = min(SHEET_COLUMNS, len(jobs))
+    rows = (len(jobs) + columns - 1) // columns
+    fig, axes = plt.subplots(rows, columns, figsize=(7.5 * columns, 3 * rows), dpi=300, squeeze=False)
+    for ax, (job_path, telo_phrase, track, plotcp_range) in zip(axes.flat, jobs):
+        read_id, direction, x, y, telo_boundary_point, maxlengthtelo = track
+        draw_boundary(ax, read_id, x, y, telo_boundary_point, maxlengthtelo, plotcp_range)
+        ax.grid(True)
+    for ax in list(axes.flat)[len(jobs):]:
+        ax.set_visible(False)
+    fig.tight_layout()
+    fig.savefig(path, format='png', dpi=300)
+    plt.close(fig)
+    return path
+
+def plot_sheets(jobs, per_sheet):
+    '''
+    Group plot jobs into sheets of per_sheet panels, each sheet has one k-mer length, in the order of jobs
+    return: list of (png path, list of plot jobs), sheets named plot_<k-mer length>_sheet_<number>.png next to the single plots
+    '''
+    by_phrase = {}
+    for job in jobs:
+        by_phrase.setdefault(job[1], []).append(job)
+    sheets = []
+    for telo_phrase, phrase_jobs in by_phrase.items():
+        for number, start in enumerate(range(0, len(phrase_jobs), per_sheet), start=1):
+            path = os.path.join(os.path.dirname(phrase_jobs[start][0]), f"plot_{telo_phrase}_sheet_{number}.png")
+            sheets.append((path, phrase_jobs[start:start + per_sheet]))
+    return sheets
+
+def render_plots(jobs, processes=1, per_sheet=0):
+    '''
+    Draw the plot jobs recorded by the analysis
+    processes: number of processes drawing at the same time
+    per_sheet: 0 for one png per read end, otherwise number of read ends per png
+    return: number of png written
+    '''
+    if per_sheet:
+        func, tasks = render_sheet, plot_sheets(jobs, per_sheet)
+    else:
+        func, tasks = render_plot, list(jobs)
+    if not tasks:
+        return 0
+
+    if processes > 1 and len(tasks) > 1:
+        with Pool(processes=min(processes, len(tasks))) as pool:
+            chunksize = max(1, len(tasks) // (4 * processes))
+            pool.map(func, tasks, chunksize=chunksize)
+    else:
+        for task in tasks:
+            func(task)
+    return len(tasks)
+
+def store_plot_jobs(tracks, output_dir, plotcp_range=None):
+    '''
+    Plot jobs of every read end of a track store (trackstore.Tracks), to redraw plots without reading the input again
+    return: list of plot jobs, png named plot_<k-mer length>_<read id>_<tail>.png in output_dir
+    '''
+    jobs = []
+    for i in range(len(tracks)):
+        track = tracks[i]
+        telo_phrase = int(tracks.kmer[i])
+        jobs.append((os.path.join(output_dir, f"plot_{telo_phrase}_{track[0]}_{track[1]}.png"), telo_phrase, track, plotcp_range))
+    return jobs
@@ -0,0 +1,148 @@
+# Topsicle
+# single writer for the per-read results (telolengths_all.csv)
+# workers do not open the csv or take a lock for every row: they buffer rows and send them in chunks through a queue,
+# and one writer thread in the main process appends them to the csv, which stays open for the whole run.
+# the same rows can also be saved in a compact format next to the csv (.npz or .csv.gz) for fast loading later.
+# progress markers of the resumable manifest go through the writer too, after the rows they cover are written
+
+import csv
+import gzip
+import time
+import numpy as np
+
+RESULT_HEADER = ['file_number', 'phrase', 'trc', 'readID', 'telo_length']
+# number of rows buffered before they are sent / written
+CHUNK_ROWS = 500
+
+class ResultSink:
+    '''
+    Writer of the result rows: one open csv, rows written in batches, optionally a columnar copy when closed
+    path: csv file, created with the header if new or empty
+    columnar: None, "npz" (numpy arrays, np.load) or "csv.gz", written next to the csv as path without .csv + extension
+    flush_rows: number of buffered rows before writing them
+    kept_rows: optional, rows of a previous run to keep (resumed run), the csv is rewritten with only them before new rows are added
+    manifest: optional, manifest.Manifest that progress markers are recorded in
+    '''
+    def __init__(self, path, columnar=None, flush_rows=CHUNK_ROWS, kept_rows=None, manifest=None):
+        self.path = path
+        self.columnar = columnar
+        self.flush_rows = flush_rows
+        self.buffer = []
+        self.rows_written = 0
+        self.columns = {name: [] for name in RESULT_HEADER} if columnar == "npz" else None
+        self.gz_handle = None
+        self.manifest = manifest
+
+        self.handle = open(path, mode='a' if kept_rows is None else 'w', newline='')
+        self.writer = csv.writer(self.handle)
+        if self.handle.tell() == 0:
+            self.writer.writerow(RESULT_HEADER)
+        if columnar == "csv.gz":
+            self.gz_handle = gzip.open(self.columnar_path(), "wt", newline='')
+            self.gz_writer = csv.writer(self.gz_handle)
+            self.gz_writer.writerow(RESULT_HEADER)
+        elif columnar not in (None, "npz"):
+            raise ValueError(f"Unknown result format: {columnar}")
+        if kept_rows:
+            self.add_rows(kept_rows)
+            self.flush()
+
+    def columnar_path(self):
+        base = self.path[:-len(".csv")] if self.path.endswith(".csv") else self.path
+        return f"{base}.{self.columnar}"
+
+    def add(self, row):
+        '''
+        Add one row: [file name, k-mer length, TRC (formatted), read id, telomere length]
+        '''
+        self.buffer.append(row)
+        if len(self.buffer) >= self.flush_rows:
+            self.flush()
+
+    def add_rows(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.writer.writerows(self.buffer)
+        self.handle.flush()
+        if self.gz_handle is not None:
+            self.gz_writer.writerows(self.buffer)
+        if self.columns is not None:
+            for row in self.buffer:
+                for name, value in zip(RESULT_HEADER, row):
+                    self.columns[name].append(value)
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+
+    def progress(self, filepath, units, rows, done=False):
+        '''
+        Progress marker of filepath: write the buffered rows, then record in the manifest that its first units batches/reads are done
+        rows: number of rows of filepath written so far
+        '''
+        self.flush()
+        if self.manifest is not None:
+            self.manifest.mark(filepath, units, rows, done)
+
+    def drain(self, rows_queue):
+        '''
+        Write chunks of (rows, progress marker or None) from rows_queue until None is received, run on a thread of the main process
+        '''
+        while True:
+            item = rows_queue.get()
+            if item is None:
+                break
+            rows, progress = item
+            self.add_rows(rows)
+            if progress is not None:
+                self.progress(*progress)
+        self.flush()
+
+    def close(self):
+        self.flush()
+        self.handle.close()
+        if self.gz_handle is not None:
+            self.gz_handle.close()
+        if self.columns is not None:
+            np.savez_compressed(self.columnar_path(),
+                                file_number=np.array(self.columns['file_number'], dtype=str),
+                                phrase=np.array(self.columns['phrase'], dtype=np.int64),
+                                trc=np.array([float(trc) if trc != "" else np.nan for trc in self.columns['trc']], dtype=float),
+                                readID=np.array(self.columns['readID'], dtype=str),
+                                telo_length=np.array(self.columns['telo_length'], dtype=np.int64))
+
+class QueueRows:
+    '''
+    Result rows of a worker process, sent to the ResultSink in chunks through a (manager) queue, 
+    together with the latest progress marker
+    flush_every: seconds after which buffered rows are sent with a progress marker even if the chunk is not full
+    '''
+    def __init__(self, rows_queue, chunk_rows=CHUNK_ROWS, flush_every=2.0):
+        self.rows_queue = rows_queue
+        self.chunk_rows = chunk_rows
+        self.flush_every = flush_every
+        self.buffer = []
+        self.pending = None
+        self.last_flush = time.time()
+
+    def add(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= 2 * self.chunk_rows:
+            self.flush()
+
+    def progress(self, filepath, units, rows, done=False):
+        '''
+        Same as ResultSink.progress, sent with the next chunk of rows (right away when the file is done)
+        '''
+        self.pending = (filepath, units, rows, done)
+        if done or len(self.buffer) >= self.chunk_rows or time.time() - self.last_flush >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.buffer or self.pending is not None:
+            self.rows_queue.put((self.buffer, self.pending))
+            self.buffer = []
+            self.pending = None
+        self.last_flush = time.time()
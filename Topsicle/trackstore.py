@@ -0,0 +1,118 @@
+# Topsicle
+# store of the mean window tracks of step 2 (--trackstore): for every read end checked, its window positions and
+# mean window values, so plots, changepoint experiments or QC can load them without reading the fastq again.
+# per input there are two files in the output folder:
+#   <input name>.tracks.bin: float32 values, for each read end its positions then its mean values
+#   <input name>.tracks.idx: one read end per line: read id, k-mer length, tail, offset (in values), number of windows,
+#                            boundary point, maxlengthtelo
+# the values are read through np.memmap, so only the tracks that are used are loaded
+
+import os
+import numpy as np
+
+INDEX_COLUMNS = ["read_id", "kmer", "tail", "offset", "windows", "boundary", "maxlengthtelo"]
+
+def store_paths(output_dir, file_name):
+    '''
+    (values file, index file) of the track store of one input
+    '''
+    prefix = os.path.join(output_dir, f"{file_name}.tracks")
+    return prefix + ".bin", prefix + ".idx"
+
+class TrackWriter:
+    '''
+    Append mean window tracks of one input to its store
+    append: keep the tracks already in the store (resumed run), otherwise start a new store
+    '''
+    def __init__(self, output_dir, file_name, append=False):
+        self.bin_path, self.idx_path = store_paths(output_dir, file_name)
+        mode = "ab" if append and os.path.exists(self.idx_path) else "wb"
+        self.offset = self.truncate_store() if mode == "ab" else 0
+        self.values = open(self.bin_path, mode)
+        self.index = open(self.idx_path, mode[0])
+
+    def truncate_store(self):
+        '''
+        Drop what an interrupted run wrote after its last complete index line (a partial line, values no line points to),
+        so new tracks start right after the last indexed one
+        return: offset (in values) where the next track goes
+        '''
+        values_size = os.path.getsize(self.bin_path) // 4 if os.path.exists(self.bin_path) else 0
+        lines = []
+        end = 0
+        with open(self.idx_path) as handle:
+            for line in handle:
+                fields = line.split("\t")
+                if not line.endswith("\n") or len(fields) != len(INDEX_COLUMNS):
+                    break
+                track_end = int(fields[3]) + 2 * int(fields[4])
+                if track_end > values_size:
+                    break  # its values were not all written
+                lines.append(line)
+                end = max(end, track_end)
+        with open(self.idx_path, "w") as handle:
+            handle.writelines(lines)
+        with open(self.bin_path, "ab") as handle:
+            handle.truncate(4 * end)
+        return end
+
+    def add(self, kmer, track):
+        '''
+        track: (read id, tail, positions, mean values, boundary point, maxlengthtelo) from bound_detect_ends
+        '''
+        read_id, direction, x, y, telo_boundary_point, maxlengthtelo = track
+        self.values.write(np.asarray(x, dtype=np.float32).tobytes())
+        self.values.write(np.asarray(y, dtype=np.float32).tobytes())
+        self.index.write(f"{read_id}\t{kmer}\t{direction}\t{self.offset}\t{len(x)}\t{telo_boundary_point}\t{maxlengthtelo}\n")
+        self.offset += 2 * len(x)
+
+    def flush(self):
+        # values first, so an index line never points past the end of the values
+        self.values.flush()
+        self.index.flush()
+
+    def close(self):
+        self.flush()
+        self.values.close()
+        self.index.close()
+
+class Tracks:
+    '''
+    Track store of one input, loaded for reading (--trackstore output)
+    output_dir, file_name: where the store is, file_name is the input file name without extension, as in telolengths_all.csv
+    len(tracks), tracks[i]: read end i as (read id, tail, positions, mean values, boundary point, maxlengthtelo),
+    positions and values are float32 arrays backed by the memory map
+    '''
+    def __init__(self, output_dir, file_name):
+        bin_path, idx_path = store_paths(output_dir, file_name)
+        rows = {}
+        with open(idx_path) as handle:
+            for line in handle:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != len(INDEX_COLUMNS):
+                    continue  # last line of an interrupted run
+                # a read end computed again in a resumed run is kept once, the last time
+                rows[(fields[0], fields[1], fields[2])] = fields
+        rows = list(rows.values())
+        self.read_id = [row[0] for row in rows]
+        self.kmer = np.array([int(row[1]) for row in rows], dtype=np.int64)
+        self.tail = [row[2] for row in rows]
+        self.offset = np.array([int(row[3]) for row in rows], dtype=np.int64)
+        self.windows = np.array([int(row[4]) for row in rows], dtype=np.int64)
+        self.boundary = np.array([int(row[5]) for row in rows], dtype=np.int64)
+        self.maxlengthtelo = np.array([int(row[6]) for row in rows], dtype=np.int64)
+        self.values = np.memmap(bin_path, dtype=np.float32, mode="r") if os.path.getsize(bin_path) else np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.read_id)
+
+    def __getitem__(self, i):
+        start, n = self.offset[i], self.windows[i]
+        return (self.read_id[i], self.tail[i], self.values[start:start + n], self.values[start + n:start + 2 * n],
+                int(self.boundary[i]), int(self.maxlengthtelo[i]))
+
+    def find(self, read_id, kmer=None):
+        '''
+        Indexes of the read ends of read_id (for one k-mer length if given)
+        '''
+        return [i for i, rid in enumerate(self.read_id) if rid == read_id and (kmer is None or self.kmer[i] == kmer)]
@@ -0,0 +1,176 @@
+# Topsicle
+# per-read TRC cache: TRC only depends on the input, the pattern, the k-mer lengths, no_bp, the minimum read length and the scan mode,
+# so the TRC of both ends of every read is saved once in a small sidecar file (<input name>.<path hash>.trc.npz in the cache folder)
+# and a run with another cutoff, window or slide goes straight to step 2.
+# the cache is checked against the size and mtime of the input and the parameters, and recomputed if any changed.
+# with the TRC prefilter, reads that can not reach the cutoff of the run are not counted (their TRC is saved as nan),
+# so the cache serves runs with the same or a higher cutoff, a run with a lower cutoff counts every read again (--noprefilter caches the TRC of every read)
+
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+
+from Topsicle.allsteps import patternTRC_scores_stream, scan_patterns, trc_match
+from Topsicle.manifest import file_fingerprint
+
+CACHE_VERSION = 2
+NEWLINE = ord("\n")
+
+class GrowingArray:
+    '''
+    numpy array that values are added to one at a time, its capacity doubles when it is full,
+    so the TRC of every read is not kept in python lists
+    '''
+    def __init__(self, dtype, capacity=4096):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            grown = np.empty(2 * len(self.data), dtype=self.data.dtype)
+            grown[:self.size] = self.data
+            self.data = grown
+        self.data[self.size] = value
+        self.size += 1
+
+    def array(self):
+        return self.data[:self.size].copy()
+
+def cache_path(cache_dir, seq_loc):
+    '''
+    Location of the TRC cache of input seq_loc in cache_dir, named after the input and a hash of its absolute path
+    (inputs with the same name in different folders, e.g. barcode01/reads.fastq and barcode02/reads.fastq, get their own cache)
+    '''
+    base_name = os.path.basename(seq_loc)
+    path_hash = hashlib.sha1(os.path.abspath(seq_loc).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{os.path.splitext(base_name)[0]}.{path_hash}.trc.npz")
+
+def cache_meta(seq_loc, telopattern, no_bp, read_length, max_errors=None):
+    '''
+    What a cache must match to be used: input fingerprint and the parameters TRC depends on (k-mer lengths are checked separately),
+    max_errors is None for k-mer counting (caches written before --scanmode have no max_errors, they are k-mer caches)
+    '''
+    return {"version": CACHE_VERSION, "input": os.path.abspath(seq_loc), "fingerprint": file_fingerprint(seq_loc),
+            "pattern": telopattern, "no_bp": no_bp, "minSeqLength": read_length, "max_errors": max_errors}
+
+def load_trc_cache(path, seq_loc, telopattern, kmers, no_bp=1000, read_length=0, max_errors=None, prefilter_cutoff=None):
+    '''
+    Load a TRC cache if it is still valid for seq_loc, these parameters and all k-mer lengths in kmers
+    prefilter_cutoff: cutoff of the run, a cache made with a prefilter at a higher cutoff is not valid (None: the TRC of every read is needed)
+    return: dict like compute_trc_cache, or None
+    '''
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            expected = cache_meta(seq_loc, telopattern, no_bp, read_length, max_errors)
+            if {key: meta.get(key) for key in expected} != expected:
+                return None
+            if not set(kmers) <= set(meta["kmers"]):
+                return None
+            # reads under the prefilter cutoff were not counted, a lower cutoff needs them
+            if meta.get("prefilter_cutoff") is not None and (prefilter_cutoff is None or prefilter_cutoff < meta["prefilter_cutoff"]):
+                return None
+            cache = {"read_names": data["read_names"], "length": data["length"], "kmers": {}}
+            for kmer in kmers:
+                cache["kmers"][kmer] = {"forward": data[f"forward_{kmer}"], "reverse": data[f"reverse_{kmer}"], "best": data[f"best_{kmer}"],
+                                        "patterns": data[f"patterns_{kmer}"].tolist()}
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"TRC cache {path} can not be read ({e}), TRC is computed again")
+        return None
+    return cache
+
+def save_trc_cache(path, cache, meta):
+    '''
+    Save a cache from compute_trc_cache, written under a temporary name (of this process) and renamed so it is never half written
+    '''
+    arrays = {"meta": np.array(json.dumps({**meta, "kmers": list(cache["kmers"])})),
+              "read_names": cache["read_names"], "length": cache["length"]}
+    for kmer, scores in cache["kmers"].items():
+        arrays[f"forward_{kmer}"] = scores["forward"]
+        arrays[f"reverse_{kmer}"] = scores["reverse"]
+        arrays[f"best_{kmer}"] = scores["best"]
+        arrays[f"patterns_{kmer}"] = np.array(scores["patterns"], dtype=str)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as handle:
+        np.savez_compressed(handle, **arrays)
+    os.replace(tmp_path, path)
+
+def compute_trc_cache(seq_loc, telopattern, kmers, no_bp=1000, read_length=0, engine="numpy", batch_size=256, threads=None, max_errors=None,
+                      prefilter_cutoff=None):
+    '''
+    TRC of both ends of every read longer than read_length, for every k-mer length, in one pass over seq_loc
+    prefilter_cutoff: optional, reads that can not be over this cutoff are not counted, their TRC is nan
+    return: dict with "read_names" (read ids in file order, each followed by a newline, as a uint8 array, see read_name),
+            "length" (array) and "kmers": {k: {"forward", "reverse" (TRC arrays), "best" (index of the best k-mer of the end with the highest TRC),
+            "patterns" (k-mers, or repeat units with max_errors)}}
+    '''
+    # read ids go in one buffer and the scores in numpy arrays as the reads are counted, memory per read stays a few bytes
+    read_names = bytearray()
+    lengths = GrowingArray(np.int64)
+    columns = {kmer: (GrowingArray(float), GrowingArray(float), GrowingArray(np.int32)) for kmer in kmers}
+    for ends, scores in patternTRC_scores_stream(seq_loc, telopattern, kmers, read_length=read_length, no_bp=no_bp, engine=engine,
+                                                 batch_size=batch_size, threads=threads, max_errors=max_errors, prefilter_cutoff=prefilter_cutoff):
+        read_names += ends[0].encode() + b"\n"
+        lengths.append(ends[1])
+        for kmer, (trc_forward, trc_reverse, best) in scores.items():
+            columns[kmer][0].append(trc_forward)
+            columns[kmer][1].append(trc_reverse)
+            columns[kmer][2].append(best)
+
+    cache = {"read_names": np.frombuffer(read_names, dtype=np.uint8), "length": lengths.array(), "kmers": {}}
+    for kmer, (trc_forward, trc_reverse, best) in columns.items():
+        cache["kmers"][kmer] = {"forward": trc_forward.array(), "reverse": trc_reverse.array(), "best": best.array(),
+                                "patterns": scan_patterns(telopattern, kmer, max_errors)}
+    return cache
+
+def read_name(cache, ends, i):
+    '''
+    Id of read i of a cache
+    ends: positions of the newlines in cache["read_names"]
+    '''
+    start = int(ends[i - 1]) + 1 if i else 0
+    return cache["read_names"][start:ends[i]].tobytes().decode()
+
+def trc_cache(seq_loc, cache_dir, telopattern, kmers, no_bp=1000, read_length=0, engine="numpy", batch_size=256, threads=None, use_cache=True, max_errors=None,
+              prefilter_cutoff=None, save_cache=True):
+    '''
+    TRC of every read of seq_loc from its cache in cache_dir, computed and saved there if it is missing or out of date
+    use_cache: False to always compute TRC and not save it
+    save_cache: False to only read the cache, a TRC computed here does not replace it (a cache of other k-mer lengths stays as it is)
+    max_errors: optional, TRC of the repeat unit with up to max_errors errors (--scanmode approx), cached separately from k-mer TRC
+    prefilter_cutoff: optional, cutoff of the run, reads that can not be over it are not counted (see compute_trc_cache)
+    return: (dict from compute_trc_cache, True if it came from the cache)
+    '''
+    path = cache_path(cache_dir, seq_loc)
+    if use_cache:
+        cache = load_trc_cache(path, seq_loc, telopattern, kmers, no_bp, read_length, max_errors, prefilter_cutoff)
+        if cache is not None:
+            return cache, True
+
+    cache = compute_trc_cache(seq_loc, telopattern, kmers, no_bp, read_length, engine, batch_size, threads, max_errors, prefilter_cutoff)
+    if use_cache and save_cache:
+        save_trc_cache(path, cache, {**cache_meta(seq_loc, telopattern, no_bp, read_length, max_errors), "prefilter_cutoff": prefilter_cutoff})
+    return cache, False
+
+def cached_matches(cache, kmers, cutoff):
+    '''
+    Same as the matches of patternTRC_multi_stream, from a TRC cache
+    yield: (read id, {k: [read id, pattern, tail, TRC] or None}) of reads over cutoff for at least one k, in file order
+    '''
+    # reads over cutoff for any k, found on the arrays, then only those are turned into matches
+    over = np.zeros(len(cache["length"]), dtype=bool)
+    for kmer in kmers:
+        scores = cache["kmers"][kmer]
+        over |= np.maximum(scores["forward"], scores["reverse"]) > cutoff
+    ends = np.flatnonzero(cache["read_names"] == NEWLINE)
+    for i in np.flatnonzero(over).tolist():
+        read_id = read_name(cache, ends, i)
+        matches = {}
+        for kmer in kmers:
+            scores = cache["kmers"][kmer]
+            matches[kmer] = trc_match(read_id, scores["patterns"], (float(scores["forward"][i]), float(scores["reverse"][i]), int(scores["best"][i])), cutoff)
+        yield read_id, matches
@@ -0,0 +1,90 @@
+# Memory allocated per read while the read ends are extracted, on ultra-long reads (100-500 kb)
+# TRC and step 2 only use the first/last few kbp of each read, so extracting them should cost about one copy of the
+# sequence line (reading it) and not several (stripping, reversing and upper casing the whole read).
+# measures, with tracemalloc, the peak allocation of each read for:
+# - stream: fastreader.iter_ends on the fastq, as step 1 and --streaming read it
+# - fetch: allsteps.fetch_read_ends on the same reads by byte offset, as step 2 reads the subset file
+# - reference: the same ends with the whole line stripped, sliced and reversed (how the ends were extracted before)
+# python3 benchmarks/read_end_alloc.py --reads 50 --length 300000
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+PACKAGE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PACKAGE_ROOT)
+
+from benchmarks.synthetic_reads import generate
+from Topsicle.allsteps import fetch_read_ends, build_read_index
+from Topsicle.fastreader import iter_ends, title_id
+
+def reference_ends(path, span):
+    '''
+    Ends of every read of a 4 line fastq, with copies of the whole sequence and quality lines like before
+    yield: same as iter_ends
+    '''
+    with open(path, "rb") as handle:
+        for title in handle:
+            seq = handle.readline().rstrip()
+            handle.readline()
+            if len(handle.readline().rstrip()) != len(seq):
+                raise ValueError("Lengths of sequence and quality values differs")
+            yield (title_id(title[1:].rstrip()), len(seq), seq[:span].upper().decode("latin-1"), seq[::-1][:span].upper().decode("latin-1"))
+
+def allocation_per_read(ends):
+    '''
+    Peak bytes allocated while each item of ends is produced, and the total time
+    return: (array of peak bytes, one per read, seconds)
+    '''
+    peaks = []
+    iterator = iter(ends)
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        while True:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+            del item
+    finally:
+        seconds = time.perf_counter() - start
+        tracemalloc.stop()
+    return np.array(peaks, dtype=np.int64), seconds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Memory allocated per read while extracting read ends, on ultra-long reads')
+    parser.add_argument('--reads', type=int, help='Number of reads', default=50)
+    parser.add_argument('--length', type=int, help='Read length', default=300000)
+    parser.add_argument('--span', type=int, help='Base pairs kept at each end (maxlengthtelo)', default=20000)
+    parser.add_argument('--workdir', type=str, help='Folder for the generated reads (default: a temporary folder)')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="topsicle_alloc_")
+    os.makedirs(workdir, exist_ok=True)
+    path = os.path.join(workdir, "ultralong.fastq")
+    generate(path, args.reads * args.length, length_distribution="fixed", mean_length=args.length, min_length=args.length, seed=1)
+    build_read_index(path)
+    read_ids = [ends[0] for ends in iter_ends(path, 1)]
+
+    runs = {
+        "stream": lambda: iter_ends(path, args.span),
+        "fetch": lambda: fetch_read_ends(path, read_ids, args.span),
+        "reference": lambda: reference_ends(path, args.span),
+    }
+    results = {}
+    for name, ends in runs.items():
+        results[name] = list(ends())
+        peaks, seconds = allocation_per_read(ends())
+        print(f"{name:10s} {np.median(peaks) / 1e6:8.2f} MB per read (median), {peaks.max() / 1e6:8.2f} MB max, "
+              f"{np.median(peaks) / args.length:5.2f} bytes per base, {seconds:6.3f} s")
+    if not results["stream"] == results["fetch"] == results["reference"]:
+        print("warning: the read ends differ between the runs")
@@ -0,0 +1,245 @@
+# Benchmark suite of Topsicle on synthetic reads with known telomere lengths (benchmarks/synthetic_reads.py)
+# - time of each stage on its own: parse (read ends), TRC (step 1), windowing and changepoint (step 2), csv output, plotting
+# - wall time of the whole topsicle command for each --threads value, to see how it scales
+# - accuracy of the telomere lengths of that run against the known lengths
+# results are saved as JSON; with --baseline an earlier result is compared and the run fails (exit 1) on a regression:
+# python3 benchmarks/run_benchmarks.py --size 20MB --threads 1 2 4 --save benchmarks/baseline.json
+# python3 benchmarks/run_benchmarks.py --size 20MB --threads 1 2 4 --baseline benchmarks/baseline.json
+
+import argparse
+import csv
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+PACKAGE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PACKAGE_ROOT)
+
+from benchmarks.synthetic_reads import generate, load_truth, parse_size
+from Topsicle.allsteps import trc_counters, trc_kmers, patterns_to_search, pattern_table, window_counts, window_means
+from Topsicle.changepoint import changepoints
+from Topsicle.fastreader import iter_ends
+from Topsicle.sink import ResultSink
+
+# a stage is a regression when it is slower than the baseline by more than the tolerance (and by more than MIN_SECONDS,
+# so stages that take milliseconds do not fail on noise)
+MIN_SECONDS = 0.05
+
+def timed(func, repeat):
+    '''
+    Best time in seconds of func() over repeat runs, and its result (of the last run)
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def stage_times(path, args, output_dir):
+    '''
+    Time each stage of Topsicle on its own, with the same defaults as the topsicle command
+    return: (dict of stage -> seconds, dict of counts of what each stage processed)
+    '''
+    kmer = len(args.pattern) - 2
+    no_bp = 1000
+    span = max(no_bp, args.maxlengthtelo)
+    slide = len(args.pattern)
+    times = {}
+
+    times["parse"], ends = timed(lambda: list(iter_ends(path, span, read_length=args.minSeqLength)), args.repeat)
+
+    # step 1, TRC of the first/last no_bp of every read, in batches like patternTRC_count
+    counters = trc_counters(args.pattern, [kmer])
+    ratio_perfect_hit = no_bp / len(args.pattern)
+    def trc():
+        matches = []
+        for i in range(0, len(ends), 256):
+            batch = ends[i:i + 256]
+            matches.extend(trc_kmers([item[0] for item in batch], [item[2][:no_bp] for item in batch], [item[3][:no_bp] for item in batch],
+                                     counters, ratio_perfect_hit, args.cutoff)[kmer])
+        return matches
+    times["trc"], matches = timed(trc, args.repeat)
+    hits = [(item, match[2]) for item, match in zip(ends, matches) if match is not None]
+
+    # step 2, window counts and means of the read ends over the cutoff, then their changepoint
+    compiled = [re.compile(pattern) for pattern in patterns_to_search(args.pattern, cut_length=kmer)]
+    table = pattern_table(compiled)
+    def windowing():
+        tracks = []
+        for (read_id, length, seq_start, seq_end), tail in hits:
+            maxlengthtelo = min(length, args.maxlengthtelo)
+            for direction, seq in (("forward", seq_start), ("reverse", seq_end)):
+                if tail != direction:
+                    continue
+                means = window_means(*window_counts(seq[args.trimfirst:maxlengthtelo], compiled, args.windowSize, slide, table=table))
+                tracks.append((read_id, [mean for start, mean in means if start + args.trimfirst <= maxlengthtelo]))
+        return tracks
+    times["windowing"], tracks = timed(windowing, args.repeat)
+    times["changepoint"], _ = timed(lambda: [changepoints(y, n_bkps=1) for read_id, y in tracks if y], args.repeat)
+
+    # csv output of one row per read end, through the same writer as the topsicle command
+    rows = [["benchmark", kmer, "0.900", read_id, 1000] for read_id, y in tracks] * 10
+    def output():
+        sink = ResultSink(os.path.join(output_dir, "stage_output.csv"), kept_rows=[])
+        sink.add_rows(rows)
+        sink.close()
+    times["csv_output"], _ = timed(output, args.repeat)
+
+    counts = {"reads": len(ends), "trc_hits": len(hits), "read_ends": len(tracks), "csv_rows": len(rows), "plots": 0}
+    if args.plots:
+        from Topsicle.render import render_plots
+        jobs = []
+        for i, (read_id, y) in enumerate(tracks[:args.plots]):
+            x = [args.trimfirst + slide * j for j in range(len(y))]
+            jobs.append((os.path.join(output_dir, f"stage_plot_{i}.png"), kmer, (read_id, "forward", x, y, x[len(x) // 2], args.maxlengthtelo), None))
+        times["plotting"], counts["plots"] = timed(lambda: render_plots(jobs), 1)
+    return times, counts
+
+def run_topsicle(path, pattern, threads, output_dir, extra_args):
+    '''
+    Wall time of the whole topsicle command on path with threads cores
+    return: (seconds, path of telolengths_all.csv)
+    '''
+    command = [sys.executable, "-m", "Topsicle.main", "-i", path, "-o", output_dir, "--pattern", pattern, "-t", str(threads), "--override"] + extra_args
+    start = time.perf_counter()
+    subprocess.run(command, cwd=PACKAGE_ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start, os.path.join(output_dir, "telolengths_all.csv")
+
+def accuracy(result_csv, truth):
+    '''
+    Telomere lengths of result_csv against the known lengths, on the first row of each read
+    return: dict of accuracy measures
+    '''
+    found = {}
+    with open(result_csv, newline='') as handle:
+        for row in csv.DictReader(handle):
+            found.setdefault(row["readID"], int(row["telo_length"]))
+
+    telomeric = {read_id: length for read_id, (tail, length) in truth.items() if tail != "none"}
+    detected = {read_id: found[read_id] for read_id in telomeric if found.get(read_id, 0) > 0}
+    errors = np.array([detected[read_id] - telomeric[read_id] for read_id in detected], dtype=float)
+    false_positives = sum(1 for read_id, (tail, length) in truth.items() if tail == "none" and found.get(read_id, 0) > 0)
+    return {
+        "telomeric_reads": len(telomeric),
+        "detected_fraction": len(detected) / len(telomeric) if telomeric else 0.0,
+        "false_positive_reads": false_positives,
+        "median_abs_error_bp": float(np.median(np.abs(errors))) if len(errors) else None,
+        "mean_error_bp": float(errors.mean()) if len(errors) else None,
+        "within_10_percent": float(np.mean(np.abs(errors) <= 0.1 * np.array([telomeric[read_id] for read_id in detected]))) if len(errors) else None,
+    }
+
+def regressions(result, baseline, tolerance):
+    '''
+    Differences of result from baseline beyond tolerance (fraction)
+    return: list of messages, empty if there is no regression
+    '''
+    messages = []
+    def slower(name, new, old):
+        if old is not None and new is not None and new > old * (1 + tolerance) and new - old > MIN_SECONDS:
+            messages.append(f"{name}: {new:.3f} s, baseline {old:.3f} s")
+    for stage, seconds in result["stages"].items():
+        slower(f"stage {stage}", seconds, baseline.get("stages", {}).get(stage))
+    for threads, seconds in result["threads"].items():
+        slower(f"topsicle --threads {threads}", seconds, baseline.get("threads", {}).get(threads))
+
+    new, old = result["accuracy"], baseline.get("accuracy", {})
+    if old.get("detected_fraction") is not None and new["detected_fraction"] < old["detected_fraction"] - tolerance / 10:
+        messages.append(f"detected fraction {new['detected_fraction']:.3f}, baseline {old['detected_fraction']:.3f}")
+    if old.get("median_abs_error_bp") is not None and new["median_abs_error_bp"] is not None \
+            and new["median_abs_error_bp"] > old["median_abs_error_bp"] * (1 + tolerance) + 10:
+        messages.append(f"median absolute error {new['median_abs_error_bp']:.0f} bp, baseline {old['median_abs_error_bp']:.0f} bp")
+    return messages
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PACKAGE_ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark Topsicle on synthetic reads with known telomere lengths')
+    parser.add_argument('--input', type=str, help='Reads made by synthetic_reads.py (with their .truth.tsv), instead of generating them')
+    parser.add_argument('--workdir', type=str, help='Folder for the generated reads and topsicle outputs (default: a temporary folder)')
+    parser.add_argument('--size', type=str, help='Amount of sequence to generate, e.g. 20MB or 10GB', default="20MB")
+    parser.add_argument('--format', type=str, choices=["fastq", "fastq.gz", "fasta"], help='Format of the generated reads', default="fastq")
+    parser.add_argument('--pattern', type=str, help='Telomere repeat', default="CCCTAAA")
+    parser.add_argument('--error', type=float, help='Error rate in the generated telomeres', default=0.05)
+    parser.add_argument('--lengths', type=str, choices=["lognormal", "uniform", "fixed"], help='Read length distribution', default="lognormal")
+    parser.add_argument('--seed', type=int, help='Random seed of the generated reads', default=1)
+    parser.add_argument('--threads', nargs='+', type=int, help='--threads values of the whole topsicle runs', default=[1])
+    parser.add_argument('--topsicle_args', type=str, help='Extra arguments of the topsicle runs, e.g. --topsicle_args="--streaming"', default="")
+    parser.add_argument('--repeat', type=int, help='Runs of each stage, the best time is kept', default=3)
+    parser.add_argument('--plots', type=int, help='Number of plots drawn in the plotting stage (0 to skip it)', default=10)
+    parser.add_argument('--save', type=str, help='Save the results to this JSON file')
+    parser.add_argument('--baseline', type=str, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, help='Allowed slowdown against the baseline, as a fraction', default=0.25)
+    # same defaults as the topsicle command
+    parser.add_argument('--minSeqLength', type=int, default=9000, help=argparse.SUPPRESS)
+    parser.add_argument('--cutoff', type=float, default=0.7, help=argparse.SUPPRESS)
+    parser.add_argument('--windowSize', type=int, default=100, help=argparse.SUPPRESS)
+    parser.add_argument('--trimfirst', type=int, default=100, help=argparse.SUPPRESS)
+    parser.add_argument('--maxlengthtelo', type=int, default=20000, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="topsicle_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    if args.input:
+        path = args.input
+        data = {"input": path, "bytes": os.path.getsize(path)}
+    else:
+        path = os.path.join(workdir, f"synthetic.{args.format}")
+        start = time.perf_counter()
+        truth_path, n_reads, bases = generate(path, parse_size(args.size), pattern=args.pattern, error_rate=args.error,
+                                              length_distribution=args.lengths, seed=args.seed)
+        data = {"size": args.size, "format": args.format, "pattern": args.pattern, "error": args.error, "lengths": args.lengths,
+                "seed": args.seed, "reads": n_reads, "bases": bases, "bytes": os.path.getsize(path)}
+        print(f"generated {n_reads} reads ({bases} bp) in {time.perf_counter() - start:.1f} s")
+    truth = load_truth(f"{path}.truth.tsv")
+
+    stages, counts = stage_times(path, args, workdir)
+    for stage, seconds in stages.items():
+        print(f"{stage:12s} {seconds:8.3f} s")
+
+    threads = {}
+    result_csv = None
+    for n in args.threads:
+        seconds, run_csv = run_topsicle(path, args.pattern, n, os.path.join(workdir, f"topsicle_t{n}"), args.topsicle_args.split())
+        threads[str(n)] = seconds
+        result_csv = result_csv or run_csv
+        print(f"topsicle --threads {n}: {seconds:.2f} s")
+    scores = accuracy(result_csv, truth)
+    print("accuracy:", ", ".join(f"{name} {value:.3f}" if isinstance(value, float) else f"{name} {value}" for name, value in scores.items()))
+
+    result = {
+        "meta": {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": git_commit(), "python": platform.python_version(),
+                 "numpy": np.__version__, "platform": platform.platform(), "cpus": os.cpu_count(), "topsicle_args": args.topsicle_args},
+        "data": data,
+        "counts": counts,
+        "stages": stages,
+        "throughput_mb_s": {stage: data["bytes"] / 1e6 / seconds for stage, seconds in stages.items() if stage in ("parse", "trc") and seconds > 0},
+        "threads": threads,
+        "speedup": {n: threads[str(args.threads[0])] / seconds for n, seconds in threads.items()},
+        "accuracy": scores,
+    }
+    if args.save:
+        with open(args.save, "w") as handle:
+            json.dump(result, handle, indent=2)
+        print("results saved to", args.save)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        if baseline.get("data", {}).get("bytes") != data["bytes"]:
+            print("warning: the baseline was measured on other data, times are not comparable")
+        found = regressions(result, baseline, args.tolerance)
+        for message in found:
+            print("REGRESSION", message)
+        sys.exit(1 if found else 0)
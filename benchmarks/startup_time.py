@@ -0,0 +1,60 @@
+# Startup time check of the topsicle command line
+# measures, in fresh python processes, how long importing Topsicle.main and running "topsicle --help" take,
+# and checks that the heavy plotting / parsing packages are not imported on that path.
+# exits with 1 if the startup is over budget, so it can run in CI or before a release:
+# python3 benchmarks/startup_time.py --budget 0.8
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# packages that should only be imported when a code path needs them
+HEAVY_MODULES = ["pandas", "Bio", "matplotlib", "seaborn", "scipy", "ruptures"]
+PACKAGE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def run_time(command, repeat):
+    '''
+    Median wall time in seconds of running command (list) repeat times
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=PACKAGE_ROOT, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def heavy_imports():
+    '''
+    Heavy packages that are imported by "import Topsicle.main"
+    '''
+    code = f"import sys, Topsicle.main; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=PACKAGE_ROOT, check=True, capture_output=True, text=True).stdout
+    return output.split()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the startup time of the topsicle command line')
+    parser.add_argument('--budget', type=float, help='Maximum median time in seconds of "topsicle --help"', default=1.0)
+    parser.add_argument('--repeat', type=int, help='Number of runs of each measurement', default=5)
+    args = parser.parse_args()
+
+    baseline = run_time([sys.executable, "-c", "pass"], args.repeat)
+    import_time = run_time([sys.executable, "-c", "import Topsicle.main"], args.repeat)
+    help_time = run_time([sys.executable, "-m", "Topsicle.main", "--help"], args.repeat)
+    heavy = heavy_imports()
+
+    print(f"python startup:        {baseline:.3f} s")
+    print(f"import Topsicle.main:  {import_time:.3f} s")
+    print(f"topsicle --help:       {help_time:.3f} s (budget {args.budget:.3f} s)")
+    print(f"heavy imports:         {', '.join(heavy) if heavy else 'none'}")
+
+    failed = False
+    if help_time > args.budget:
+        print("FAIL: topsicle --help is over the startup budget")
+        failed = True
+    if heavy:
+        print(f"FAIL: {', '.join(heavy)} imported at startup, import them where they are used")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,153 @@
+# Synthetic long reads with known telomeres, for the benchmarks
+# each read is random sequence, with a telomere of known length (repeats of the pattern with errors) at its start
+# (pattern as given, "forward" tail) or at its end (reverse complement, "reverse" tail), or no telomere.
+# writes the reads (fasta or fastq, .gz if the name ends with .gz) and a truth table <output>.truth.tsv:
+# read id, read length, tail (forward / reverse / none), telomere length
+# python3 benchmarks/synthetic_reads.py -o reads.fastq --size 50MB --pattern CCCTAAA --error 0.05
+
+import argparse
+import gzip
+import os
+import re
+import numpy as np
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+COMPLEMENT = bytes.maketrans(b"ACGT", b"TGCA")
+SIZE_UNITS = {"": 1, "B": 1, "KB": 10**3, "MB": 10**6, "GB": 10**9, "TB": 10**12}
+
+def parse_size(size):
+    '''
+    Number of bytes in a size like 500MB, 20GB or 1000000
+    '''
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?B?)\s*", size.upper())
+    if match is None:
+        raise ValueError(f"Unknown size: {size}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+def read_lengths(rng, n, distribution, mean_length, sd_length, min_length):
+    '''
+    n read lengths: "lognormal" with mean_length and sd_length, "uniform" between min_length and 2 * mean_length - min_length,
+    or "fixed" (all mean_length), none shorter than min_length
+    '''
+    if distribution == "lognormal":
+        sigma2 = np.log(1 + (sd_length / mean_length) ** 2)
+        lengths = rng.lognormal(np.log(mean_length) - sigma2 / 2, np.sqrt(sigma2), n)
+    elif distribution == "uniform":
+        lengths = rng.uniform(min_length, max(min_length, 2 * mean_length - min_length), n)
+    elif distribution == "fixed":
+        lengths = np.full(n, mean_length)
+    else:
+        raise ValueError(f"Unknown read length distribution: {distribution}")
+    return np.maximum(lengths.astype(np.int64), min_length)
+
+def add_errors(rng, seq, error_rate):
+    '''
+    Substitutions, deletions and insertions (each a third of error_rate) in seq (uint8 array of ACGT)
+    '''
+    if error_rate <= 0:
+        return seq
+    kind = rng.random(len(seq))
+    seq = seq.copy()
+    substituted = kind < error_rate / 3
+    seq[substituted] = BASES[rng.integers(0, 4, int(substituted.sum()))]
+    deleted = (kind >= error_rate / 3) & (kind < 2 * error_rate / 3)
+    inserted = (kind >= 2 * error_rate / 3) & (kind < error_rate)
+    # an inserted base goes after the base it is drawn for
+    insert_at = np.flatnonzero(inserted) + 1
+    seq = np.insert(seq, insert_at, BASES[rng.integers(0, 4, len(insert_at))])
+    keep = np.ones(len(seq), dtype=bool)
+    keep[np.flatnonzero(deleted) + np.searchsorted(insert_at, np.flatnonzero(deleted), side="right")] = False
+    return seq[keep]
+
+def telomere(rng, pattern, length, error_rate):
+    '''
+    length bp of repeats of pattern (starting at a random phase), with errors
+    '''
+    unit = np.frombuffer(pattern.encode(), dtype=np.uint8)
+    phase = int(rng.integers(0, len(unit)))
+    repeats = np.resize(np.roll(unit, -phase), length)
+    return add_errors(rng, repeats, error_rate)
+
+def synthetic_read(rng, length, pattern, tail, telomere_length, error_rate):
+    '''
+    One read of about length bp (errors change the telomere length a little), as bytes
+    return: (sequence, telomere length in the read)
+    '''
+    if tail == "none" or telomere_length == 0:
+        return BASES[rng.integers(0, 4, length)].tobytes(), 0
+    repeats = telomere(rng, pattern, min(telomere_length, length), error_rate).tobytes()
+    body = BASES[rng.integers(0, 4, max(0, length - len(repeats)))].tobytes()
+    if tail == "forward":
+        return repeats + body, len(repeats)
+    return body + repeats[::-1].translate(COMPLEMENT), len(repeats)
+
+def generate(output, size, pattern="CCCTAAA", error_rate=0.05, length_distribution="lognormal", mean_length=25000, sd_length=10000,
+             min_length=10000, telomere_min=500, telomere_max=10000, telomeric_fraction=0.7, seed=1, fastq=None):
+    '''
+    Write synthetic reads to output until about size bytes of sequence, and their truth table
+    fastq: write fastq (default: from the output name)
+    telomeric_fraction: fraction of reads with a telomere, half of them at each end
+    return: (path of the truth table, number of reads, bases written)
+    '''
+    rng = np.random.default_rng(seed)
+    fastq = ".fastq" in output or ".fq" in output if fastq is None else fastq
+    opener = (lambda path: gzip.open(path, "wb", compresslevel=1)) if output.endswith(".gz") else (lambda path: open(path, "wb"))
+    truth_path = f"{output}.truth.tsv"
+    n_reads, bases = 0, 0
+    with opener(output) as handle, open(truth_path, "w") as truth:
+        truth.write("read_id\tlength\ttail\ttelomere_length\n")
+        while bases < size:
+            # reads are drawn 1000 at a time, which keeps the numpy calls large without holding much in memory
+            lengths = read_lengths(rng, 1000, length_distribution, mean_length, sd_length, min_length)
+            draws = rng.random(1000)
+            telomere_lengths = rng.integers(telomere_min, telomere_max + 1, 1000)
+            for length, draw, telomere_length in zip(lengths.tolist(), draws.tolist(), telomere_lengths.tolist()):
+                if bases >= size:
+                    break
+                tail = "none" if draw >= telomeric_fraction else ("forward" if draw < telomeric_fraction / 2 else "reverse")
+                seq, telomere_length = synthetic_read(rng, length, pattern, tail, telomere_length, error_rate)
+                read_id = f"synthetic_{n_reads}"
+                if fastq:
+                    handle.write(b"@%s\n%s\n+\n%s\n" % (read_id.encode(), seq, b"I" * len(seq)))
+                else:
+                    lines = b"\n".join(seq[i:i + 80] for i in range(0, len(seq), 80))
+                    handle.write(b">%s\n%s\n" % (read_id.encode(), lines))
+                truth.write(f"{read_id}\t{len(seq)}\t{tail if telomere_length else 'none'}\t{telomere_length}\n")
+                n_reads += 1
+                bases += len(seq)
+    return truth_path, n_reads, bases
+
+def load_truth(truth_path):
+    '''
+    Truth table of generate: dict of read id -> (tail, telomere length)
+    '''
+    truth = {}
+    with open(truth_path) as handle:
+        next(handle)
+        for line in handle:
+            read_id, length, tail, telomere_length = line.rstrip("\n").split("\t")
+            truth[read_id] = (tail, int(telomere_length))
+    return truth
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate synthetic long reads with known telomere lengths')
+    parser.add_argument('-o', '--output', type=str, help='Output fasta / fastq (.gz for gzip), a truth table is written next to it', required=True)
+    parser.add_argument('--size', type=str, help='Amount of sequence, e.g. 100MB or 20GB', default="50MB")
+    parser.add_argument('--pattern', type=str, help='Telomere repeat', default="CCCTAAA")
+    parser.add_argument('--error', type=float, help='Error rate in the telomere (substitutions, insertions, deletions)', default=0.05)
+    parser.add_argument('--lengths', type=str, choices=["lognormal", "uniform", "fixed"], help='Read length distribution', default="lognormal")
+    parser.add_argument('--meanlength', type=int, help='Mean read length', default=25000)
+    parser.add_argument('--sdlength', type=int, help='Standard deviation of the read length (lognormal)', default=10000)
+    parser.add_argument('--minlength', type=int, help='Minimum read length (topsicle skips reads under --minSeqLength, 9000 by default)', default=10000)
+    parser.add_argument('--telomin', type=int, help='Minimum telomere length', default=500)
+    parser.add_argument('--telomax', type=int, help='Maximum telomere length', default=10000)
+    parser.add_argument('--telofraction', type=float, help='Fraction of reads with a telomere', default=0.7)
+    parser.add_argument('--seed', type=int, help='Random seed', default=1)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    truth_path, n_reads, bases = generate(args.output, parse_size(args.size), pattern=args.pattern, error_rate=args.error,
+                                          length_distribution=args.lengths, mean_length=args.meanlength, sd_length=args.sdlength,
+                                          min_length=args.minlength, telomere_min=args.telomin, telomere_max=args.telomax,
+                                          telomeric_fraction=args.telofraction, seed=args.seed)
+    print(f"{n_reads} reads, {bases} bp written to {args.output}, truth in {truth_path}")
@@ -24,6 +24,7 @@ colors = sns.color_palette("colorblind",n_colors=30)
 
 from Topsicle.descriptive_plot import *
 from Topsicle.allsteps import *
+from Topsicle.trccache import trc_cache, cached_matches
 
 sns.set_style("whitegrid", {'grid.color': 'grey', 'grid.linestyle': '--'})
 
@@ -59,8 +60,13 @@ def plot_running(args):
     
     filtered_files = []
     for seq_loc in filenames:
-        # Get reads with TRC above cutoff
-        trc_results = patternTRC_count(seq_loc, telopattern=args.pattern, read_length=args.minSeqLength, kmer=telo_phrases[0], no_bp=1000,cutoff=0.7)
+        # Get reads with TRC above cutoff, from the TRC cache of a topsicle run when there is one.
+        # the cache is only read here, saving the TRC of this one k-mer length would replace a cache of all the k-mer lengths of that run
+        cache, cached = trc_cache(seq_loc, args.cachedir or args.outputDir, args.pattern, telo_phrases[:1], no_bp=1000, read_length=args.minSeqLength,
+                                  prefilter_cutoff=0.7, save_cache=False)
+        if cached:
+            tprint(f"TRC of {seq_loc} loaded from cache")
+        trc_results = [matches[telo_phrases[0]] for read_id, matches in cached_matches(cache, telo_phrases[:1], 0.7)]
         if trc_results and len(trc_results) > 0:
             # Get read IDs to keep
             read_ids_to_keep = set([row[0] for row in trc_results])
@@ -131,6 +137,7 @@ if __name__ == "__main__":
     parser.add_argument('--telophrase', nargs='+', type=int, help='Length of telomere k-mer to search. By default will use telomere k-mer length minus 2')
     parser.add_argument('--recfindingpattern', action='store_true', help='Optional, use this to plot the heatmap of patterns vs match')
     parser.add_argument('--rawcount', action='store_true', help='Optional, save raw count results to CSV for flexibility of plotting')
+    parser.add_argument('--cachedir', type=str, help='Optional, folder of the per-read TRC cache, e.g. the outputDir of a topsicle run on the same input. By default outputDir')
 
 
     # Parse the command line arguments
@@ -0,0 +1,20 @@
+# Topsicle
+# startup of the topsicle command line, same checks as benchmarks/startup_time.py:
+# import Topsicle.main must not import the heavy plotting / parsing packages, and topsicle --help must stay under the budget
+# python3 -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from startup_time import heavy_imports, run_time
+
+# seconds, median of the runs of "topsicle --help", same default as startup_time.py --budget
+HELP_BUDGET = 1.0
+
+def test_no_heavy_imports():
+    assert heavy_imports() == []
+
+def test_help_time():
+    help_time = run_time([sys.executable, "-m", "Topsicle.main", "--help"], 3)
+    assert help_time <= HELP_BUDGET, f"topsicle --help took {help_time:.3f} s, budget {HELP_BUDGET} s"